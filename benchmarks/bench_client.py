@@ -0,0 +1,168 @@
+""" Benchmark the client's hot paths offline, and check for regressions.
+
+Replays the recorded interactions in `tests/cassettes` (see
+`pyns.testing.replay`) to time request handling, path building, the
+`get` decorator chain and upload filtering, and runs a local synthetic
+API server (see `pyns.testing.server`) to time name to id conversion,
+entity enrichment in `to_df`, and `fetch_predictors` end to end.
+`--scale` multiplies recorded list responses and the synthetic dataset.
+
+Results are compared with, or saved as, a JSON baseline, along with the
+machine they were run on. Baselines are machine specific: save one before
+upgrading pyns, then compare on the same machine.
+(`baselines/bench_client.json` is an example, recorded on the machine
+described in its `meta`.)
+
+Usage:
+    python benchmarks/bench_client.py [--scale 1] [--repeat 5]
+        [--save baseline.json | --compare baseline.json [--tolerance 0.3]]
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+from pathlib import Path
+
+from pyns import Neuroscout
+from pyns.fetch_utils import fetch_predictors
+from pyns.testing import NeuroscoutServer, SyntheticData
+from pyns.testing.replay import ReplayAdapter, load_cassettes
+
+CASSETTES = Path(__file__).parent.parent / 'tests' / 'cassettes'
+
+# Recorded predictor events request (tests/cassettes/predictor_events.json)
+EVENT_RUNS = [1433, 1434, 1435, 1436, 1437]
+EVENT_PREDICTORS = [37968, 37993]
+
+
+def measure(func, repeat, number=1):
+    """ Time (s) per call of `func`, over `repeat` rounds of `number`
+    calls """
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        times.append((time.perf_counter() - start) / number)
+    return {'min': min(times), 'median': statistics.median(times)}
+
+
+def replay_cases(scale):
+    """ Cases replaying recorded responses """
+    adapter = ReplayAdapter(load_cassettes([CASSETTES], scale=scale))
+    api = Neuroscout(cache=False, retries=0)
+    api._session.mount('https://', adapter)
+    url = api._build_path('datasets')
+
+    return {
+        'session_get': (lambda: api._session.get(url).content, 200),
+        'make_request': (lambda: api._get('datasets'), 200),
+        'build_path': (
+            lambda: api._build_path('analyses', id='abcde',
+                                    sub_route='report'), 10000),
+        'get_chain': (
+            lambda: api.runs.get(dataset_id=5, task_id=4), 200),
+        'to_df_records': (
+            lambda: api.predictor_events.get(
+                run_id=EVENT_RUNS, predictor_id=EVENT_PREDICTORS,
+                output_type='df', resolve_ids=False), 20),
+        'get_uploads': (
+            lambda: api.analyses.get_uploads('gbp6i', select=None), 200),
+    }
+
+
+def synthetic_cases(server, scale):
+    """ Cases requesting a local synthetic API server """
+    api = Neuroscout(email='user@example.com', password='password',
+                     api_base_url=server.url)
+    names = ['predictor_%03d' % i for i in range(min(4 * scale, 20))]
+    subjects = ['%03d' % i for i in range(1, 2 + scale)]
+
+    def events(output_type):
+        return api.predictor_events.get(
+            predictor_name=names, dataset_name='Synthetic',
+            subject=subjects, output_type=output_type)
+
+    return {
+        'names_to_ids': (lambda: events('json'), 5),
+        'id_to_entities': (lambda: events('df'), 5),
+        'fetch_predictors': (
+            lambda: fetch_predictors(
+                names, 'Synthetic', api=api, engine='numpy',
+                subject=subjects), 2),
+    }
+
+
+def compare(results, baseline, tolerance):
+    """ Print results relative to a baseline. Returns the names of cases
+    slower than the baseline by more than `tolerance` """
+    regressions = []
+    for name, result in results.items():
+        base = baseline['results'].get(name)
+        if base is None:
+            print('{:>18} {:>12.6f}s {:>9}'.format(
+                name, result['min'], 'new'))
+            continue
+        # Minimum times are the least affected by other load
+        ratio = result['min'] / base['min']
+        flag = ratio > 1 + tolerance
+        if flag:
+            regressions.append(name)
+        print('{:>18} {:>12.6f}s {:>8.2f}x{}'.format(
+            name, result['min'], ratio, '  REGRESSION' if flag else ''))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument('--scale', type=int, default=1,
+                        help='Scale of recorded responses and synthetic '
+                        'dataset')
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='Rounds to time each case for')
+    parser.add_argument('--save', type=Path, help='Save a baseline')
+    parser.add_argument('--compare', type=Path,
+                        help='Compare with a baseline')
+    parser.add_argument('--tolerance', type=float, default=0.3,
+                        help='Slowdown relative to the baseline to fail on')
+    args = parser.parse_args()
+
+    data = SyntheticData(n_runs=16 * args.scale, n_predictors=50 * args.scale,
+                         events_per_run=100, run_duration=300.)
+    with NeuroscoutServer(data) as server:
+        cases = dict(replay_cases(args.scale),
+                     **synthetic_cases(server, args.scale))
+        results = {}
+        for name, (func, number) in cases.items():
+            func()  # Warm up (imports, connections)
+            results[name] = measure(func, args.repeat, number)
+
+    if args.compare:
+        baseline = json.loads(args.compare.read_text())
+        if baseline['meta']['scale'] != args.scale:
+            sys.exit("Baseline was run at scale {}".format(
+                baseline['meta']['scale']))
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            sys.exit("Regressions: {}".format(', '.join(regressions)))
+    else:
+        for name, result in results.items():
+            print('{:>18} {:>12.6f}s'.format(name, result['min']))
+
+    if args.save:
+        args.save.parent.mkdir(parents=True, exist_ok=True)
+        args.save.write_text(json.dumps({
+            'meta': {'scale': args.scale, 'repeat': args.repeat,
+                     'python': platform.python_version(),
+                     'machine': platform.machine(),
+                     'platform': platform.platform(),
+                     'cpus': os.cpu_count()},
+            'results': results}, indent=2) + '\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+""" Benchmark compact dtypes for predictor event frames.
+
+Compares memory use and grouping time of a frame as built by `to_df`
+with the same frame after `pyns.endpoints.base._compact_df`, on
+synthetic events for a grid of runs x predictors.
+
+Usage:
+    python benchmarks/bench_compact.py [--events 100]
+"""
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+from pyns.endpoints.base import _compact_df
+
+
+def make_events(n_runs, n_predictors, n_events):
+    """ Synthetic predictor events, as returned by `to_df` """
+    rng = np.random.default_rng(0)
+    n = n_runs * n_predictors * n_events
+    run_id = np.repeat(np.arange(n_runs), n_predictors * n_events)
+    predictor_id = np.tile(np.repeat(np.arange(n_predictors), n_events),
+                           n_runs)
+    return pd.DataFrame({
+        'run_id': run_id,
+        'predictor_id': predictor_id,
+        'onset': rng.uniform(0, 600, n).round(2),
+        'duration': 1.0,
+        'value': rng.normal(size=n).round(6).astype(str).astype(object),
+        'subject': pd.Series((run_id // 2).astype(str), dtype=object),
+        'session': None,
+        'number': run_id % 2 + 1,
+        'acquisition': None,
+        'predictor_name': pd.Series(
+            ['pred_%d' % p for p in predictor_id], dtype=object),
+    })
+
+
+def _group_time(df):
+    start = time.perf_counter()
+    df.groupby(['subject', 'predictor_name'], observed=True).onset.mean()
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--events', type=int, default=100,
+                        help='Events per run and predictor')
+    args = parser.parse_args()
+
+    print('{:>6} {:>6} {:>10} {:>10} {:>10} {:>7} {:>9} {:>9}'.format(
+        'runs', 'preds', 'rows', 'plain MB', 'compact MB', 'ratio',
+        'plain gb', 'comp gb'))
+    for n_runs, n_predictors in [(10, 10), (50, 50), (100, 100)]:
+        df = make_events(n_runs, n_predictors, args.events)
+        plain = df.memory_usage(deep=True).sum() / 2 ** 20
+        plain_group = _group_time(df)
+        df = _compact_df(df)
+        compact = df.memory_usage(deep=True).sum() / 2 ** 20
+        print('{:>6} {:>6} {:>10} {:>10.1f} {:>10.1f} {:>6.2f} {:>8.3f}s '
+              '{:>8.3f}s'.format(
+                  n_runs, n_predictors, len(df), plain, compact,
+                  compact / plain, plain_group, _group_time(df)))
+
+
+if __name__ == '__main__':
+    main()
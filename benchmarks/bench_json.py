@@ -0,0 +1,86 @@
+""" Benchmark decoding of JSON response bodies.
+
+Decodes the recorded response bodies in `tests/cassettes` with
+`requests`' `Response.json` (text decoding, then `json.loads`), with
+`json.loads` on the raw bytes, and with `orjson.loads` on the raw bytes
+(the client's default when orjson is installed). Bodies are optionally
+repeated in a JSON array, to approximate multi-MB payloads.
+
+Usage:
+    python benchmarks/bench_json.py [--repeat 100] [--scale 1]
+"""
+import argparse
+import base64
+import gzip
+import json
+import time
+from pathlib import Path
+
+import requests
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+CASSETTES = Path(__file__).parent.parent / 'tests' / 'cassettes'
+
+
+def load_bodies(scale=1):
+    """ Decompressed JSON response bodies from all cassettes """
+    bodies = []
+    for path in sorted(CASSETTES.glob('*.json')):
+        for interaction in json.loads(path.read_text())['http_interactions']:
+            response = interaction['response']
+            if response['headers'].get('Content-Type') != \
+                    ['application/json']:
+                continue
+            body = response['body']
+            raw = base64.b64decode(body['base64_string']) \
+                if body.get('base64_string') else body['string'].encode()
+            if 'gzip' in response['headers'].get('Content-Encoding', []):
+                raw = gzip.decompress(raw)
+            if scale > 1:
+                raw = b'[' + b','.join([raw] * scale) + b']'
+            bodies.append(raw)
+    return bodies
+
+
+def response_json(body):
+    resp = requests.Response()
+    resp._content = body
+    resp.encoding = None
+    return resp.json()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--repeat', type=int, default=100,
+                        help='Times to decode each body')
+    parser.add_argument('--scale', type=int, default=1,
+                        help='Copies of each body per payload')
+    args = parser.parse_args()
+
+    bodies = load_bodies(args.scale)
+    print('{} bodies, {:.2f} MB total'.format(
+        len(bodies), sum(map(len, bodies)) / 2 ** 20))
+
+    decoders = [('Response.json', response_json),
+                ('json.loads(bytes)', json.loads)]
+    if orjson is not None:
+        decoders.append(('orjson.loads(bytes)', orjson.loads))
+
+    baseline = None
+    for name, loads in decoders:
+        start = time.perf_counter()
+        for _ in range(args.repeat):
+            for body in bodies:
+                loads(body)
+        elapsed = time.perf_counter() - start
+        baseline = baseline or elapsed
+        print('{:>20} {:>8.3f}s {:>6.1f}x'.format(
+            name, elapsed, baseline / elapsed))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+""" Benchmark building predictor event frames from decoded JSON records.
+
+Compares building an Arrow table directly from records (output_type
+'arrow') with building a pandas DataFrame (output_type 'df'), and with
+converting that DataFrame to Arrow afterwards, as Arrow-native consumers
+previously had to. Entity enrichment is skipped, as it is the same for
+all output types.
+
+Usage:
+    python benchmarks/bench_output_types.py [--events 100]
+"""
+import argparse
+import time
+import tracemalloc
+
+import numpy as np
+import pyarrow as pa
+
+from pyns.endpoints.base import _as_frame
+
+
+def make_records(n_runs, n_predictors, n_events):
+    """ Synthetic predictor events, as decoded from the API's JSON """
+    rng = np.random.default_rng(0)
+    n = n_runs * n_predictors * n_events
+    onsets = rng.uniform(0, 600, n).round(2).tolist()
+    values = rng.normal(size=n).round(6).astype(str).tolist()
+    return [
+        {'run_id': r, 'predictor_id': p, 'onset': onsets[i],
+         'duration': 1.0, 'value': values[i]}
+        for i, (r, p) in enumerate(
+            (r, p) for r in range(n_runs) for p in range(n_predictors)
+            for _ in range(n_events))]
+
+
+def _measure(func, *args):
+    """ Time, and peak memory (MB) allocated by Python and Arrow """
+    tracemalloc.start()
+    arrow_before = pa.total_allocated_bytes()
+    start = time.perf_counter()
+    result = func(*args)
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    peak += pa.total_allocated_bytes() - arrow_before
+    return elapsed, peak / 2 ** 20, result
+
+
+def to_pandas_then_arrow(records):
+    return pa.Table.from_pandas(_as_frame(records, 'df'),
+                                preserve_index=False)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--events', type=int, default=100,
+                        help='Events per run and predictor')
+    args = parser.parse_args()
+
+    print('{:>8} {:>22} {:>10} {:>10} {:>10}'.format(
+        'rows', 'path', 'time (s)', 'peak MB', 'result MB'))
+    for n_runs, n_predictors in [(10, 10), (50, 50), (100, 100)]:
+        records = make_records(n_runs, n_predictors, args.events)
+        for name, func in [
+                ('df', lambda r: _as_frame(r, 'df')),
+                ('df, then to arrow', to_pandas_then_arrow),
+                ('arrow', lambda r: _as_frame(r, 'arrow'))]:
+            elapsed, peak, result = _measure(func, records)
+            size = result.nbytes if isinstance(result, pa.Table) else \
+                result.memory_usage(deep=True).sum()
+            print('{:>8} {:>22} {:>10.3f} {:>10.1f} {:>10.1f}'.format(
+                len(records), name, elapsed, peak, size / 2 ** 20))
+            del result
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+""" Benchmark resampling of predictors to TR in `fetch_predictors`.
+
+Compares the pybids path (building variables, then
+`BIDSRunVariableCollection.to_dense`) with `pyns.resampling.to_dense`, on
+synthetic events for a grid of runs x predictors, and checks that both
+produce the same values (exiting with an error if any differ by more than
+the tolerance). pybids only detects the start of a run where onsets
+decrease, so with very few events per run it can misplace events, and the
+check fails.
+
+Usage:
+    python benchmarks/bench_resample.py [--events 100] [--tolerance 1e-6]
+"""
+import argparse
+import time
+
+import numpy as np
+from bids.variables import BIDSRunVariableCollection
+
+from pyns import resampling
+from pyns.fetch_utils import _build_variables, _coerce_amplitudes
+
+from bench_variables import make_events
+
+
+def pybids_dense(all_df, run_info):
+    collection = BIDSRunVariableCollection(
+        _build_variables(all_df, run_info))
+    return collection.to_dense('TR')
+
+
+def numpy_dense(all_df, run_info, names):
+    numeric, _ = _coerce_amplitudes(all_df['amplitude'])
+    return resampling.to_dense(
+        all_df.assign(amplitude=numeric), run_info, names)
+
+
+def _time(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return time.perf_counter() - start, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--events', type=int, default=100,
+                        help='Events per run and predictor')
+    parser.add_argument('--tolerance', type=float, default=1e-6,
+                        help='Largest difference allowed between engines')
+    args = parser.parse_args()
+
+    # Warm up imports (e.g. scipy.signal) before timing
+    all_df, run_info = make_events(2, 2, 10)
+    pybids_dense(all_df, run_info)
+    numpy_dense(all_df, run_info, ['pred_0', 'pred_1'])
+
+    print('{:>6} {:>6} {:>10} {:>11} {:>10} {:>8} {:>10}'.format(
+        'runs', 'preds', 'rows', 'pybids (s)', 'numpy (s)', 'speedup',
+        'max diff'))
+    failed = []
+    for n_runs, n_predictors in [(10, 10), (50, 10), (10, 50), (50, 50)]:
+        all_df, run_info = make_events(n_runs, n_predictors, args.events)
+        names = sorted(all_df.predictor_name.unique())
+        slow, collection = _time(pybids_dense, all_df, run_info)
+        fast, dense = _time(numpy_dense, all_df, run_info, names)
+
+        diff = max(
+            np.abs(
+                collection.variables[name].values.values.ravel()
+                - np.concatenate([dense[r][:, i] for r in sorted(dense)])
+            ).max()
+            for i, name in enumerate(names))
+        print('{:>6} {:>6} {:>10} {:>11.3f} {:>10.3f} {:>7.1f}x {:>10.2g}'
+              .format(n_runs, n_predictors, len(all_df), slow, fast,
+                      slow / fast, diff))
+        if not diff <= args.tolerance:
+            failed.append((n_runs, n_predictors, diff))
+
+    if failed:
+        raise SystemExit('\n'.join(
+            'Engines differ for {} runs x {} predictors: max diff {:.2g} '
+            '> {:.2g}'.format(n_runs, n_predictors, diff, args.tolerance)
+            for n_runs, n_predictors, diff in failed))
+
+
+if __name__ == '__main__':
+    main()
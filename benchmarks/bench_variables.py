@@ -0,0 +1,94 @@
+""" Benchmark variable construction in `fetch_predictors`.
+
+Compares `pyns.fetch_utils._build_variables` with the previous
+per-group loop, on synthetic events for a grid of runs x predictors.
+
+Usage:
+    python benchmarks/bench_variables.py [--events 100]
+"""
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+from bids.variables import SparseRunVariable
+from bids.variables.entities import RunInfo
+
+from pyns.fetch_utils import _build_variables, RUN_INFO_FIELDS
+
+
+def make_events(n_runs, n_predictors, n_events):
+    """ Synthetic, enriched predictor events as returned by `to_df` """
+    rng = np.random.default_rng(0)
+    n = n_runs * n_predictors * n_events
+    # Run ids start at 1, as a falsy run_id is left out of the entities
+    run_id = np.repeat(np.arange(1, n_runs + 1), n_predictors * n_events)
+    df = pd.DataFrame({
+        'run_id': run_id,
+        'predictor_name': np.tile(
+            np.repeat(['pred_%d' % p for p in range(n_predictors)], n_events),
+            n_runs),
+        'onset': rng.uniform(0, 600, n).round(2),
+        'duration': 1.0,
+        'amplitude': rng.normal(size=n).astype(str),
+        'subject': (run_id // 2).astype(str),
+        'session': None,
+        'run': run_id % 2 + 1,
+        'acquisition': None,
+    })
+    run_info = pd.DataFrame(
+        {'duration': 600.0, 'tr': 2.0, 'n_vols': 300},
+        index=pd.Index(np.arange(1, n_runs + 1), name='run_id'))
+    return df.sample(frac=1, random_state=0), run_info
+
+
+def loop_variables(all_df, all_run_info):
+    """ Previous implementation, one pass per (run, predictor) group """
+    variables = []
+    for (run_id, names), df in all_df.groupby(['run_id', 'predictor_name']):
+        keep_cols = []
+        entities = {}
+        for j in ['subject', 'session', 'run', 'acquisition', 'run_id']:
+            val = df[j].iloc[0]
+            if val:
+                entities[j] = val
+                keep_cols.append(j)
+        run_info = RunInfo(
+            **all_run_info.loc[run_id, RUN_INFO_FIELDS].to_dict(),
+            image=None, entities=entities)
+        df = df.copy()
+        try:
+            df['amplitude'] = pd.to_numeric(df['amplitude'])
+        except ValueError:
+            pass
+        df = df[['onset', 'duration', 'amplitude'] + keep_cols].sort_values(
+            'onset')
+        variables.append(SparseRunVariable(names, df, run_info, 'events'))
+    return variables
+
+
+def _time(func, *args):
+    start = time.perf_counter()
+    func(*args)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--events', type=int, default=100,
+                        help='Events per run and predictor')
+    args = parser.parse_args()
+
+    print('{:>6} {:>6} {:>10} {:>10} {:>10} {:>8}'.format(
+        'runs', 'preds', 'rows', 'loop (s)', 'fast (s)', 'speedup'))
+    for n_runs, n_predictors in [(10, 10), (50, 10), (10, 50),
+                                 (50, 50), (100, 100)]:
+        all_df, run_info = make_events(n_runs, n_predictors, args.events)
+        loop = _time(loop_variables, all_df, run_info)
+        fast = _time(_build_variables, all_df, run_info)
+        print('{:>6} {:>6} {:>10} {:>10.3f} {:>10.3f} {:>7.1f}x'.format(
+            n_runs, n_predictors, len(all_df), loop, fast, loop / fast))
+
+
+if __name__ == '__main__':
+    main()
@@ -8,7 +8,16 @@ ROUTE_PATTERN = '{base_url}/{route}[/{id}][/{sub_route}]'
 from .api import Neuroscout
 from . import endpoints
 
-__all__ = ['Neuroscout', 'endpoints', 'fetch_utils']
+__all__ = ['Neuroscout', 'AsyncNeuroscout', 'endpoints', 'fetch_utils']
 
 __author__ = ['Alejandro de la Vega']
 __license__ = 'MIT'
+
+
+def __getattr__(name):
+    # Imported on first use, as it imports httpx
+    if name == 'AsyncNeuroscout':
+        from .async_api import AsyncNeuroscout
+        return AsyncNeuroscout
+    raise AttributeError(
+        "module {!r} has no attribute {!r}".format(__name__, name))
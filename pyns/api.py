@@ -1,41 +1,166 @@
 """ Neuroscout API client"""
+import gzip
+import json
 import requests
 import re
 import jwt
 import os
+import threading
+import contextvars
+import time
+import warnings
+import weakref
+from collections import deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from functools import partialmethod
 
 from . import API_BASE_URL, ROUTE_PATTERN
 from . import endpoints
+from .cache import (ResponseCache, DiskCache, TokenCache, CACHE_DIR_ENV,
+                    make_key)
+from .endpoints.utils import lazy_import
+from .transport import (NeuroscoutAdapter, SingleFlight, DEFAULT_TIMEOUT,
+                        as_retry,
+                        as_rate_limiter, request_timeout)
 
+orjson = lazy_import('orjson')
+
+# Minimum size (bytes) of JSON request bodies to compress, if enabled
+COMPRESS_MIN_BYTES = 1024
+
+# Time (s) before expiry at which tokens are renewed
+TOKEN_REFRESH_MARGIN = 60
+
+Transfer = namedtuple('Transfer', [
+    'method', 'url', 'status', 'request_bytes', 'request_decoded_bytes',
+    'response_bytes', 'response_decoded_bytes'])
+Transfer.__doc__ = """ Bytes of a request and its response, as sent or
+received (i.e. compressed, if it was), and decoded """
+
+
+RequestEvent = namedtuple('RequestEvent', [
+    'method', 'route', 'url', 'status', 'latency', 'request_bytes',
+    'response_bytes', 'cache_hit', 'retries', 'error', 'coalesced'],
+    defaults=[False])
+RequestEvent.__doc__ = """ A request, as passed to hooks. `route` is the
+path template (e.g. 'analyses/{id}/report'), `latency` the time (s) to
+receive and decode the response, and `error` the exception raised by a
+failed request, if any. `coalesced` requests shared the response of an
+identical request in flight, without transferring any bytes. """
+
+
+def _route_label(route, sub_route=None, id=None):
+    """ Path template of a request, with ids replaced by '{id}' """
+    if id is not None:
+        parts = [route, '{id}'] + ([str(sub_route)] if sub_route else [])
+        return '/'.join(parts)
+    if sub_route is not None:
+        # Auto methods receive positional ids as the sub_route, except on
+        # the user route whose sub_routes are named
+        return '/'.join([route, str(sub_route) if route == 'user' else '{id}'])
+    return route
+
+
+def _token_expiry(token):
+    """ Local time (s since the epoch) at which a new token expires,
+    adjusting for clock skew from its issue time """
+    claims = jwt.decode(token, verify=False,
+                        options={'verify_signature': False})
+    return claims['exp'] - (claims['iat'] - time.time())
+
+
+def _raw_bytes(resp):
+    """ Number of response body bytes read over the wire, i.e. before
+    decompression """
+    try:
+        return resp.raw.tell()
+    except (AttributeError, OSError, ValueError):
+        return len(resp.content)
+
+
+class BaseNeuroscout(object):
+    """ Configuration, request building and response handling shared by the
+    blocking :class:`Neuroscout` and asynchronous `AsyncNeuroscout` clients.
+    """
+    def __init__(self, api_base_url=None, cache=None, cache_dir=None,
+                 json_loads=None, compress_requests=False,
+                 transfer_history=1000, retries=3, rate_limit=None,
+                 timeout=DEFAULT_TIMEOUT, hooks=None, token_cache=None,
+                 coalesce_requests=True):
+        """ Initialize shared client state.
 
-class Neuroscout(object):
-    """Neuroscout API client object. This is the access point for the API."""
-    def __init__(self, email=None, password=None, api_base_url=None):
-        """ Initialize Neuroscout object.
-        :param email: Email address to use for authorization.
-        :type email: str, optional
-        :param password: Authentication password
-        :type password: str, optional
         :param api_base_url: Alternate base URL for API (for debugging)
         :type api_base_url: str, optional
+        :param cache: Cache GET responses. If True, uses an in-memory
+            :class:`.ResponseCache`, or a :class:`.DiskCache` if a cache
+            directory is set.
+        :type cache: bool or :class:`.BaseCache`, optional
+        :param cache_dir: Directory for a persistent :class:`.DiskCache`
+            shared between processes. Defaults to the `NEUROSCOUT_CACHE_DIR`
+            environment variable. Setting either enables caching unless
+            `cache` is False.
+        :type cache_dir: str, optional
+        :param json_loads: Function decoding JSON response bodies from
+            bytes. Defaults to `orjson.loads` if orjson is installed,
+            otherwise `json.loads`.
+        :type json_loads: callable, optional
+        :param compress_requests: Gzip JSON request bodies of at least
+            `COMPRESS_MIN_BYTES`, or of at least this many bytes if an int.
+        :type compress_requests: bool or int
+        :param transfer_history: Number of recent requests to keep
+            :class:`Transfer` records of, in `transfers`.
+        :type transfer_history: int
+        :param retries: Number of retries of failed connections, and of
+            idempotent requests failing with a transient server error, with
+            exponential backoff and jitter. Or a policy built with
+            :func:`.make_retry`. None or 0 disable retries.
+        :type retries: int or :class:`urllib3.util.retry.Retry`
+        :param rate_limit: Maximum requests per second, or a
+            :class:`.RateLimiter` to share between clients.
+        :type rate_limit: float or :class:`.RateLimiter`, optional
+        :param timeout: Default timeout (s) of each request, or a
+            (connect, read) tuple. None for no timeout.
+        :type timeout: float or tuple, optional
+        :param hooks: Callables passed a :class:`RequestEvent` after each
+            request, e.g. a :class:`.RequestMetrics`.
+        :type hooks: list, optional
+        :param token_cache: Store API tokens on disk, to reuse between
+            clients and processes. If True, uses a :class:`.TokenCache` in
+            the cache directory. Defaults to True if a cache directory is
+            set.
+        :type token_cache: bool or :class:`.TokenCache`, optional
+        :param coalesce_requests: Share the response of a GET request with
+            identical requests made while it is in flight.
+        :type coalesce_requests: bool
         """
-        self._session = requests.Session()
         self._api_base_url = api_base_url or API_BASE_URL
+        self._coalesce_requests = coalesce_requests
+        self.hooks = list(hooks or [])
+        self._timeout = timeout
+        self._retry = as_retry(retries)
+        self._rate_limiter = as_rate_limiter(rate_limit)
+        if json_loads is None:
+            json_loads = orjson.loads if orjson else json.loads
+        self._json_loads = json_loads
+        if compress_requests is True:
+            compress_requests = COMPRESS_MIN_BYTES
+        self._compress_min_bytes = compress_requests or None
+        self.transfers = deque(maxlen=transfer_history)
+        self._transfers_lock = threading.Lock()
         self._api_token = None
+        self._auth_identity = None
+        self._credentials = (None, None)
 
-        self._authorize(email, password)
+        cache_dir = cache_dir or os.environ.get(CACHE_DIR_ENV)
+        if cache is True or (cache is None and cache_dir):
+            cache = DiskCache(cache_dir) if cache_dir else ResponseCache()
+        self.cache = cache if cache is not False else None
 
-        # Set up main routes
-        self.analyses = endpoints.Analyses(self)
-        self.datasets = endpoints.Datasets(self)
-        self.tasks = endpoints.Tasks(self)
-        self.runs = endpoints.Runs(self)
-        self.predictors = endpoints.Predictors(self)
-        self.predictor_events = endpoints.PredictorEvents(self)
-        self.datasets = endpoints.Datasets(self)
-        self.user = endpoints.User(self)
+        if token_cache is True or (token_cache is None and cache_dir):
+            token_cache = TokenCache(cache_dir)
+        self._token_cache = token_cache if token_cache is not False \
+            else None
 
     def _get_headers(self):
         """ Build authorization header """
@@ -55,7 +180,7 @@ class Neuroscout(object):
             path (str): Formatted URI
         """
         def _replace_variables(pattern, variables):
-            for name in re.findall("\{(.*?)\}", pattern):
+            for name in re.findall(r"\{(.*?)\}", pattern):
                 if name in variables and variables[name] is not None:
                     di = {name: str(variables[name])}
                     pattern = pattern.format(**di)
@@ -65,7 +190,7 @@ class Neuroscout(object):
             return pattern
 
         new_path = ROUTE_PATTERN
-        optional_patterns = re.findall('\[(.*?)\]', ROUTE_PATTERN)
+        optional_patterns = re.findall(r'\[(.*?)\]', ROUTE_PATTERN)
 
         for pattern in optional_patterns:
             chunk = _replace_variables(pattern, kwargs)
@@ -73,27 +198,24 @@ class Neuroscout(object):
 
         return new_path.format(base_url=self._api_base_url, route=route)
 
-    def _make_request(self, request, route, sub_route=None, id=None,
-                      params=None, data=None,
-                      json=None, headers=None, remove_null=True,
-                      files=None, **kwargs):
-        """ Generic request handler """
-
-        if route != 'auth':
-            self._check_expiry()
-
-        request_function = getattr(self._session, request)
+    def _prepare_request(self, request, route, sub_route=None, id=None,
+                         params=None, data=None, json=None, headers=None,
+                         remove_null=True, files=None, **kwargs):
+        """ Build the URI and arguments of a request.
 
+        Returns:
+            path (str): Formatted URI
+            request_kwargs (dict): Arguments for the HTTP library call
+        """
         if remove_null is True:
             kwargs = {k: v for (k, v) in kwargs.items() if v is not None}
 
         if request == 'get':
-            params = kwargs
-            # Join lists as comma separated list
-            for k, v in params.items():
-                if isinstance(v, list):
-                    v = [str(i) for i in v]
-                    params[k] = ','.join(v)
+            # Join lists as comma separated list, in a new dict as the
+            # caller's arguments may be shared with other threads
+            params = {
+                k: ','.join(str(i) for i in v) if isinstance(v, list) else v
+                for k, v in kwargs.items()}
 
         elif request in ['put', 'post']:
             if files:
@@ -102,54 +224,515 @@ class Neuroscout(object):
                 json = kwargs
 
         headers = headers or self._get_headers()
-        route = self._build_path(route, sub_route=sub_route, id=id)
+        if json is not None and self._compress_min_bytes is not None:
+            data, headers = self._compress_json(json, headers)
+            json = None if data is not None else json
+        path = self._build_path(route, sub_route=sub_route, id=id)
+
+        return path, dict(json=json, data=data, files=files,
+                          headers=headers, params=params)
+
+    def _request_timeout(self, timeout=None):
+        """ Timeout of a request, defaulting to the client's, and capped to
+        the current deadline (see :func:`.deadline_scope`) """
+        return request_timeout(self._timeout if timeout is None else timeout)
+
+    def _compress_json(self, payload, headers):
+        """ Gzip a JSON body, if large enough.
+
+        Returns:
+            data (bytes): Compressed body, or None if not compressed
+            headers (dict): Request headers
+        """
+        body = json.dumps(payload).encode()
+        if len(body) < self._compress_min_bytes:
+            return None, headers
+        headers = dict(headers or {}, **{
+            'Content-Type': 'application/json', 'Content-Encoding': 'gzip'})
+        return gzip.compress(body), headers
+
+    def _record_transfer(self, method, url, status, request_headers,
+                         request_body, response_bytes,
+                         response_decoded_bytes):
+        """ Record the bytes transferred by a request """
+        request_bytes = int(request_headers.get('Content-Length') or 0)
+        request_decoded_bytes = request_bytes
+        if request_headers.get('Content-Encoding') == 'gzip' and \
+                isinstance(request_body, bytes):
+            # Uncompressed size (mod 2 ** 32), from the gzip trailer
+            request_decoded_bytes = int.from_bytes(
+                request_body[-4:], 'little')
+        transfer = Transfer(
+            method.upper(), url, status, request_bytes,
+            request_decoded_bytes, response_bytes, response_decoded_bytes)
+        with self._transfers_lock:
+            self.transfers.append(transfer)
+        return transfer
+
+    def _emit(self, request, route, sub_route, id, url, start,
+              transfer=None, cache_hit=False, retries=0, error=None,
+              status=None, coalesced=False):
+        """ Pass a :class:`RequestEvent` to each hook """
+        if not self.hooks:
+            return
+        event = RequestEvent(
+            request.upper(), _route_label(route, sub_route, id), url,
+            transfer.status if transfer else status,
+            time.perf_counter() - start,
+            transfer.request_bytes if transfer else 0,
+            transfer.response_bytes if transfer else 0,
+            cache_hit, retries, error, coalesced)
+        for hook in list(self.hooks):
+            try:
+                hook(event)
+            except Exception as exc:
+                warnings.warn("Request hook {!r} failed: {}".format(
+                    hook, exc))
+
+    @property
+    def transfer_totals(self):
+        """ Total bytes of recorded requests and responses, as transferred
+        and decoded """
+        totals = dict.fromkeys(Transfer._fields[3:], 0)
+        with self._transfers_lock:
+            transfers = list(self.transfers)
+        for transfer in transfers:
+            for field in totals:
+                totals[field] += getattr(transfer, field)
+        return totals
+
+    def _cache_lookup(self, request, path, params):
+        """ Return (key, hit, content) for a request. key is None if the
+        request is not cacheable. """
+        if self.cache is None or request != 'get':
+            return None, False, None
+        key = make_key(request, path, params, identity=self._auth_identity)
+        hit, content = self.cache.get(key, loads=self._json_loads)
+        return key, hit, content
+
+    def _flight_key(self, request, path, params, cache_key=None):
+        """ Key to coalesce a request on, or None if it is not coalesced
+        """
+        if not self._coalesce_requests or request != 'get':
+            return None
+        return cache_key or make_key(
+            request, path, params, identity=self._auth_identity)
+
+    def _cache_store(self, key, content, route, sub_route=None, id=None,
+                     body=None):
+        if key is not None:
+            # Auto methods receive positional ids (e.g. `runs.get(5)`)
+            # as the sub_route, which then forms the id segment of the path
+            self.cache.set(key, content, route=route,
+                           id=id if id is not None else sub_route,
+                           raw=body)
+
+    def _decode(self, headers, body):
+        """ Decode a response body. JSON is decoded straight from the raw
+        bytes, without first building a text string """
+        if headers.get('Content-Type') == 'application/json':
+            return self._json_loads(body)
+        return body
+
+    @staticmethod
+    def _raise_for_status(error, content):
+        """ Re-raise an HTTP error, including the API's message if any """
+        if isinstance(content, dict):
+            if content.get('message') is not None:
+                error = str(error) + "\n Message: {}".format(
+                    content['message'])
+
+        raise requests.exceptions.HTTPError(error)
+
+    def invalidate(self, route=None, id=None):
+        """ Remove cached responses, if caching is enabled.
+
+        :param route: Only remove responses for this route (e.g. 'runs').
+        :type route: str, optional
+        :param id: Only remove responses for this resource id.
+        :type id: str or int, optional
+
+        :return: Number of removed responses
+        :rtype: int
+        """
+        if self.cache is None:
+            return 0
+        return self.cache.invalidate(route=route, id=id)
+
+    def _resolve_credentials(self, email=None, password=None):
+        """ Fill in missing credentials from those last used, or from the
+        environment """
+        email = email or self._credentials[0]
+        password = password or self._credentials[1]
+        if email is None and 'NEUROSCOUT_USER' in os.environ:
+            email = os.environ['NEUROSCOUT_USER']
+        if password is None and 'NEUROSCOUT_PASSWORD' in os.environ:
+            password = os.environ['NEUROSCOUT_PASSWORD']
+        return email, password
 
-        resp = request_function(
-            route, json=json, data=data, files=files,
-            headers=headers, params=params)
+    def _set_token(self, token, email, expires=None):
+        """ Store api_token, and its expiry in local time. `expires` (s
+        since the epoch) is computed from the token if not given. """
+        if expires is None:
+            expires = _token_expiry(token)
+        self._api_token_exp = datetime.fromtimestamp(expires)
+        self._api_token = token
+        self._auth_identity = email
 
-        if resp.headers.get('Content-Type') == 'application/json':
-            content = resp.json()
+    def _token_expired(self, margin=0):
+        """ Whether the token expires within `margin` seconds """
+        return self._api_token is not None and \
+            (self._api_token_exp - datetime.now()).total_seconds() < margin
+
+
+class Neuroscout(BaseNeuroscout):
+    """Neuroscout API client object. This is the access point for the API.
+
+    Clients are thread-safe: one client can be shared by a pool of worker
+    threads, which then share its connections and token. Size
+    `max_connections` to the number of threads.
+    """
+    def __init__(self, email=None, password=None, api_base_url=None,
+                 cache=None, cache_dir=None, json_loads=None,
+                 compress_requests=False, transfer_history=1000, retries=3,
+                 rate_limit=None, timeout=DEFAULT_TIMEOUT, hooks=None,
+                 token_cache=None, refresh_tokens=False, max_connections=32,
+                 coalesce_requests=True):
+        """ Initialize Neuroscout object.
+        :param email: Email address to use for authorization.
+        :type email: str, optional
+        :param password: Authentication password
+        :type password: str, optional
+        :param api_base_url: Alternate base URL for API (for debugging)
+        :type api_base_url: str, optional
+        :param cache: Cache GET responses. If True, uses an in-memory
+            :class:`.ResponseCache`, or a :class:`.DiskCache` if a cache
+            directory is set.
+        :type cache: bool or :class:`.BaseCache`, optional
+        :param cache_dir: Directory for a persistent :class:`.DiskCache`
+            shared between processes. Defaults to the `NEUROSCOUT_CACHE_DIR`
+            environment variable. Setting either enables caching unless
+            `cache` is False.
+        :type cache_dir: str, optional
+        :param json_loads: Function decoding JSON response bodies from
+            bytes. Defaults to orjson if installed.
+        :type json_loads: callable, optional
+        :param compress_requests: Gzip JSON request bodies of at least
+            `COMPRESS_MIN_BYTES`, or of at least this many bytes if an int.
+            Responses are always requested compressed.
+        :type compress_requests: bool or int
+        :param transfer_history: Number of recent requests to keep
+            :class:`Transfer` records of, in `transfers`.
+        :type transfer_history: int
+        :param retries: Number of retries of failed connections, and of
+            idempotent requests failing with a transient server error (429,
+            5xx), with exponential backoff, jitter and `Retry-After`
+            handling. Or a policy built with :func:`.make_retry`.
+        :type retries: int or :class:`urllib3.util.retry.Retry`
+        :param rate_limit: Maximum requests per second, across all
+            threads, or a :class:`.RateLimiter` to share between clients.
+        :type rate_limit: float or :class:`.RateLimiter`, optional
+        :param timeout: Default timeout (s) of each request, or a
+            (connect, read) tuple. None for no timeout. Any call can
+            override it with a `timeout` argument.
+        :type timeout: float or tuple, optional
+        :param hooks: Callables passed a :class:`RequestEvent` after each
+            request, including cache hits and failed requests. E.g. a
+            :class:`.RequestMetrics` collecting per-route latencies.
+        :type hooks: list, optional
+        :param token_cache: Store API tokens on disk, so that clients in
+            other processes (e.g. many short jobs) reuse them until close
+            to expiry, instead of each logging in. If True, uses a
+            :class:`.TokenCache` in the cache directory. Defaults to True
+            if a cache directory is set.
+        :type token_cache: bool or :class:`.TokenCache`, optional
+        :param refresh_tokens: Renew the API token on a background thread
+            before it expires, so that no request waits on a login.
+        :type refresh_tokens: bool
+        :param max_connections: Number of connections to keep open to the
+            API, for reuse by concurrent requests.
+        :type max_connections: int
+        :param coalesce_requests: Send one request for identical GET
+            requests made at the same time (e.g. by several threads
+            resolving the same dataset name), and share its response.
+        :type coalesce_requests: bool
+        """
+        super().__init__(
+            api_base_url=api_base_url, cache=cache, cache_dir=cache_dir,
+            json_loads=json_loads, compress_requests=compress_requests,
+            transfer_history=transfer_history, retries=retries,
+            rate_limit=rate_limit, timeout=timeout, hooks=hooks,
+            token_cache=token_cache, coalesce_requests=coalesce_requests)
+        self._max_connections = max_connections
+        self._http_session = None
+        self._pool_lock = threading.RLock()
+        self._auth_lock = threading.RLock()
+        self._inflight = SingleFlight()
+
+        self._authorize(email, password)
+        self._refresher = None
+        if refresh_tokens and self._api_token is not None:
+            self._refresher = _TokenRefresher(self)
+            self._refresher.start()
+
+        self._init_endpoints()
+
+    def __getstate__(self):
+        """ Pickle configuration, the email and the current token, so that
+        a client sent to other processes (e.g. a process pool) does not
+        need to log in again. The password is not pickled: once the token
+        expires, unpickled clients log in with credentials from the
+        environment (`NEUROSCOUT_PASSWORD`). Connections, the transfer
+        history and in-memory cached responses are not pickled, and a rate
+        limiter applies per process. """
+        state = self.__dict__.copy()
+        for attr in ('_http_session', '_pool_lock', '_auth_lock',
+                     '_transfers_lock', '_refresher', 'analyses', 'datasets',
+                     'tasks', 'runs', 'predictors', 'predictor_events',
+                     'user'):
+            state.pop(attr, None)
+        state['transfers'] = deque(maxlen=self.transfers.maxlen)
+        state['_credentials'] = (self._credentials[0], None)
+        state['_refresh_tokens'] = self._refresher is not None
+        return state
+
+    def __setstate__(self, state):
+        refresh_tokens = state.pop('_refresh_tokens')
+        self.__dict__.update(state)
+        self._http_session = None
+        self._pool_lock = threading.RLock()
+        self._auth_lock = threading.RLock()
+        self._transfers_lock = threading.Lock()
+        self._refresher = None
+        # Tokens can only be renewed with a password from the environment
+        if refresh_tokens and self._api_token is not None and \
+                self._resolve_credentials()[1] is not None:
+            self._refresher = _TokenRefresher(self)
+            self._refresher.start()
+        self._init_endpoints()
+
+    @property
+    def _session(self):
+        """ HTTP session, created on first use """
+        if self._http_session is None:
+            with self._pool_lock:
+                if self._http_session is None:
+                    session = requests.Session()
+                    adapter = self._make_adapter()
+                    session.mount('http://', adapter)
+                    session.mount('https://', adapter)
+                    self._http_session = session
+        return self._http_session
+
+    def _make_adapter(self):
+        """ Transport adapter with pools of `_max_connections` per host """
+        return NeuroscoutAdapter(
+            rate_limiter=self._rate_limiter, max_retries=self._retry,
+            pool_maxsize=self._max_connections)
+
+    def _init_endpoints(self):
+        """ Set up main routes """
+        self.analyses = endpoints.Analyses(self)
+        self.datasets = endpoints.Datasets(self)
+        self.tasks = endpoints.Tasks(self)
+        self.runs = endpoints.Runs(self)
+        self.predictors = endpoints.Predictors(self)
+        self.predictor_events = endpoints.PredictorEvents(self)
+        self.datasets = endpoints.Datasets(self)
+        self.user = endpoints.User(self)
+
+    def _make_request(self, request, route, sub_route=None, id=None,
+                      timeout=None, **kwargs):
+        """ Generic request handler """
+
+        if route != 'auth':
+            self._check_expiry()
+
+        request_function = getattr(self._session, request)
+
+        path, request_kwargs = self._prepare_request(
+            request, route, sub_route=sub_route, id=id, **kwargs)
+
+        start = time.perf_counter()
+        cache_key, hit, content = self._cache_lookup(
+            request, path, request_kwargs['params'])
+        if hit:
+            self._emit(request, route, sub_route, id, path, start,
+                       cache_hit=True)
+            return content
+
+        def send():
+            return request_function(
+                path, timeout=self._request_timeout(timeout),
+                **request_kwargs)
+
+        flight_key = self._flight_key(
+            request, path, request_kwargs['params'], cache_key)
+        try:
+            if flight_key is None:
+                resp, shared = send(), False
+            else:
+                resp, shared = self._inflight.do(flight_key, send)
+        except requests.exceptions.RequestException as error:
+            self._emit(request, route, sub_route, id, path, start,
+                       error=error)
+            raise
+        finally:
+            # Mutations may change any cached listing of this route
+            if self.cache is not None and request != 'get':
+                self.cache.invalidate(route=route)
+
+        # Each caller decodes its own copy of a shared response
+        body = resp.content
+        content = self._decode(resp.headers, body)
+        if shared:
+            self._emit(request, route, sub_route, id, resp.url, start,
+                       status=resp.status_code, coalesced=True)
         else:
-            content = resp.content
+            transfer = self._record_transfer(
+                request, resp.url, resp.status_code, resp.request.headers,
+                resp.request.body, _raw_bytes(resp), len(body))
+            self._emit(request, route, sub_route, id, resp.url, start,
+                       transfer, retries=getattr(resp, 'retries', 0))
 
         try:
             resp.raise_for_status()
         except requests.exceptions.HTTPError as error:
-            if isinstance(content, dict):
-                if content.get('message') is not None:
-                    error = str(error) + "\n Message: {}".format(
-                        content['message'])
+            self._raise_for_status(error, content)
 
-            raise requests.exceptions.HTTPError(error)
+        if not shared:
+            self._cache_store(cache_key, content, route, sub_route, id,
+                              body)
 
         return content
 
-    def _authorize(self, email=None, password=None):
-        """ Fetch api_token given access credentials """
-        if email is None and 'NEUROSCOUT_USER' in os.environ:
-            email = os.environ['NEUROSCOUT_USER']
-        if password is None and 'NEUROSCOUT_PASSWORD' in os.environ:
-            password = os.environ['NEUROSCOUT_PASSWORD']
+    def _resize_pool(self, maxsize):
+        """ Grow the session's connection pools to hold at least `maxsize`
+        connections per host, so concurrent requests reuse connections.
+        Pools are resized by mounting a new adapter. """
+        with self._pool_lock:
+            if maxsize <= self._max_connections:
+                return
+            self._max_connections = maxsize
+            if self._http_session is None:
+                return
+
+            # Adapters mounted by others (e.g. to record requests) are kept
+            adapter = self._make_adapter()
+            for prefix, previous in list(self._http_session.adapters.items()):
+                if isinstance(previous, NeuroscoutAdapter):
+                    self._http_session.mount(prefix, adapter)
+                    previous.close()
+
+    def gather(self, calls, max_workers=16, return_exceptions=True):
+        """ Run API calls concurrently on a bounded thread pool.
+
+        All calls share this client's session, whose connection pool is
+        grown to `max_workers` connections if smaller.
+
+        :param calls: Callables taking no arguments, e.g.
+            `functools.partial(api.runs.get, 5)`.
+        :type calls: list
+        :param max_workers: Maximum number of concurrent requests.
+        :type max_workers: int
+        :param return_exceptions: If True, exceptions are returned in place
+            of the failed call's result. Otherwise, the first is raised.
+        :type return_exceptions: bool
+
+        :return: Results, in the same order as `calls`
+        :rtype: list
+        """
+        calls = list(calls)
+        if not calls:
+            return []
+
+        def _call(func):
+            try:
+                return func()
+            except Exception as exc:
+                if not return_exceptions:
+                    raise
+                return exc
+
+        max_workers = min(max_workers, len(calls))
+        if max_workers <= 1:
+            return [_call(func) for func in calls]
+
+        self._resize_pool(max_workers)
+        # Run each call in a copy of this context, to keep any deadline
+        contexts = [contextvars.copy_context() for _ in calls]
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            return list(pool.map(
+                lambda ctx, func: ctx.run(_call, func), contexts, calls))
+
+    def close(self):
+        """ Stop refreshing the token, and close connections """
+        if self._refresher is not None:
+            self._refresher.stopped.set()
+        if self._http_session is not None:
+            self._http_session.close()
+
+    def _authorize(self, email=None, password=None,
+                   min_ttl=TOKEN_REFRESH_MARGIN):
+        """ Fetch api_token given access credentials. With a token cache,
+        reuse a stored token valid for at least `min_ttl` seconds. """
+        email, password = self._resolve_credentials(email, password)
 
         if email is not None and password is not None:
-            rv = self._post('auth', email=email, password=password)
-            self._api_token = rv['access_token']
+            def login():
+                rv = self._post('auth', email=email, password=password)
+                return rv['access_token'], _token_expiry(rv['access_token'])
 
-            iat = datetime.utcfromtimestamp(
-                jwt.decode(self._api_token, verify=False, 
-                           options={'verify_signature': False})['iat'])
-            adj = iat - datetime.now()
-            self._api_token_exp = datetime.utcfromtimestamp(
-                jwt.decode(self._api_token, verify=False, 
-                           options={'verify_signature': False})['exp']) - adj
+            with self._auth_lock:
+                if self._token_cache is not None:
+                    token, expires = self._token_cache.fetch(
+                        self._api_base_url, email, password, login,
+                        min_ttl=min_ttl)
+                else:
+                    token, expires = login()
+                self._credentials = (email, password)
+                self._set_token(token, email, expires)
 
     def _check_expiry(self):
-        if self._api_token is not None:
-            if datetime.now() > self._api_token_exp:
-                self._authorize()
+        if self._token_expired(TOKEN_REFRESH_MARGIN):
+            with self._auth_lock:
+                # Renew once, for all threads which found the token expired
+                if self._token_expired(TOKEN_REFRESH_MARGIN):
+                    self._authorize()
 
     _get = partialmethod(_make_request, 'get')
     _post = partialmethod(_make_request, 'post')
     _put = partialmethod(_make_request, 'put')
     _delete = partialmethod(_make_request, 'delete')
+
+
+class _TokenRefresher(threading.Thread):
+    """ Daemon thread renewing a client's token before it comes within
+    `TOKEN_REFRESH_MARGIN` of expiry. Holds a weak reference to the client,
+    and stops once the client is closed or garbage collected. """
+    def __init__(self, client):
+        super().__init__(name='pyns-token-refresher', daemon=True)
+        self._client = weakref.ref(client)
+        self.stopped = threading.Event()
+        weakref.finalize(client, self.stopped.set)
+
+    @staticmethod
+    def _delay(client):
+        """ Time (s) until the client's token is due for renewal """
+        remaining = (client._api_token_exp - datetime.now()).total_seconds()
+        # Renew short-lived tokens halfway, rather than continuously
+        return max(remaining - 2 * TOKEN_REFRESH_MARGIN, remaining / 2, 1)
+
+    def run(self):
+        delay = self._delay(self._client())
+        while not self.stopped.wait(delay):
+            client = self._client()
+            if client is None:
+                return
+            try:
+                client._authorize(min_ttl=2 * TOKEN_REFRESH_MARGIN)
+                delay = self._delay(client)
+            except Exception as exc:
+                warnings.warn("Token refresh failed: {}".format(exc))
+                delay = max(TOKEN_REFRESH_MARGIN / 4, 1)
+            del client
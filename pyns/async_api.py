@@ -0,0 +1,295 @@
+""" Asynchronous Neuroscout API client"""
+import asyncio
+import time
+from functools import partial, partialmethod
+
+from .api import BaseNeuroscout, TOKEN_REFRESH_MARGIN, _token_expiry
+from .cache import ResponseCache
+from .endpoints import aio
+from .endpoints.utils import attempt_to_import
+from .transport import (AsyncSingleFlight, DeadlineExceeded,
+                        DEFAULT_TIMEOUT, _retry_delay, request_timeout)
+
+httpx = attempt_to_import('httpx')
+
+
+def _cap_timeouts(timeouts):
+    """ httpx timeouts (connect, read, write and pool), capped to the
+    current deadline """
+    return {k: request_timeout(v) for k, v in timeouts.items()}
+
+
+if httpx is not None:
+    class AsyncRetryTransport(httpx.AsyncBaseTransport):
+        """ httpx transport with the retry and rate limiting behavior of
+        :class:`.NeuroscoutAdapter`. The number of retries made is stored
+        in the response's `extensions['retries']`. """
+        def __init__(self, transport, retry, rate_limiter=None):
+            self.transport = transport
+            self.retry = retry
+            self.rate_limiter = rate_limiter
+
+        async def handle_async_request(self, request):
+            retry = self.retry
+            idempotent = request.method in (retry.allowed_methods or ())
+            timeout = request.extensions.get('timeout')
+            attempt = 0
+            while True:
+                if self.rate_limiter is not None:
+                    await self.rate_limiter.acquire_async()
+                if timeout is not None:
+                    # Cap each attempt to the time left before the deadline
+                    request.extensions['timeout'] = _cap_timeouts(timeout)
+                try:
+                    response = await self.transport.handle_async_request(
+                        request)
+                except httpx.TransportError as error:
+                    retryable = isinstance(error, httpx.ConnectError) or \
+                        idempotent
+                    if not retryable or attempt >= (retry.total or 0):
+                        raise
+                    delay = _retry_delay(retry, attempt + 1)
+                else:
+                    if not idempotent or attempt >= (retry.total or 0) or \
+                            response.status_code not in \
+                            (retry.status_forcelist or ()):
+                        response.extensions['retries'] = attempt
+                        return response
+                    delay = _retry_delay(
+                        retry, attempt + 1,
+                        response.headers.get('Retry-After'))
+                    await response.aclose()
+                attempt += 1
+                await asyncio.sleep(delay)
+
+        async def aclose(self):
+            await self.transport.aclose()
+
+
+class AsyncNeuroscout(BaseNeuroscout):
+    """Asynchronous Neuroscout API client, for use within an asyncio
+    event loop. Requires `httpx`.
+
+    Endpoints mirror :class:`.Neuroscout`, but their auto methods (`get`,
+    `post`, `put`, `delete`) are coroutine functions::
+
+        async with AsyncNeuroscout() as api:
+            runs = await api.runs.get(dataset_name='Budapest')
+    """
+    def __init__(self, email=None, password=None, api_base_url=None,
+                 cache=None, cache_dir=None, max_connections=100,
+                 json_loads=None, compress_requests=False,
+                 transfer_history=1000, retries=3, rate_limit=None,
+                 timeout=DEFAULT_TIMEOUT, hooks=None, token_cache=None,
+                 coalesce_requests=True):
+        """ Initialize AsyncNeuroscout object. Authorization is deferred
+        until the first request, or an explicit `await api.authorize()`.
+
+        :param email: Email address to use for authorization.
+        :type email: str, optional
+        :param password: Authentication password
+        :type password: str, optional
+        :param api_base_url: Alternate base URL for API (for debugging)
+        :type api_base_url: str, optional
+        :param cache: Cache GET responses. See :class:`.Neuroscout`.
+        :type cache: bool or :class:`.BaseCache`, optional
+        :param cache_dir: Directory for a persistent :class:`.DiskCache`.
+        :type cache_dir: str, optional
+        :param max_connections: Maximum number of concurrent connections.
+        :type max_connections: int
+        :param json_loads: Function decoding JSON response bodies from
+            bytes. Defaults to orjson if installed.
+        :type json_loads: callable, optional
+        :param compress_requests: Gzip large JSON request bodies.
+            See :class:`.Neuroscout`.
+        :type compress_requests: bool or int
+        :param transfer_history: Number of recent requests to keep
+            :class:`.Transfer` records of, in `transfers`.
+        :type transfer_history: int
+        :param retries: Retry policy. See :class:`.Neuroscout`.
+        :type retries: int or :class:`urllib3.util.retry.Retry`
+        :param rate_limit: Maximum requests per second, or a
+            :class:`.RateLimiter` to share between clients.
+        :type rate_limit: float or :class:`.RateLimiter`, optional
+        :param timeout: Default timeout (s) of each request, or a
+            (connect, read) tuple. See :class:`.Neuroscout`.
+        :type timeout: float or tuple, optional
+        :param hooks: Callables passed a :class:`.RequestEvent` after each
+            request. See :class:`.Neuroscout`.
+        :type hooks: list, optional
+        :param token_cache: Store API tokens on disk, to reuse between
+            clients and processes. See :class:`.Neuroscout`.
+        :type token_cache: bool or :class:`.TokenCache`, optional
+        :param coalesce_requests: Share the response of a GET request with
+            identical requests made while it is in flight.
+        :type coalesce_requests: bool
+        """
+        if httpx is None:
+            raise ImportError("httpx is required to use AsyncNeuroscout")
+
+        super().__init__(
+            api_base_url=api_base_url, cache=cache, cache_dir=cache_dir,
+            json_loads=json_loads, compress_requests=compress_requests,
+            transfer_history=transfer_history, retries=retries,
+            rate_limit=rate_limit, timeout=timeout, hooks=hooks,
+            token_cache=token_cache, coalesce_requests=coalesce_requests)
+        transport = httpx.AsyncHTTPTransport(
+            limits=httpx.Limits(max_connections=max_connections))
+        self._session = httpx.AsyncClient(
+            timeout=None, transport=AsyncRetryTransport(
+                transport, self._retry, self._rate_limiter))
+        self._credentials = self._resolve_credentials(email, password)
+        self._authorized = False
+        self._auth_lock = None
+        self._inflight = AsyncSingleFlight()
+
+        # Set up main routes
+        self.analyses = aio.AsyncAnalyses(self)
+        self.datasets = aio.AsyncDatasets(self)
+        self.tasks = aio.AsyncTasks(self)
+        self.runs = aio.AsyncRuns(self)
+        self.predictors = aio.AsyncPredictors(self)
+        self.predictor_events = aio.AsyncPredictorEvents(self)
+        self.user = aio.AsyncUser(self)
+
+    async def __aenter__(self):
+        await self.authorize()
+        return self
+
+    async def __aexit__(self, *args):
+        await self.aclose()
+
+    async def aclose(self):
+        """ Close underlying connections """
+        await self._session.aclose()
+
+    async def _blocking(self, func, *args, **kwargs):
+        """ Run a blocking call, such as a disk cache operation, in the
+        loop's default executor """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            None, partial(func, *args, **kwargs))
+
+    async def _cache_call(self, func, *args, **kwargs):
+        """ Call a cache method. Only the in-memory cache is called within
+        the event loop, as others may block on disk or locks. """
+        if isinstance(self.cache, ResponseCache):
+            return func(*args, **kwargs)
+        return await self._blocking(func, *args, **kwargs)
+
+    async def _make_request(self, request, route, sub_route=None, id=None,
+                            timeout=None, **kwargs):
+        """ Generic request handler """
+        if route != 'auth':
+            await self._check_expiry()
+
+        path, request_kwargs = self._prepare_request(
+            request, route, sub_route=sub_route, id=id, **kwargs)
+
+        start = time.perf_counter()
+        cache_key, hit, content = await self._cache_call(
+            self._cache_lookup, request, path, request_kwargs['params'])
+        if hit:
+            self._emit(request, route, sub_route, id, path, start,
+                       cache_hit=True)
+            return content
+
+        if isinstance(request_kwargs['data'], bytes):
+            # Compressed body
+            request_kwargs['content'] = request_kwargs.pop('data')
+
+        timeout = self._request_timeout(timeout)
+        if isinstance(timeout, tuple):
+            timeout = httpx.Timeout(timeout[1], connect=timeout[0])
+        def send():
+            return self._session.request(
+                request.upper(), path, timeout=timeout, **{
+                    k: v for k, v in request_kwargs.items()
+                    if v is not None})
+
+        flight_key = self._flight_key(
+            request, path, request_kwargs['params'], cache_key)
+        try:
+            if flight_key is None:
+                resp, shared = await send(), False
+            else:
+                resp, shared = await self._inflight.do(flight_key, send)
+        except (httpx.HTTPError, DeadlineExceeded) as error:
+            self._emit(request, route, sub_route, id, path, start,
+                       error=error)
+            raise
+        finally:
+            if self.cache is not None and request != 'get':
+                await self._cache_call(self.cache.invalidate, route=route)
+
+        # Each caller decodes its own copy of a shared response
+        body = resp.content
+        content = self._decode(resp.headers, body)
+        if shared:
+            self._emit(request, route, sub_route, id, str(resp.url), start,
+                       status=resp.status_code, coalesced=True)
+        else:
+            transfer = self._record_transfer(
+                request, str(resp.url), resp.status_code,
+                resp.request.headers, request_kwargs.get('content'),
+                resp.num_bytes_downloaded, len(body))
+            self._emit(request, route, sub_route, id, str(resp.url), start,
+                       transfer, retries=resp.extensions.get('retries', 0))
+
+        try:
+            resp.raise_for_status()
+        except httpx.HTTPStatusError as error:
+            self._raise_for_status(error, content)
+
+        if not shared:
+            await self._cache_call(
+                self._cache_store, cache_key, content, route, sub_route, id,
+                body)
+
+        return content
+
+    async def _login(self, email, password):
+        rv = await self._post('auth', email=email, password=password)
+        return rv['access_token'], _token_expiry(rv['access_token'])
+
+    async def authorize(self, email=None, password=None):
+        """ Fetch api_token given access credentials. Concurrent callers
+        share a single request. With a token cache, logins are serialized
+        across processes as in :meth:`.TokenCache.fetch`. """
+        if self._auth_lock is None:
+            self._auth_lock = asyncio.Lock()
+
+        async with self._auth_lock:
+            # Another coroutine may have refreshed the token while we waited
+            if email is None and password is None and self._authorized \
+                    and not self._token_expired(TOKEN_REFRESH_MARGIN):
+                return
+            email, password = self._resolve_credentials(email, password)
+            if email is not None and password is not None:
+                if self._token_cache is None:
+                    token, expires = await self._login(email, password)
+                else:
+                    # The token cache blocks on its lock file, so is run
+                    # in a thread, which logs in back on the event loop
+                    loop = asyncio.get_running_loop()
+
+                    def login():
+                        return asyncio.run_coroutine_threadsafe(
+                            self._login(email, password), loop).result()
+
+                    token, expires = await self._blocking(
+                        self._token_cache.fetch, self._api_base_url, email,
+                        password, login, min_ttl=TOKEN_REFRESH_MARGIN)
+                self._credentials = (email, password)
+                self._set_token(token, email, expires)
+            self._authorized = True
+
+    async def _check_expiry(self):
+        if not self._authorized or \
+                self._token_expired(TOKEN_REFRESH_MARGIN):
+            await self.authorize()
+
+    _get = partialmethod(_make_request, 'get')
+    _post = partialmethod(_make_request, 'post')
+    _put = partialmethod(_make_request, 'put')
+    _delete = partialmethod(_make_request, 'delete')
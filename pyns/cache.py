@@ -0,0 +1,885 @@
+""" Response caches used by the Neuroscout client """
+import hashlib
+import hmac
+import json
+import os
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from contextlib import closing, contextmanager
+from pathlib import Path
+
+from .endpoints.utils import lazy_import
+
+try:
+    import fcntl
+except ImportError:  # Windows, rely on SQLite's own locking
+    fcntl = None
+
+pd = lazy_import('pandas')
+pa = lazy_import('pyarrow')
+pq = lazy_import('pyarrow.parquet', fromlist=['parquet'])
+
+# Resources that rarely change once ingested, with their time-to-live (s)
+DEFAULT_ROUTE_TTLS = {
+    'datasets': 3600,
+    'tasks': 3600,
+    'runs': 3600,
+    'predictors': 3600,
+}
+
+CACHE_DIR_ENV = 'NEUROSCOUT_CACHE_DIR'
+
+
+def make_key(method, path, params=None, identity=None):
+    """ Build a hashable cache key for a request.
+
+    Args:
+        method (str): HTTP method, e.g. 'get'.
+        path (str): Fully built request URI.
+        params (dict): Query parameters. Order does not matter.
+        identity (str): Identity of the authorized user, if any.
+
+    Returns:
+        key (tuple): Normalized cache key
+    """
+    params = tuple(sorted(
+        (str(k), str(v)) for k, v in (params or {}).items()))
+    return (method.lower(), path, params, identity)
+
+
+def _encode(value, raw=None):
+    """ Encode a response for storage.
+
+    Args:
+        value: Decoded response content, or bytes if not JSON.
+        raw (bytes): Encoded JSON body of `value`, if at hand.
+
+    Returns:
+        (is_json, blob) (tuple): Whether `blob` is JSON, and the bytes
+    """
+    if isinstance(value, bytes):
+        return False, value
+    return True, raw if raw is not None else json.dumps(value).encode()
+
+
+def _decode(is_json, blob, loads=None):
+    """ Decode a stored response, with `loads` (default `json.loads`) if
+    it is JSON """
+    if not is_json:
+        return bytes(blob)
+    return (loads or json.loads)(blob)
+
+
+class BaseCache(ABC):
+    """ Superclass for response caches.
+
+    Handles per-route TTLs and hit/miss/eviction statistics. Subclasses
+    implement storage.
+    """
+    def __init__(self, ttl=None, route_ttls=None):
+        """ Initialize cache.
+
+        :param ttl: Default time-to-live (s) for routes not in `route_ttls`.
+            If None, other routes are not cached.
+        :type ttl: float, optional
+        :param route_ttls: Mapping of route to time-to-live (s).
+            Defaults to `DEFAULT_ROUTE_TTLS`.
+        :type route_ttls: dict, optional
+        """
+        self.ttl = ttl
+        self.route_ttls = dict(
+            DEFAULT_ROUTE_TTLS if route_ttls is None else route_ttls)
+        self._lock = threading.RLock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.RLock()
+
+    def get_ttl(self, route):
+        """ Time-to-live for a route, or None if it is not cached """
+        return self.route_ttls.get(route, self.ttl)
+
+    def _count(self, hit):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    @abstractmethod
+    def get(self, key, loads=None):
+        """ Look up a cached response.
+
+        :param key: Key built with :func:`make_key`
+        :type key: tuple
+        :param loads: Function decoding JSON responses. Defaults to
+            `json.loads`.
+        :type loads: callable, optional
+
+        :return: Tuple of (hit, value)
+        :rtype: tuple
+        """
+
+    @abstractmethod
+    def set(self, key, value, route, id=None, raw=None):
+        """ Store a response, evicting the least recently used if full.
+
+        :param key: Key built with :func:`make_key`
+        :type key: tuple
+        :param value: Decoded response content
+        :param route: Primary API route, e.g. 'runs'
+        :type route: str
+        :param id: Resource id of the request, if any
+        :param raw: Encoded JSON body of `value`, if at hand, which is
+            stored rather than encoding `value` again.
+        :type raw: bytes, optional
+        """
+
+    @abstractmethod
+    def invalidate(self, route=None, id=None):
+        """ Remove cached responses.
+
+        :param route: Only remove responses for this route.
+            If None, all routes.
+        :type route: str, optional
+        :param id: Only remove responses for this resource id.
+        :type id: str or int, optional
+
+        :return: Number of removed responses
+        :rtype: int
+        """
+
+    @abstractmethod
+    def clear(self):
+        """ Remove all responses and reset statistics """
+
+    @abstractmethod
+    def __len__(self):
+        pass
+
+    @property
+    def stats(self):
+        """ Hit, miss and eviction counts, and current size """
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'size': len(self),
+            }
+
+
+class ResponseCache(BaseCache):
+    """ In-memory LRU cache of API responses with per-route TTLs.
+
+    Only routes with a TTL (either in `route_ttls` or via `ttl`) are cached.
+    Responses are stored encoded, and decoded on each hit, so callers can
+    safely mutate returned values.
+    """
+    def __init__(self, maxsize=512, maxbytes=2 ** 27, ttl=None,
+                 route_ttls=None):
+        """ Initialize cache.
+
+        :param maxsize: Maximum number of cached responses.
+        :type maxsize: int
+        :param maxbytes: Maximum total size (bytes) of cached responses.
+        :type maxbytes: int
+        :param ttl: Default time-to-live (s) for routes not in `route_ttls`.
+            If None, other routes are not cached.
+        :type ttl: float, optional
+        :param route_ttls: Mapping of route to time-to-live (s).
+            Defaults to `DEFAULT_ROUTE_TTLS`.
+        :type route_ttls: dict, optional
+        """
+        super().__init__(ttl=ttl, route_ttls=route_ttls)
+        self.maxsize = maxsize
+        self.maxbytes = maxbytes
+        self.nbytes = 0
+        self._entries = OrderedDict()
+
+    def get(self, key, loads=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] < time.monotonic():
+                del self._entries[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return False, None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            is_json, blob = entry[3:]
+        return True, _decode(is_json, blob, loads)
+
+    def __getstate__(self):
+        # Cached responses stay with their process
+        state = super().__getstate__()
+        state.update(_entries=OrderedDict(), nbytes=0, hits=0, misses=0,
+                     evictions=0)
+        return state
+
+    def _pop(self, key):
+        """ Remove an entry, returning it """
+        entry = self._entries.pop(key)
+        self.nbytes -= len(entry[4])
+        return entry
+
+    def set(self, key, value, route, id=None, raw=None):
+        ttl = self.get_ttl(route)
+        if not ttl or self.maxsize <= 0:
+            return
+        is_json, blob = _encode(value, raw)
+        if len(blob) > self.maxbytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._pop(key)
+            self._entries[key] = (
+                time.monotonic() + ttl, route,
+                None if id is None else str(id), is_json, blob)
+            self.nbytes += len(blob)
+            while len(self._entries) > self.maxsize or \
+                    self.nbytes > self.maxbytes:
+                self._pop(next(iter(self._entries)))
+                self.evictions += 1
+
+    def invalidate(self, route=None, id=None):
+        id = None if id is None else str(id)
+        with self._lock:
+            stale = [
+                k for k, (_, r, i, _, _) in self._entries.items()
+                if (route is None or r == route) and (id is None or i == id)
+            ]
+            for k in stale:
+                self._pop(k)
+        return len(stale)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.nbytes = 0
+            self.hits = self.misses = self.evictions = 0
+
+    @property
+    def stats(self):
+        return {**super().stats, 'maxsize': self.maxsize,
+                'bytes': self.nbytes, 'maxbytes': self.maxbytes}
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class _SQLiteStore:
+    """ Mixin for stores indexed by a SQLite database in `cache_dir`, with
+    writes serialized across processes by an advisory lock file. Requires
+    a `_lock` (threading.RLock) and a `_schema_`. """
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.RLock()
+
+    def _open_store(self, cache_dir, name, mode=None):
+        cache_dir = cache_dir or os.environ.get(CACHE_DIR_ENV)
+        if not cache_dir:
+            raise ValueError(
+                "A cache_dir must be provided, or {} set".format(
+                    CACHE_DIR_ENV))
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self._db_path = self.cache_dir / (name + '.sqlite')
+        self._lock_path = self.cache_dir / (name + '.lock')
+        if mode is not None:
+            # Create the database with restricted permissions, which SQLite
+            # also applies to its journal files
+            os.close(os.open(str(self._db_path), os.O_CREAT | os.O_WRONLY,
+                             mode))
+            os.chmod(str(self._db_path), mode)
+
+        with self._write_lock(), self._connect() as con:
+            con.executescript(self._schema_)
+
+    def _connect(self):
+        """ Open a new connection. Connections are not shared between
+        threads or processes. """
+        con = sqlite3.connect(str(self._db_path), timeout=60,
+                              isolation_level=None)
+        con.execute('PRAGMA journal_mode=WAL')
+        return closing(con)
+
+    @contextmanager
+    def _write_lock(self):
+        """ Exclusive inter-process lock, held while writing """
+        with self._lock, open(self._lock_path, 'a') as fh:
+            if fcntl is not None:
+                fcntl.flock(fh, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(fh, fcntl.LOCK_UN)
+
+
+class DiskCache(_SQLiteStore, BaseCache):
+    """ Persistent cache of API responses, shared between processes.
+
+    Responses are stored in a SQLite database in `cache_dir`. Writes and
+    evictions are serialized across processes with an advisory lock file,
+    so many jobs on one node can share a cache directory. The directory
+    should be on a local filesystem, as network filesystems often do not
+    honor file locks.
+
+    The total size of stored responses is capped at `maxbytes`, evicting
+    the least recently used responses first.
+    """
+    _schema_ = """
+        CREATE TABLE IF NOT EXISTS responses (
+            key TEXT PRIMARY KEY,
+            route TEXT NOT NULL,
+            rid TEXT,
+            is_json INTEGER NOT NULL,
+            value BLOB NOT NULL,
+            size INTEGER NOT NULL,
+            expires REAL NOT NULL,
+            accessed REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS responses_accessed
+            ON responses (accessed);
+        CREATE INDEX IF NOT EXISTS responses_route ON responses (route);
+    """
+
+    def __init__(self, cache_dir=None, maxbytes=2 ** 30, ttl=None,
+                 route_ttls=None):
+        """ Initialize cache.
+
+        :param cache_dir: Directory to store cache in. Defaults to the
+            `NEUROSCOUT_CACHE_DIR` environment variable.
+        :type cache_dir: str, optional
+        :param maxbytes: Maximum total size (bytes) of stored responses.
+        :type maxbytes: int
+        :param ttl: Default time-to-live (s) for routes not in `route_ttls`.
+            If None, other routes are not cached.
+        :type ttl: float, optional
+        :param route_ttls: Mapping of route to time-to-live (s).
+            Defaults to `DEFAULT_ROUTE_TTLS`.
+        :type route_ttls: dict, optional
+        """
+        super().__init__(ttl=ttl, route_ttls=route_ttls)
+        self.maxbytes = maxbytes
+        self._open_store(cache_dir, 'responses')
+
+    @staticmethod
+    def _hash(key):
+        return hashlib.sha256(repr(key).encode()).hexdigest()
+
+    def get(self, key, loads=None):
+        now = time.time()
+        with self._connect() as con:
+            row = con.execute(
+                'SELECT is_json, value FROM responses '
+                'WHERE key = ? AND expires > ?',
+                (self._hash(key), now)).fetchone()
+            if row is not None:
+                con.execute('UPDATE responses SET accessed = ? WHERE key = ?',
+                            (now, self._hash(key)))
+
+        self._count(row is not None)
+        if row is None:
+            return False, None
+        return True, _decode(*row, loads)
+
+    def set(self, key, value, route, id=None, raw=None):
+        ttl = self.get_ttl(route)
+        if not ttl:
+            return
+        is_json, blob = _encode(value, raw)
+        if len(blob) > self.maxbytes:
+            return
+
+        now = time.time()
+        with self._write_lock(), self._connect() as con:
+            con.execute(
+                'INSERT OR REPLACE INTO responses VALUES (?,?,?,?,?,?,?,?)',
+                (self._hash(key), route, None if id is None else str(id),
+                 int(is_json), blob, len(blob), now + ttl, now))
+            self._evict(con)
+
+    def _evict(self, con):
+        """ Drop expired responses, then least recently used until the
+        cache fits within `maxbytes`. Must hold the write lock. """
+        con.execute('DELETE FROM responses WHERE expires <= ?', (time.time(),))
+        total = con.execute(
+            'SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+        if total <= self.maxbytes:
+            return
+
+        removed = []
+        for key, size in con.execute(
+                'SELECT key, size FROM responses ORDER BY accessed'):
+            if total <= self.maxbytes:
+                break
+            removed.append((key, ))
+            total -= size
+        con.executemany('DELETE FROM responses WHERE key = ?', removed)
+        with self._lock:
+            self.evictions += len(removed)
+
+    def invalidate(self, route=None, id=None):
+        clauses, args = [], []
+        if route is not None:
+            clauses.append('route = ?')
+            args.append(route)
+        if id is not None:
+            clauses.append('rid = ?')
+            args.append(str(id))
+        where = ' WHERE ' + ' AND '.join(clauses) if clauses else ''
+
+        with self._write_lock(), self._connect() as con:
+            return con.execute(
+                'DELETE FROM responses' + where, args).rowcount
+
+    def clear(self):
+        self.invalidate()
+        with self._lock:
+            self.hits = self.misses = self.evictions = 0
+
+    @property
+    def nbytes(self):
+        """ Total size (bytes) of stored responses """
+        with self._connect() as con:
+            return con.execute(
+                'SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+
+    @property
+    def stats(self):
+        return {**super().stats, 'bytes': self.nbytes,
+                'maxbytes': self.maxbytes}
+
+    def __len__(self):
+        with self._connect() as con:
+            return con.execute('SELECT COUNT(*) FROM responses').fetchone()[0]
+
+
+class EventCache(_SQLiteStore):
+    """ Persistent store of predictor events, shared between processes.
+
+    Events are stored as Parquet files in `cache_dir`, one shard per
+    (predictor_id, run_id), so that a request for a different set of
+    predictors or runs only needs to fetch the shards not yet stored. An
+    index of shards is kept in a SQLite database, alongside
+    :class:`DiskCache`'s if they share a `cache_dir`.
+
+    Shards are validated against their index entry (file size and row
+    count) when read, and dropped if they do not match. The total size of
+    stored shards is capped at `maxbytes`, evicting the least recently used
+    first. Requires `pyarrow`.
+    """
+    _schema_ = """
+        CREATE TABLE IF NOT EXISTS shards (
+            predictor_id INTEGER NOT NULL,
+            run_id INTEGER NOT NULL,
+            rows INTEGER NOT NULL,
+            size INTEGER NOT NULL,
+            stored REAL NOT NULL,
+            accessed REAL NOT NULL,
+            PRIMARY KEY (predictor_id, run_id)
+        );
+        CREATE INDEX IF NOT EXISTS shards_accessed ON shards (accessed);
+    """
+
+    columns = ['run_id', 'predictor_id', 'onset', 'duration', 'value']
+
+    def __init__(self, cache_dir=None, maxbytes=2 ** 32, max_age=None):
+        """ Initialize cache.
+
+        :param cache_dir: Directory to store cache in. Defaults to the
+            `NEUROSCOUT_CACHE_DIR` environment variable.
+        :type cache_dir: str, optional
+        :param maxbytes: Maximum total size (bytes) of stored shards.
+        :type maxbytes: int
+        :param max_age: Age (s) after which shards are fetched again.
+            If None, shards do not expire.
+        :type max_age: float, optional
+        """
+        if not pq:
+            raise ImportError(
+                "pyarrow is required to cache predictor events")
+        self._lock = threading.RLock()
+        self.maxbytes = maxbytes
+        self.max_age = max_age
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._open_store(cache_dir, 'events')
+        self._schema = pa.schema([
+            ('run_id', pa.int64()), ('predictor_id', pa.int64()),
+            ('onset', pa.float64()), ('duration', pa.float64()),
+            ('value', pa.string())])
+
+    def _shard_path(self, predictor_id, run_id):
+        return self.cache_dir / 'events' / str(predictor_id) / \
+            '{}.parquet'.format(run_id)
+
+    def _read_shard(self, predictor_id, run_id, rows, size):
+        """ Read a shard, or return None if it does not match its index """
+        path = self._shard_path(predictor_id, run_id)
+        try:
+            if path.stat().st_size != size:
+                return None
+            table = pq.read_table(str(path), schema=self._schema)
+        except (OSError, pa.ArrowException):
+            return None
+        return table if table.num_rows == rows else None
+
+    def load(self, predictor_ids, run_ids):
+        """ Read stored events for all pairs of predictor and run ids.
+
+        :param predictor_ids: Predictor ids to read.
+        :type predictor_ids: list
+        :param run_ids: Run ids to read.
+        :type run_ids: list
+
+        :return: Tuple of (events, missing), where events is a DataFrame
+            of the stored shards, and missing a list of (predictor_id,
+            run_id) pairs which must be fetched.
+        :rtype: tuple
+        """
+        wanted = {(int(p), int(r)) for p in predictor_ids for r in run_ids}
+        min_stored = 0 if self.max_age is None else \
+            time.time() - self.max_age
+
+        with self._connect() as con:
+            index = {
+                (p, r): (rows, size) for p, r, rows, size in con.execute(
+                    'SELECT predictor_id, run_id, rows, size FROM shards '
+                    'WHERE stored > ?', (min_stored, ))
+                if (p, r) in wanted}
+
+        tables, found, invalid = [], [], []
+        for (p, r), (rows, size) in sorted(index.items()):
+            table = self._read_shard(p, r, rows, size)
+            if table is None:
+                invalid.append((p, r))
+            else:
+                tables.append(table)
+                found.append((p, r))
+
+        if invalid:
+            self._remove(invalid)
+        if found:
+            with self._connect() as con:
+                con.executemany(
+                    'UPDATE shards SET accessed = ? '
+                    'WHERE predictor_id = ? AND run_id = ?',
+                    [(time.time(), p, r) for p, r in found])
+
+        with self._lock:
+            self.hits += len(found)
+            self.misses += len(wanted) - len(found)
+
+        table = pa.concat_tables(tables) if tables else \
+            self._schema.empty_table()
+        return table.to_pandas(), sorted(wanted - set(found))
+
+    def store(self, events, pairs):
+        """ Store fetched events, as one shard per pair.
+
+        :param events: Events with `run_id`, `predictor_id`, `onset`,
+            `duration` and `value` columns.
+        :type events: :class:`pandas.DataFrame`
+        :param pairs: (predictor_id, run_id) pairs that were fetched. Pairs
+            without events are stored as empty shards.
+        :type pairs: list
+        """
+        events = self.normalize(events)
+        groups = {
+            key: df for key, df in events.groupby(['predictor_id', 'run_id'])}
+        empty = events.iloc[:0]
+
+        rows = []
+        for p, r in pairs:
+            path = self._shard_path(p, r)
+            path.parent.mkdir(parents=True, exist_ok=True)
+            table = pa.Table.from_pandas(
+                groups.get((p, r), empty), schema=self._schema,
+                preserve_index=False)
+            # Write then rename, so readers never see a partial shard
+            tmp = path.with_name('{}.{}.tmp'.format(path.name, os.getpid()))
+            pq.write_table(table, str(tmp))
+            os.replace(str(tmp), str(path))
+            rows.append((int(p), int(r), table.num_rows,
+                         path.stat().st_size))
+
+        now = time.time()
+        with self._write_lock(), self._connect() as con:
+            con.executemany(
+                'INSERT OR REPLACE INTO shards VALUES (?,?,?,?,?,?)',
+                [row + (now, now) for row in rows])
+            self._evict(con)
+
+    def normalize(self, events):
+        """ Select shard columns and convert values to strings (or None),
+        as stored in shards. """
+        events = pd.DataFrame(events, columns=self.columns)
+        value = events['value']
+        events['value'] = value.astype(str).where(value.notna(), None)
+        return events
+
+    def _evict(self, con):
+        """ Drop least recently used shards until the cache fits within
+        `maxbytes`. Must hold the write lock. """
+        total = con.execute(
+            'SELECT COALESCE(SUM(size), 0) FROM shards').fetchone()[0]
+        if total <= self.maxbytes:
+            return
+
+        removed = []
+        for p, r, size in con.execute(
+                'SELECT predictor_id, run_id, size FROM shards '
+                'ORDER BY accessed'):
+            if total <= self.maxbytes:
+                break
+            removed.append((p, r))
+            total -= size
+        self._delete(con, removed)
+        with self._lock:
+            self.evictions += len(removed)
+
+    def _delete(self, con, pairs):
+        con.executemany(
+            'DELETE FROM shards WHERE predictor_id = ? AND run_id = ?', pairs)
+        for p, r in pairs:
+            try:
+                self._shard_path(p, r).unlink()
+            except FileNotFoundError:
+                pass
+
+    def _remove(self, pairs):
+        with self._write_lock(), self._connect() as con:
+            self._delete(con, pairs)
+
+    def invalidate(self, predictor_id=None, run_id=None):
+        """ Remove stored shards.
+
+        :param predictor_id: Only remove shards for this predictor.
+        :type predictor_id: int, optional
+        :param run_id: Only remove shards for this run.
+        :type run_id: int, optional
+
+        :return: Number of removed shards
+        :rtype: int
+        """
+        clauses, args = [], []
+        if predictor_id is not None:
+            clauses.append('predictor_id = ?')
+            args.append(int(predictor_id))
+        if run_id is not None:
+            clauses.append('run_id = ?')
+            args.append(int(run_id))
+        where = ' WHERE ' + ' AND '.join(clauses) if clauses else ''
+
+        with self._write_lock(), self._connect() as con:
+            pairs = con.execute(
+                'SELECT predictor_id, run_id FROM shards' + where,
+                args).fetchall()
+            self._delete(con, pairs)
+        return len(pairs)
+
+    def clear(self):
+        """ Remove all shards and reset statistics """
+        self.invalidate()
+        with self._lock:
+            self.hits = self.misses = self.evictions = 0
+
+    @property
+    def nbytes(self):
+        """ Total size (bytes) of stored shards """
+        with self._connect() as con:
+            return con.execute(
+                'SELECT COALESCE(SUM(size), 0) FROM shards').fetchone()[0]
+
+    @property
+    def stats(self):
+        """ Hit, miss and eviction counts (in shards), and current size """
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'size': len(self),
+                'bytes': self.nbytes,
+                'maxbytes': self.maxbytes,
+            }
+
+    def __len__(self):
+        with self._connect() as con:
+            return con.execute('SELECT COUNT(*) FROM shards').fetchone()[0]
+
+
+class TokenCache(_SQLiteStore):
+    """ Persistent store of API tokens, shared between processes.
+
+    Tokens are keyed by API base URL and user, and stored in a SQLite
+    database in `cache_dir`, readable only by its owner. :meth:`fetch`
+    serializes logins across processes, so that many short jobs sharing a
+    `cache_dir` log in once, and reuse the token until close to its expiry.
+
+    Each token is bound to a salted hash of the password it was obtained
+    with, and only returned to callers giving that password. The tokens
+    themselves are stored in plain text: anyone who can read the database
+    can act as its users until the tokens expire.
+    """
+    _schema_ = """
+        CREATE TABLE IF NOT EXISTS tokens (
+            key TEXT PRIMARY KEY,
+            token TEXT NOT NULL,
+            expires REAL NOT NULL,
+            salt BLOB NOT NULL,
+            secret BLOB NOT NULL
+        );
+    """
+
+    # PBKDF2 iterations hashing passwords
+    _iterations_ = 100000
+
+    def __init__(self, cache_dir=None):
+        """ Initialize cache.
+
+        :param cache_dir: Directory to store tokens in. Defaults to the
+            `NEUROSCOUT_CACHE_DIR` environment variable.
+        :type cache_dir: str, optional
+        """
+        self._lock = threading.RLock()
+        self._open_store(cache_dir, 'tokens', mode=0o600)
+
+    @staticmethod
+    def _hash(api_base_url, user):
+        return hashlib.sha256(
+            repr((api_base_url.rstrip('/'), user)).encode()).hexdigest()
+
+    def _secret(self, password, salt):
+        return hashlib.pbkdf2_hmac(
+            'sha256', password.encode(), salt, self._iterations_)
+
+    def get(self, api_base_url, user, password, min_ttl=0):
+        """ Look up a stored token.
+
+        :param api_base_url: Base URL of the API the token is for.
+        :type api_base_url: str
+        :param user: User (email) the token is for.
+        :type user: str
+        :param password: Password the token was obtained with.
+        :type password: str
+        :param min_ttl: Minimum time (s) the token must remain valid for.
+        :type min_ttl: float
+
+        :return: Tuple of (token, expiry time in seconds since the epoch),
+            or None if no token is valid for `min_ttl`, or the password
+            differs.
+        :rtype: tuple
+        """
+        with self._connect() as con:
+            row = con.execute(
+                'SELECT token, expires, salt, secret FROM tokens '
+                'WHERE key = ? AND expires > ?',
+                (self._hash(api_base_url, user), time.time() + min_ttl)
+            ).fetchone()
+        if row is None or not hmac.compare_digest(
+                self._secret(password, row[2]), row[3]):
+            return None
+        return row[0], row[1]
+
+    def _store(self, con, api_base_url, user, password, token, expires):
+        salt = os.urandom(16)
+        con.execute(
+            'INSERT OR REPLACE INTO tokens '
+            '(key, token, expires, salt, secret) VALUES (?, ?, ?, ?, ?)',
+            (self._hash(api_base_url, user), token, expires, salt,
+             self._secret(password, salt)))
+
+    def set(self, api_base_url, user, password, token, expires):
+        """ Store a token.
+
+        :param api_base_url: Base URL of the API the token is for.
+        :type api_base_url: str
+        :param user: User (email) the token is for.
+        :type user: str
+        :param password: Password the token was obtained with.
+        :type password: str
+        :param token: API token.
+        :type token: str
+        :param expires: Expiry time of the token (s since the epoch).
+        :type expires: float
+        """
+        with self._write_lock(), self._connect() as con:
+            self._store(con, api_base_url, user, password, token, expires)
+
+    def fetch(self, api_base_url, user, password, login, min_ttl=0):
+        """ Look up a token, or log in if none is valid for `min_ttl`.
+        Logins are serialized across processes, so that processes waiting
+        on another's login reuse its token.
+
+        :param api_base_url: Base URL of the API the token is for.
+        :type api_base_url: str
+        :param user: User (email) the token is for.
+        :type user: str
+        :param password: Password to log in with.
+        :type password: str
+        :param login: Function taking no arguments, returning a new
+            (token, expires) tuple.
+        :type login: callable
+        :param min_ttl: Minimum time (s) a stored token must remain valid
+            for to be reused.
+        :type min_ttl: float
+
+        :return: Tuple of (token, expiry time in seconds since the epoch)
+        :rtype: tuple
+        """
+        cached = self.get(api_base_url, user, password, min_ttl)
+        if cached is not None:
+            return cached
+        with self._write_lock():
+            # Another process may have logged in while we waited
+            cached = self.get(api_base_url, user, password, min_ttl)
+            if cached is not None:
+                return cached
+            token, expires = login()
+            with self._connect() as con:
+                self._store(con, api_base_url, user, password, token,
+                            expires)
+        return token, expires
+
+    def invalidate(self, api_base_url=None, user=None):
+        """ Remove stored tokens, e.g. after they were revoked.
+
+        :param api_base_url: Only remove the token for this API and `user`.
+            If None, all tokens.
+        :type api_base_url: str, optional
+        :param user: User (email) of the token to remove.
+        :type user: str, optional
+        """
+        with self._write_lock(), self._connect() as con:
+            if api_base_url is None:
+                con.execute('DELETE FROM tokens')
+            else:
+                con.execute('DELETE FROM tokens WHERE key = ?',
+                            (self._hash(api_base_url, user),))
+
+    def __len__(self):
+        with self._connect() as con:
+            return con.execute('SELECT COUNT(*) FROM tokens').fetchone()[0]
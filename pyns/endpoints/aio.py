@@ -0,0 +1,219 @@
+"""Asynchronous counterparts of the endpoint classes, used by
+`AsyncNeuroscout`"""
+import asyncio
+from abc import abstractmethod
+from functools import partial, wraps
+
+from .base import (Base, _name_lookup, _ids_from_lookup, _run_search_args,
+                   _entity_lookups, _apply_entities, _check_output_type,
+                   _as_frame, _finish_frame, _missing_ids)
+
+
+class AsyncBase(Base):
+    """Superclass for asynchronous resources.
+
+    Mirrors :class:`.Base`: subclasses list `auto_methods`, which are
+    created as coroutine functions wrapping the client's request methods.
+    """
+    def __init__(self, client):
+        """Initialize a Model instance.
+
+        :param client: base client instance
+        :type client: `AsyncNeuroscout`
+        """
+        self._client = client
+
+        all_methods = ('get', 'post', 'put', 'delete')
+        assert set(self._auto_methods_) <= set(all_methods)
+
+        for method in self._auto_methods_:
+            setattr(self,
+                    method,
+                    partial(
+                        getattr(self._client, "_" + method),
+                        self._base_path_)
+            )
+            if method == 'get':
+                setattr(self, method,
+                        async_to_df(getattr(self, method), self._client))
+                if self._convert_names_to_ids_ is True:
+                    setattr(self, method,
+                            async_names_to_ids(getattr(self, method),
+                                               self._client))
+                if self._find_runs_ is True:
+                    setattr(self, method,
+                            async_find_runs(getattr(self, method),
+                                            self._client))
+
+    async def get_many(self, ids, return_exceptions=True, **kwargs):
+        """ Get multiple resources by id, concurrently.
+
+        Concurrency is bounded by the client's connection limit.
+
+        :param ids: Resource ids to get
+        :type ids: list
+        :param return_exceptions: If True, exceptions are returned in place
+            of the failed item's result. Otherwise, the first is raised.
+        :type return_exceptions: bool
+        :param kwargs: Additional arguments for each `get` call.
+        :type kwargs: dict
+
+        :return: Results, in the same order as `ids`
+        :rtype: list
+        """
+        if 'get' not in self._auto_methods_:
+            raise ValueError(
+                "{} does not support get".format(self._base_path_))
+        return await asyncio.gather(
+            *[self.get(id=i, **kwargs) for i in ids],
+            return_exceptions=return_exceptions)
+
+    @property
+    @abstractmethod
+    def _base_path_(self):
+        pass
+
+    @property
+    @abstractmethod
+    def _auto_methods_(self):
+        """ HTTP methods to auto create in subordinate classes """
+        pass
+
+
+def async_names_to_ids(func, client):
+    ''' Asynchronous :func:`.names_to_ids` '''
+    @wraps(func)
+    async def wrapper(*args, **kwargs):
+        for kw in sorted(kwargs):
+            if kw.endswith('_name'):
+                mod, filter_args = _name_lookup(client, kw, kwargs)
+                kwargs[kw.replace('_name', '_id')] = _ids_from_lookup(
+                    kw, kwargs, await mod.get(**filter_args))
+                kwargs.pop(kw)
+
+        return await func(*args, **kwargs)
+    return wrapper
+
+
+def async_find_runs(func, client):
+    """ Asynchronous :func:`.find_runs` """
+    @wraps(func)
+    async def wrapper(*args, **kwargs):
+        search_args = _run_search_args(kwargs)
+
+        if search_args:
+            runs = await client.runs.get(**search_args)
+            kwargs['run_id'] = [r['id'] for r in runs]
+            if not kwargs['run_id']:
+                raise ValueError("No runs found using provided arguments")
+        return await func(*args, **kwargs)
+    return wrapper
+
+
+async def _async_run_catalog(plan, api):
+    """ Asynchronous :func:`._run_catalog` """
+    try:
+        endpoint, kwargs = next(plan)
+        while True:
+            endpoint, kwargs = plan.send(
+                await getattr(api, endpoint).get(**kwargs))
+    except StopIteration as stop:
+        return stop.value
+
+
+async def _async_id_to_entities(df, api):
+    """ Asynchronous :func:`._id_to_entities` """
+    for col, endpoint, ids, plan in list(_entity_lookups(df, api)):
+        records = await _async_run_catalog(plan, api)
+        missing = _missing_ids(ids, records)
+        if missing:
+            records += await endpoint.get_many(
+                missing, return_exceptions=False)
+        df = _apply_entities(df, col, records)
+    return df
+
+
+def async_to_df(func, client):
+    """ Asynchronous :func:`.to_df` """
+    @wraps(func)
+    async def wrapper(*args, output_type='json', compact=False,
+                      resolve_ids=True, **kwargs):
+        _check_output_type(output_type)
+        res = await func(*args, **kwargs)
+
+        if output_type != 'json':
+            res = _as_frame(res, output_type)
+            if resolve_ids:
+                res = await _async_id_to_entities(res, client)
+            res = _finish_frame(res, output_type, compact)
+        return res
+    return wrapper
+
+
+class AsyncAnalyses(AsyncBase):
+    """ Asynchronous analyses endpoint
+
+    auto_methods: `get`, `post`, `put`, `delete`
+    """
+    _base_path_ = 'analyses'
+    _auto_methods_ = ('get', 'post', 'put', 'delete')
+    _convert_names_to_ids_ = True
+
+
+class AsyncDatasets(AsyncBase):
+    """ Asynchronous datasets endpoint
+
+    auto_methods: `get`
+    """
+    _base_path_ = 'datasets'
+    _auto_methods_ = ('get', )
+
+
+class AsyncTasks(AsyncBase):
+    """ Asynchronous tasks endpoint
+
+    auto_methods: `get`
+    """
+    _base_path_ = 'tasks'
+    _auto_methods_ = ('get', )
+    _convert_names_to_ids_ = True
+
+
+class AsyncRuns(AsyncBase):
+    """ Asynchronous runs endpoint
+
+    auto_methods: `get`
+    """
+    _base_path_ = 'runs'
+    _auto_methods_ = ('get', )
+    _convert_names_to_ids_ = True
+
+
+class AsyncPredictors(AsyncBase):
+    """ Asynchronous predictors endpoint
+
+    auto_methods: `get`, `post`
+    """
+    _base_path_ = 'predictors'
+    _auto_methods_ = ('get', 'post')
+    _find_runs_ = True
+
+
+class AsyncPredictorEvents(AsyncBase):
+    """ Asynchronous predictor events endpoint
+
+    auto_methods: `get`
+    """
+    _base_path_ = 'predictor-events'
+    _auto_methods_ = ('get', )
+    _convert_names_to_ids_ = True
+    _find_runs_ = True
+
+
+class AsyncUser(AsyncBase):
+    """ Asynchronous user endpoint
+
+    auto_methods: `get`, `post`, `put`
+    """
+    _base_path_ = 'user'
+    _auto_methods_ = ('get', 'post', 'put')
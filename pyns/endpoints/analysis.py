@@ -5,19 +5,33 @@ from functools import partial
 import datetime
 import tempfile
 import requests
-from .utils import build_model, attempt_to_import
+from .utils import build_model, lazy_import
 from .base import names_to_ids
-import tqdm
-import time
+from ..transport import with_deadline, wait
 import re
 import json
 
-altair = attempt_to_import('altair')
-nib = attempt_to_import('nibabel')
-nilearn = attempt_to_import('nilearn.plotting')
+tqdm = lazy_import('tqdm')
+altair = lazy_import('altair')
+nib = lazy_import('nibabel')
+nilearn = lazy_import('nilearn.plotting')
 
+_TMP_DIR = None
 
-TMP_DIR = Path(tempfile.mkdtemp())
+
+def _tmp_dir():
+    """ Default download directory, created on first use """
+    global _TMP_DIR
+    if _TMP_DIR is None:
+        _TMP_DIR = Path(tempfile.mkdtemp())
+    return _TMP_DIR
+
+
+def __getattr__(name):
+    if name == 'TMP_DIR':
+        return _tmp_dir()
+    raise AttributeError(
+        "module {!r} has no attribute {!r}".format(__name__, name))
 
 
 class Analysis:
@@ -73,6 +87,11 @@ class Analysis:
                         self.hash_id)
                     )
 
+    @property
+    def _client(self):
+        """ Client of the parent :class:`.Analyses` endpoint """
+        return self._analyses._client
+
     def __repr__(self):
         return "<:class:`Analysis`={} name={} dataset_id={}>".format(
             self.hash_id, self.name, self.dataset_id)
@@ -214,6 +233,7 @@ class Analyses(Base):
         """
         return self.post(id=id, sub_route='clone')
 
+    @with_deadline
     def create_analysis(self, *, name, dataset_name, predictor_names,
                         tasks=None, subjects=None, runs=None, session=None,
                         hrf_variables=None, contrasts=None,
@@ -245,6 +265,8 @@ class Analyses(Base):
         :type transformations: list
         :param kwargs: arguments to pass to Analysis class
         :type kwargs: dict
+        :param deadline: Maximum time (s) for all requests made.
+        :type deadline: float, optional
 
         :return: Analysis object
         :rype: :class:`Analysis`
@@ -371,7 +393,8 @@ class Analyses(Base):
                          params=dict(
                              run_id=run_id, sampling_rate=sampling_rate, scale=scale))
 
-    def get_report(self, id, run_id=None, loop_wait=True):
+    @with_deadline
+    def get_report(self, id, run_id=None, loop_wait=True, poll_interval=2):
         """ Get generated reports for analysis
         
         :param id: :class:`Analysis` `hash_id`
@@ -380,6 +403,11 @@ class Analyses(Base):
         :type run_id: list
         :param loop_wait: Wait until report completes before returning response.
         :type loop_wait: bool
+        :param poll_interval: Time (s) between checks of a pending report.
+        :type poll_interval: float
+        :param deadline: Maximum time (s) to wait for the report, after
+            which :class:`.DeadlineExceeded` is raised.
+        :type deadline: float, optional
     
         :return: Requests response object
         :rype: :class:`requests.Response`
@@ -387,7 +415,7 @@ class Analyses(Base):
         report = self.get(id=id, sub_route='report', run_id=run_id)
         if loop_wait:
             while report['status'] == 'PENDING':
-                time.sleep(2)
+                wait(poll_interval)
                 report = self.get(id=id, sub_route='report', run_id=run_id)
 
         return report
@@ -429,7 +457,7 @@ class Analyses(Base):
         :return: Requests response object
         :rype: :class:`requests.Response`
         """
-        if altair is None:
+        if not altair:
             raise ImportError("Altair is required to plot_reports")
 
         report = self.get_report(id=id, run_id=run_id, loop_wait=loop_wait)
@@ -553,6 +581,7 @@ class Analyses(Base):
 
         return uploads
 
+    @with_deadline
     def load_uploads(self, id, select='latest',
                      download_dir=None, collection_filters={}, 
                      image_filters={}):
@@ -575,12 +604,14 @@ class Analyses(Base):
         :param image_filters: Attributes to filter images on.
             If any attributes are not found, they are ignored.
         :type image_filters: dict
+        :param deadline: Maximum time (s) for all requests and downloads.
+        :type deadline: float, optional
 
         :return: list list of tuples of format (Nifti1Image, kwargs).
         :rype: list
         """
         if download_dir is None:
-            download_dir = TMP_DIR
+            download_dir = _tmp_dir()
         else:
             download_dir = Path(download_dir)
 
@@ -617,7 +648,10 @@ class Analyses(Base):
                     if not f_name.exists():
                         print(".", end ="")  
                         with f_name.open('wb') as file:
-                            file.write(requests.get(img_url).content)
+                            file.write(requests.get(
+                                img_url,
+                                timeout=self._client._request_timeout()
+                            ).content)
                     niimg = nib.load(f_name)
 
                     f.pop('traceback')
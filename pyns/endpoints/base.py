@@ -1,11 +1,20 @@
 """Base endpoint class"""
 from abc import ABC, abstractmethod
 from functools import partial
-import pandas as pd
 from functools import wraps
+import math
+import sys
 import pyns
 import warnings
 
+from .utils import lazy_import
+
+pd = lazy_import('pandas')
+np = lazy_import('numpy')
+pyarrow = lazy_import('pyarrow')
+pyarrow_compute = lazy_import('pyarrow.compute', fromlist=['compute'])
+polars = lazy_import('polars')
+
 class Base(ABC):
     """Superclass for all resources.
     
@@ -42,18 +51,44 @@ class Base(ABC):
             if method == 'get': 
                 setattr(self,
                         method,
-                        to_df(getattr(self, method))
+                        to_df(getattr(self, method), client=self._client)
                         )
                 if self._convert_names_to_ids_ is True:
                     setattr(self,
                             method,
-                            names_to_ids(getattr(self, method))
+                            names_to_ids(getattr(self, method),
+                                         client=self._client)
                     )
                 if self._find_runs_ is True:
                     setattr(self,
                             method,
-                            find_runs(getattr(self, method))
+                            find_runs(getattr(self, method),
+                                      client=self._client)
                     ) 
+    def get_many(self, ids, max_workers=16, return_exceptions=True,
+                 **kwargs):
+        """ Get multiple resources by id, concurrently.
+
+        :param ids: Resource ids to get
+        :type ids: list
+        :param max_workers: Maximum number of concurrent requests.
+        :type max_workers: int
+        :param return_exceptions: If True, exceptions are returned in place
+            of the failed item's result. Otherwise, the first is raised.
+        :type return_exceptions: bool
+        :param kwargs: Additional arguments for each `get` call.
+        :type kwargs: dict
+
+        :return: Results, in the same order as `ids`
+        :rtype: list
+        """
+        if 'get' not in self._auto_methods_:
+            raise ValueError(
+                "{} does not support get".format(self._base_path_))
+        return self._client.gather(
+            [partial(self.get, id=i, **kwargs) for i in ids],
+            max_workers=max_workers, return_exceptions=return_exceptions)
+
     @property
     @abstractmethod
     def _base_path_(self):
@@ -66,109 +101,335 @@ class Base(ABC):
         pass
 
 
-def names_to_ids(func):
+def _resolve_client(client, args):
+    """ Return the client a decorated call should use for lookups.
+
+    Prefers the explicitly bound client, then the `_client` of the object
+    the decorated method belongs to. Only creates a new client as a last
+    resort, as that re-authorizes and opens a new session.
+    """
+    if client is None and args:
+        client = getattr(args[0], '_client', None)
+    if client is None:
+        client = pyns.Neuroscout()
+    return client
+
+
+def _name_lookup(api, kw, kwargs):
+    """ Endpoint and filter arguments to look up the id(s) for `kw` """
+    try:
+        mod = getattr(api, kw.replace('_name', 's'))
+    except AttributeError:
+        raise ValueError("No API endpoint for {}".format(kw))
+
+    filter_args = {'name': kwargs[kw]}
+    if kw == 'task_name' and 'dataset_id' in kwargs:
+        filter_args['dataset_id'] = kwargs['dataset_id']
+
+    if kw == 'predictor_name' and 'run_id' in kwargs: 
+        filter_args['run_id'] = kwargs['run_id']
+
+    return mod, filter_args
+
+
+def _ids_from_lookup(kw, kwargs, res):
+    """ Validate the response of a name lookup and extract the id(s) """
+    if not res:
+        raise ValueError("No {} found using provided arguments".format(kw))
+    if len(res) > 1 and not isinstance(kwargs[kw], list):
+        raise ValueError("Multiple {} found using provided arguments".format(kw))
+
+    ids_ = [r['id'] for r in res]
+    if len(ids_) == 1:
+        ids_ = ids_[0]
+    return ids_
+
+
+def names_to_ids(func, client=None):
     ''' Decorator which converts _name to _id by automatically looking up in API'''
     @wraps(func)
     def wrapper(*args, **kwargs):
-        api = pyns.Neuroscout()
+        api = _resolve_client(client, args)
         # Sorting guarantees that 'dataset' is looked up before 'task' and 'predictor' to constrain search
         for kw in sorted(kwargs):
             if kw.endswith('_name'):
-                try:
-                    mod = getattr(api, kw.replace('_name', 's'))
-                except:
-                    raise ValueError("No API endpoint for {}".format(kw))
-
-                filter_args = {'name': kwargs[kw]}
-                if kw == 'task_name' and 'dataset_id' in kwargs:
-                    filter_args['dataset_id'] = kwargs['dataset_id']
-
-                if kw == 'predictor_name' and 'run_id' in kwargs: 
-                    filter_args['run_id'] = kwargs['run_id']
-                
-                res = mod.get(**filter_args)
-
-                if not res:
-                    raise ValueError("No {} found using provided arguments".format(kw))
-                if len(res) > 1 and not isinstance(kwargs[kw], list):
-                    raise ValueError("Multiple {} found using provided arguments".format(kw))
-
-                ids_ = [r['id'] for r in res]
-                if len(ids_) == 1:
-                    ids_ = ids_[0]
-                kwargs[kw.replace('_name', '_id')] = ids_
+                mod, filter_args = _name_lookup(api, kw, kwargs)
+                kwargs[kw.replace('_name', '_id')] = _ids_from_lookup(
+                    kw, kwargs, mod.get(**filter_args))
                 kwargs.pop(kw)
 
         return func(*args, **kwargs)
     return wrapper
 
 
-def find_runs(func):
+def _run_search_args(kwargs):
+    """ Pop run filter arguments from kwargs, if runs should be searched """
+    FIELDS = ['dataset_name', 'task_name', 'subject', 'number', 'session']
+    search_args = {k: kwargs.pop(k) for k in FIELDS if k in kwargs}
+
+    if 'run_ids' in kwargs and search_args:
+        raise ValueError(f"Run filter arguments {search_args} cannot be provided if run_ids are provided")
+    return search_args
+
+
+def find_runs(func, client=None):
     """ Decorator which finds runs for a given dataset and task names.
     Assumes that downstream function accepts names instead of ids 
     (i.e. has been decorated with names_to_ids)"""
     @wraps(func)
     def wrapper(*args, **kwargs):
-        api = pyns.Neuroscout()
-        FIELDS = ['dataset_name', 'task_name', 'subject', 'number', 'session']
-        search_args = {k: kwargs.pop(k) for k in FIELDS if k in kwargs}
+        api = _resolve_client(client, args)
+        search_args = _run_search_args(kwargs)
 
-        if 'run_ids' not in kwargs and search_args:
+        if search_args:
             kwargs['run_id'] = [r['id'] for r in api.runs.get(**search_args)]
             if not kwargs['run_id']:
                 raise ValueError("No runs found using provided arguments")
-        elif 'run_ids' in kwargs and search_args:
-            raise ValueError(f"Run filter arguments {search_args} cannot be provided if run_ids are provided")
         return func(*args, **kwargs)
     return wrapper
 
 
-def _id_to_entities(df):
+RUN_ENTITIES = ['subject', 'session', 'number', 'acquisition']
+
+
+def _is_arrow(df):
+    # Arrow tables can only exist once pyarrow is imported
+    pa = sys.modules.get('pyarrow')
+    return pa is not None and isinstance(df, pa.Table)
+
+
+def _unique_ids(df):
+    """ Unique, non-null values of each `_id` column of a DataFrame or
+    Arrow table """
+    if _is_arrow(df):
+        return {
+            col: pyarrow_compute.unique(df[col]).drop_null().to_pylist()
+            for col in df.column_names if col.endswith('_id')}
+    return {col: df[col].dropna().unique()
+            for col in df.columns if col.endswith('_id')}
+
+
+def _entity_lookups(df, api):
+    """ Yield (column, endpoint, unique ids, catalog plan) for each `_id`
+    column """
+    all_ids = _unique_ids(df)
+    for col, ids in all_ids.items():
+        endpoint = getattr(api, col.replace('_id', 's'), None)
+        if endpoint is None:
+            warnings.warn(f"No API endpoint for {col}, could not convert")
+            continue
+        yield col, endpoint, ids, _catalog(col, ids, all_ids.get('run_id'))
+
+
+# Minimum number of unique ids for which to list a catalog of resources,
+# rather than get each one
+CATALOG_MIN_IDS = 3
+
+# Maximum number of run ids per request when listing predictors by run
+RUN_ID_CHUNK = 200
+
+
+def _catalog(col, ids, run_ids=None):
+    """ Plan list requests for the resources referenced by `col`, given
+    the unique `ids` in it, and in the frame's `run_id` column (if any).
+
+    A generator which yields (endpoint name, get arguments) and is sent the
+    response to each. Returns the listed records, which may not cover all
+    `ids`; the rest are fetched individually.
+    """
+    records = []
+    if len(ids) < CATALOG_MIN_IDS:
+        return records
+
+    if col == 'run_id':
+        # List all runs of the dataset a run belongs to
+        run = yield 'runs', {'id': int(ids[0])}
+        records = [run]
+        if 'dataset_id' in run:
+            records = yield 'runs', {'dataset_id': run['dataset_id']}
+    elif col == 'predictor_id' and run_ids is not None:
+        # Listing costs a request per chunk of runs, and returns all of
+        # their predictors, so only list if fewer requests than ids
+        if math.ceil(len(run_ids) / RUN_ID_CHUNK) >= len(ids):
+            return records
+        run_ids = sorted(int(r) for r in run_ids)
+        for i in range(0, len(run_ids), RUN_ID_CHUNK):
+            records += (yield 'predictors',
+                        {'run_id': run_ids[i:i + RUN_ID_CHUNK]})
+    elif col == 'dataset_id':
+        records = yield 'datasets', {}
+    return records
+
+
+def _run_catalog(plan, api):
+    """ Make the requests of a :func:`_catalog` plan, and return records """
+    try:
+        endpoint, kwargs = next(plan)
+        while True:
+            endpoint, kwargs = plan.send(getattr(api, endpoint).get(**kwargs))
+    except StopIteration as stop:
+        return stop.value
+
+
+def _entity_fields(col):
+    """ Resource fields to attach for `col`, and their column names """
+    if col == 'run_id':
+        return {e: e for e in RUN_ENTITIES}
+    return {'name': col.replace('_id', '_name')}
+
+
+def _missing_ids(ids, records):
+    """ Ids not found in records """
+    found = {r['id'] for r in records}
+    return [i for i in ids if i not in found]
+
+
+def _apply_entities(df, col, records):
+    """ Merge looked up resources onto the frame. For run_id, adds run
+    entities, otherwise a `_name` column """
+    fields = _entity_fields(col)
+    if _is_arrow(df):
+        return _apply_arrow_entities(df, col, records, fields)
+
+    lookup = pd.DataFrame(records, columns=['id'] + list(fields))
+    lookup = lookup.drop_duplicates('id').set_index('id').rename(
+        columns=fields)
+    merged = df[[col]].merge(
+        lookup, how='left', left_on=col, right_index=True)
+    for name in fields.values():
+        df[name] = merged[name].to_numpy()
+    return df
+
+
+def _apply_arrow_entities(table, col, records, fields):
+    """ Arrow :func:`_apply_entities`. Existing columns are not copied;
+    looked up columns are gathered by the position of each id """
+    unique = {r['id']: r for r in records}.values()
+    lookup = pyarrow.Table.from_pylist(
+        [{k: r.get(k) for k in ['id'] + list(fields)} for r in unique])
+    index = pyarrow_compute.index_in(
+        table[col], value_set=lookup['id'].combine_chunks().cast(
+            table[col].type))
+    for field, name in fields.items():
+        values = lookup[field].take(index)
+        if name in table.column_names:
+            table = table.set_column(
+                table.column_names.index(name), name, values)
+        else:
+            table = table.append_column(name, values)
+    return table
+
+
+def _id_to_entities(df, api=None):
     """ Given a column of ids, return a column of names, or in the case of
-    run_id, a column of dataset_name, task_name, and predictor_name """
-    api = pyns.Neuroscout()
+    run_id, a column of dataset_name, task_name, and predictor_name.
+    Accepts a DataFrame or Arrow table.
+
+    Each resource type is listed in bulk where possible (see `_catalog`),
+    and only ids not listed are fetched one by one. """
+    if api is None:
+        api = pyns.Neuroscout()
+    for col, endpoint, ids, plan in list(_entity_lookups(df, api)):
+        records = _run_catalog(plan, api)
+        missing = _missing_ids(ids, records)
+        if missing:
+            records += endpoint.get_many(missing, return_exceptions=False)
+        df = _apply_entities(df, col, records)
+    return df
+
+
+# Object columns with at most this ratio of unique values to rows become
+# categoricals in compact frames
+CATEGORY_RATIO = 0.5
+
+# Text columns which hold numbers, e.g. predictor event amplitudes
+NUMERIC_TEXT_COLUMNS = ['value', 'amplitude']
+
+
+def _compact_df(df):
+    """ Convert columns to compact dtypes: float32 and int32 for numbers
+    (including numeric event values), categoricals for repeated strings,
+    and pyarrow-backed strings (if installed) for other text. Columns of
+    other objects (e.g. lists) are left as is. """
     for col in df.columns:
-        if col.endswith('_id'):
+        values = df[col]
+        is_text = values.dtype == object or \
+            pd.api.types.is_string_dtype(values)
+        if is_text and col in NUMERIC_TEXT_COLUMNS:
+            numeric = pd.to_numeric(values, errors='coerce')
+            if not (numeric.isna() & values.notna()).any():
+                values, is_text = numeric, False
+
+        if pd.api.types.is_bool_dtype(values):
+            continue
+        elif pd.api.types.is_float_dtype(values):
+            values = values.astype(np.float32)
+        elif pd.api.types.is_integer_dtype(values):
+            info = np.iinfo(np.int32)
+            if values.min() >= info.min and values.max() <= info.max:
+                values = values.astype(np.int32)
+        elif is_text:
             try:
-                endpoint = getattr(api, col.replace('_id', 's'))
-            except:
-                warnings.warn(f"No API endpoint for {col}, could not convert")
-                
-            if col == 'run_id':
-                ents = ['subject', 'session', 'number', 'acquisition']
-                entities = {
-                    'subject': {},
-                    'session': {},
-                    'number': {},
-                    'acquisition': {}
-                }
-                for r in df[col].unique():
-                    res = endpoint.get(r)
-                    for e in entities:
-                        entities[e][r] = res[e]
-
-                for e, mapping in entities.items():
-                    df[e] = df[col].map(mapping)        
-            else:
-                names = {
-                    r: endpoint.get(r)['name'] 
-                    for r in df[col].dropna().unique()
-                    }
-                df[col.replace('_id', '_name')] = df[col].map(names)
+                n_unique = values.nunique()
+            except TypeError:  # Unhashable, e.g. lists
+                continue
+            if n_unique <= CATEGORY_RATIO * len(values):
+                values = values.astype('category')
+            elif pyarrow:
+                try:
+                    values = values.astype('string[pyarrow]')
+                except (TypeError, ValueError, pyarrow.ArrowException):
+                    continue
+        df[col] = values
     return df
 
-def to_df(func):
-    """ Adds automatic conversion to pandas dataframe """
+
+def _check_output_type(output_type):
+    if output_type not in ['df', 'arrow', 'polars', 'json']:
+        raise ValueError("Invalid output type")
+
+
+def _as_frame(res, output_type):
+    """ Build a DataFrame, or an Arrow table for 'arrow' and 'polars'
+    outputs, from a list of records. Records are decoded straight into
+    Arrow columns, without intermediate pandas objects. """
+    if not isinstance(res, list):
+        raise ValueError("Cannot convert to dataframe")
+    if output_type == 'df':
+        return pd.DataFrame(res)
+    if not pyarrow:
+        raise ImportError(
+            "pyarrow is required for output_type='{}'".format(output_type))
+    if output_type == 'polars' and not polars:
+        raise ImportError("polars is required for output_type='polars'")
+    return pyarrow.Table.from_pylist(res)
+
+
+def _finish_frame(res, output_type, compact=False):
+    """ Final conversion of a frame built by `_as_frame` """
+    if output_type == 'polars':
+        return polars.from_arrow(res)
+    if output_type == 'df' and compact:
+        return _compact_df(res)
+    return res
+
+
+def to_df(func, client=None):
+    """ Adds automatic conversion to pandas dataframe, or with
+    output_type='arrow' or 'polars', to an Arrow table or Polars DataFrame.
+    With `compact=True`, DataFrame columns are converted to compact dtypes
+    (see `_compact_df`). With `resolve_ids=False`, `_id` columns are not
+    converted to entities """
     @wraps(func)
-    def wrapper(*args, output_type='json', **kwargs):
-        if output_type not in ['df', 'json']:
-            raise ValueError("Invalid output type")
+    def wrapper(*args, output_type='json', compact=False, resolve_ids=True,
+                **kwargs):
+        _check_output_type(output_type)
         res = func(*args, **kwargs)
 
-        if output_type == 'df':
-            if isinstance(res, list):
-                res = _id_to_entities(pd.DataFrame(res))
-            else:
-                raise ValueError("Cannot convert to dataframe")
+        if output_type != 'json':
+            res = _as_frame(res, output_type)
+            if resolve_ids:
+                res = _id_to_entities(res, api=_resolve_client(client, args))
+            res = _finish_frame(res, output_type, compact)
         return res
-    return wrapper
\ No newline at end of file
+    return wrapper
@@ -18,6 +18,40 @@ def attempt_to_import(dependency, name=None, fromlist=None):
     return mod
 
 
+class LazyModule:
+    """ Dependency imported (with `attempt_to_import`) on first attribute
+    access. Evaluates to False if the dependency is not installed. """
+    def __init__(self, dependency, name=None, fromlist=None):
+        self._args = (dependency, name, fromlist)
+        self._module = None
+        self._loaded = False
+
+    def _load(self):
+        if not self._loaded:
+            self._module = attempt_to_import(*self._args)
+            self._loaded = True
+        return self._module
+
+    def __getattr__(self, attr):
+        mod = self._load()
+        if mod is None:
+            raise ImportError(
+                "{} is required for this operation".format(self._args[0]))
+        return getattr(mod, attr)
+
+    def __bool__(self):
+        return self._load() is not None
+
+    def __repr__(self):
+        return "<LazyModule {!r}{}>".format(
+            self._args[0], '' if self._loaded else ' (not loaded)')
+
+
+def lazy_import(dependency, name=None, fromlist=None):
+    """ Defer importing dependency until it is first used """
+    return LazyModule(dependency, name, fromlist)
+
+
 def build_model(name, variables, tasks, subjects, runs=None, session=None,
                 hrf_variables=None, transformations=None,
                 contrasts=None, dummy_contrasts=True):
@@ -1,7 +1,17 @@
 """ High-level utilities for fetching predictors from Neuroscout API """
-import math
+from collections import defaultdict
+from itertools import groupby
+from operator import itemgetter
+
+import numpy as np
 import pandas as pd
-from pyns import Neuroscout
+from pyns import Neuroscout, resampling
+from pyns.cache import EventCache
+from pyns.profiling import profiled, stage
+from pyns.transport import with_deadline
+from pyns.endpoints.base import (
+    RUN_ENTITIES, _compact_df, _entity_fields, _id_to_entities, pyarrow,
+    polars)
 from pathlib import Path
 
 try:
@@ -20,93 +30,400 @@ except ImportError:
     install = None
     get = None
 
+RUN_INFO_FIELDS = ['duration', 'tr', 'n_vols']
+
+
+def _get_run_info(api, dataset_name, run_ids):
+    """ Get duration, TR and number of volumes for runs.
+
+    Runs are fetched with a single listing of the dataset's runs, and TRs
+    once per distinct task, rather than one request per run.
+
+    Args:
+        api (pyns.Neuroscout): A instance of API.
+        dataset_name (str): Name of dataset the runs belong to.
+        run_ids (list): Run ids to get metadata for.
+
+    Returns:
+        run_info (pd.DataFrame): Run metadata, indexed by run_id.
+    """
+    runs = pd.DataFrame(api.runs.get(dataset_name=dataset_name))
+    runs = runs.rename(columns={'id': 'run_id'})
+    runs = runs[runs.run_id.isin(run_ids)]
+
+    missing = set(run_ids) - set(runs.run_id)
+    if missing:
+        runs = pd.concat([runs, pd.DataFrame(
+            api.runs.get_many(list(missing), return_exceptions=False)
+            ).rename(columns={'id': 'run_id'})])
+
+    task_ids = runs.task.unique()
+    trs = {
+        t: res['TR'] for t, res in zip(
+            task_ids, api.tasks.get_many(task_ids, return_exceptions=False))
+    }
+
+    run_info = runs[['run_id', 'duration', 'task']].set_index('run_id')
+    run_info['tr'] = run_info.task.map(trs)
+    # TODO: Fetch real number of volumes, or allowing passing it in
+    run_info['n_vols'] = np.ceil(
+        run_info.duration / run_info.tr).astype(int)
+
+    return run_info
+
+
+# Columns of predictor event frames: those stored by EventCache, followed
+# by the entities they are resolved to
+EVENT_COLUMNS = EventCache.columns + [
+    name for col in ('run_id', 'predictor_id')
+    for name in _entity_fields(col).values()]
+
+
+def _select_events(df):
+    """ Select and order `EVENT_COLUMNS`, so that event frames have the
+    same columns whether or not they were read from an event cache """
+    return df[[c for c in EVENT_COLUMNS if c in df.columns]]
+
+
+def _fetch_events(api, predictor_names, dataset_name, event_cache,
+                  **entities):
+    """ Fetch predictor events, reading stored shards from `event_cache`
+    and only requesting missing (predictor, run) pairs from the API.
+
+    Args:
+        api (pyns.Neuroscout): A instance of API.
+        predictor_names (list): Names of predictors to fetch.
+        dataset_name (str): Name of dataset to fetch predictors from.
+        event_cache (pyns.cache.EventCache): Store of predictor events.
+        entities (dict): Run entities to filter by.
+
+    Returns:
+        all_df (pd.DataFrame): Events with `EVENT_COLUMNS`, as from
+            `predictor_events.get` with output_type='df'.
+    """
+    run_ids = [
+        r['id'] for r in api.runs.get(dataset_name=dataset_name, **entities)]
+    if not run_ids:
+        raise ValueError("No runs found using provided arguments")
+    predictor_ids = [
+        p['id'] for p in api.predictors.get(
+            name=predictor_names, run_id=run_ids)]
+    if not predictor_ids:
+        raise ValueError("No predictor_name found using provided arguments")
+
+    cached, missing = event_cache.load(predictor_ids, run_ids)
+
+    # Predictors missing the same runs are requested together
+    by_runs = defaultdict(list)
+    for p, pairs in groupby(missing, key=itemgetter(0)):
+        by_runs[tuple(r for _, r in pairs)].append(p)
+
+    frames = [cached] if len(cached) else []
+    for rids, pids in by_runs.items():
+        events = event_cache.normalize(api.predictor_events.get(
+            predictor_id=pids, run_id=list(rids)))
+        event_cache.store(events, [(p, r) for p in pids for r in rids])
+        frames.append(events)
+
+    if not frames:
+        return pd.DataFrame(columns=EVENT_COLUMNS)
+    return _select_events(
+        _id_to_entities(pd.concat(frames, ignore_index=True), api=api))
+
+
+ENTITY_FIELDS = ['subject', 'session', 'run', 'acquisition', 'run_id']
+
+
+def _coerce_amplitudes(values):
+    """ Convert amplitudes to numbers, where possible.
+
+    Args:
+        values (pd.Series): Amplitudes.
+
+    Returns:
+        numeric (np.ndarray): Numeric amplitudes (NaN where not numeric).
+        failed (np.ndarray): Per row, whether its amplitude is not numeric.
+    """
+    numeric = pd.to_numeric(values, errors='coerce')
+    failed = numeric.isna() & values.notna()
+    return numeric.to_numpy(dtype=float), failed.to_numpy()
+
+
+def _build_variables(all_df, all_run_info):
+    """ Build one SparseRunVariable per (run, predictor) from all events.
+
+    Amplitude coercion, sorting and entity extraction are done once over
+    the whole frame, and each variable is built from contiguous slices of
+    the sorted columns. Amplitudes of a (run, predictor) are numeric if all
+    of them are, otherwise (e.g. strings) they keep their values.
+
+    Args:
+        all_df (pd.DataFrame): Events, with `onset`, `duration`,
+            `amplitude`, `predictor_name` and entity columns.
+        all_run_info (pd.DataFrame): Run metadata, indexed by run_id.
+
+    Returns:
+        variables (list): SparseRunVariables, ordered by run and predictor.
+    """
+    run_codes, run_ids = pd.factorize(all_df['run_id'], sort=True)
+    pred_codes, pred_names = pd.factorize(all_df['predictor_name'], sort=True)
+    onset = all_df['onset'].to_numpy()
+    order = np.lexsort((onset, pred_codes, run_codes))
+
+    run_codes, pred_codes = run_codes[order], pred_codes[order]
+    onset, duration = onset[order], all_df['duration'].to_numpy()[order]
+    numeric, failed = _coerce_amplitudes(all_df['amplitude'])
+    numeric, failed = numeric[order], failed[order]
+    raw = all_df['amplitude'].to_numpy()[order]
+
+    # Entities are constant within a run; keep those which are set
+    run_entities = {}
+    run_infos = {}
+    # Taken by column, as a row would upcast n_vols to float
+    run_fields = all_run_info[RUN_INFO_FIELDS].to_dict('index')
+    cols = [j for j in ENTITY_FIELDS if j in all_df.columns]
+    for row in all_df.drop_duplicates('run_id')[cols].to_dict('records'):
+        run_id = row['run_id']
+        entities = {j: val for j, val in row.items() if pd.notna(val) and val}
+        run_entities[run_id] = entities
+        run_infos[run_id] = RunInfo(
+            **run_fields[run_id], image=None, entities=entities)
+
+    # Boundaries of each (run, predictor) group in the sorted arrays
+    change = np.flatnonzero(
+        (np.diff(run_codes) != 0) | (np.diff(pred_codes) != 0)) + 1
+    starts = np.concatenate([[0], change])
+    stops = np.concatenate([change, [len(order)]])
+    if not len(order):
+        return []
+    group_failed = np.logical_or.reduceat(failed, starts)
+
+    variables = []
+    for start, stop, is_raw in zip(starts, stops, group_failed):
+        run_id = run_ids[run_codes[start]]
+        amplitude = raw[start:stop] if is_raw else numeric[start:stop]
+        data = pd.DataFrame({
+            'onset': onset[start:stop],
+            'duration': duration[start:stop],
+            'amplitude': amplitude,
+            **run_entities[run_id],
+        })
+        variables.append(SparseRunVariable(
+            pred_names[pred_codes[start]], data, run_infos[run_id],
+            'events'))
+
+    return variables
+
+
+TABLE_TYPES = ('arrow', 'polars')
+
+
+def _to_table(df, return_type):
+    """ Convert a DataFrame of predictors to an Arrow table, or a Polars
+    DataFrame (sharing the Arrow table's memory) """
+    if not pyarrow:
+        raise ImportError(
+            "pyarrow is required for return_type='{}'".format(return_type))
+    if return_type == 'polars' and not polars:
+        raise ImportError("polars is required for return_type='polars'")
+    try:
+        table = pyarrow.Table.from_pandas(df, preserve_index=False)
+    except (pyarrow.ArrowInvalid, pyarrow.ArrowTypeError):
+        # Arrow columns have a single type; store mixed columns as strings
+        df = df.astype({c: str for c in df.select_dtypes(object).columns})
+        table = pyarrow.Table.from_pandas(df, preserve_index=False)
+    return polars.from_arrow(table) if return_type == 'polars' else table
+
+
+def _fetch_dense(all_df, all_run_info, predictor_names, return_type,
+                 rescale):
+    """ Densify events to TR with the NumPy engine (see `pyns.resampling`).
+    Non-numeric predictors are dropped. """
+    numeric, failed = _coerce_amplitudes(all_df['amplitude'])
+    # As with pybids, a (run, predictor) is only numeric if all its events are
+    group_failed = pd.Series(failed, index=all_df.index).groupby(
+        [all_df['run_id'], all_df['predictor_name']]).transform('any')
+    all_df = all_df.assign(amplitude=numeric)[~group_failed.to_numpy()]
+    predictor_names = [
+        p for p in predictor_names if p in set(all_df.predictor_name)]
+
+    with stage('to_dense'):
+        dense = resampling.to_dense(
+            all_df, all_run_info, predictor_names, rescale=rescale)
+    if return_type == 'array':
+        return dense
+
+    with stage('to_df'):
+        sampling_rate = 1. / all_run_info.tr.iloc[0]
+        df = resampling.dense_to_df(
+            dense, all_df, predictor_names, sampling_rate)
+        sort_keys = [a for a in ['subject', 'session', 'run', 'acquisition', 'onset'] if a in df.columns]
+        df = df.sort_values(sort_keys)
+        sort_columns = ['onset', 'duration'] + predictor_names
+        sort_columns += df.columns.difference(sort_columns).tolist()
+        df = df[sort_columns]
+        if return_type in TABLE_TYPES:
+            df = _to_table(df, return_type)
+    return df
+
+
+@profiled
+@with_deadline
 def fetch_predictors(predictor_names, dataset_name, return_type='df', rescale=False,
-    resample=True, api=None, **entities):
-    """ Fetch predictors from Neuroscout API, and return as a 
+    resample=True, api=None, engine='pybids', event_cache=None, compact=False,
+    **entities):
+    """ Fetch predictors from Neuroscout API, and return as a
     BIDSRunVariableCollection or pandas DataFrame
 
     Args:
         predictor_names (str): Mame of predictors to fetch.
         dataset_name (str): Name of dataset to fetch predictors from.
-        return_type (str): Either 'df' or 'BIDSRunVariableCollection'.
+        return_type (str): Either 'df', 'arrow' (pyarrow Table), 'polars'
+            (Polars DataFrame) or 'BIDSRunVariableCollection'. With
+            engine='numpy', 'array' (a dictionary of run_id to array of
+            shape (samples, predictors)) instead of a collection.
         rescale (bool): Whether to rescale predictors to mean 0, std 1.
         resample (bool): Whether to resample predictors to TR.
         api (pyns.Neuroscout): A instance of API (if None, will create one).
+        engine (str): Either 'pybids', or 'numpy' to resample with
+            `pyns.resampling`, which is faster and does not require pybids.
+            With 'numpy', `onset` is relative to the start of each run,
+            and non-numeric predictors are dropped.
+        event_cache (pyns.cache.EventCache): Store events locally, and only
+            fetch those not yet stored. Either an EventCache, a directory
+            for one, or True to use the `NEUROSCOUT_CACHE_DIR` directory.
+        compact (bool): Load events with compact dtypes (categoricals,
+            float32), which reduces memory use and speeds up grouping.
+            Event timing and values are then single precision.
+        deadline (float): Maximum time (s) for all requests made. Raises
+            `pyns.transport.DeadlineExceeded` once it has passed.
+        profile (bool): Record the wall time and peak memory of each stage
+            (api_fetch, run_metadata, variables, rescale, to_dense, to_df),
+            and return a (result, `pyns.profiling.ProfileReport`) tuple.
         entities (dict): Entities to filter by. e.g.: 'subject', 'session', 'run'.
     """
+    if engine not in ('pybids', 'numpy'):
+        raise ValueError("engine must be either 'pybids' or 'numpy'")
+    if engine == 'numpy':
+        if not resample:
+            raise ValueError("engine='numpy' requires resample=True")
+        if return_type not in ('df', 'array') + TABLE_TYPES:
+            raise ValueError(
+                "return_type must be one of 'df', 'arrow', 'polars' or "
+                "'array' with engine='numpy'")
+    elif SparseRunVariable is None:
+        raise ImportError("bids.variables is required to fetch predictors. Please install pybids.")
+
     if api is None:
         api = Neuroscout()
 
-    if SparseRunVariable is None:
-        raise ImportError("bids.variables is required to fetch predictors. Please install pybids.")
-
     # Fetch from API
     if 'run' in entities:
         entities['number'] = entities.pop('run')
-    all_df = api.predictor_events.get(
-        predictor_name=predictor_names, dataset_name=dataset_name, output_type='df', **entities)
-    all_df = all_df.rename(columns={'number': 'run', 'value': 'amplitude'})
-    
+    with stage('api_fetch'):
+        if event_cache is not None and event_cache is not False:
+            if not isinstance(event_cache, EventCache):
+                event_cache = EventCache(
+                    None if event_cache is True else event_cache)
+            all_df = _fetch_events(
+                api, predictor_names, dataset_name, event_cache, **entities)
+            if compact:
+                all_df = _compact_df(all_df)
+        else:
+            all_df = api.predictor_events.get(
+                predictor_name=predictor_names, dataset_name=dataset_name, output_type='df',
+                compact=compact, **entities)
+            all_df = _select_events(all_df)
+        all_df = all_df.rename(columns={'number': 'run', 'value': 'amplitude'})
+
     # Get run-level metadata
-    all_run_info = {}
-    for run_id in all_df.run_id.unique():
-        resp = api.runs.get(run_id)
-        ri = {
-            'duration': resp['duration'],
-            'tr': api.tasks.get(resp['task'])['TR'],
-            'image': None
-        }
-        
-        # TODO: Fetch real number of volumes, or allowing passing it in
-        ri['n_vols'] = math.ceil(ri['duration'] / ri['tr'])
-        all_run_info[run_id] = ri
-        
-    # Create BIDSRunVariableCollection
-    variables = []
-    for (run_id, names), df in all_df.groupby(['run_id', 'predictor_name']):
-        # Determine entities / run info
-        keep_cols = []
-        entities = {}
-        for j in ['subject', 'session', 'run', 'acquisition', 'run_id']:
-            val = df[j].iloc[0]
-            if val:
-                entities[j] = val
-                keep_cols.append(j)
-        run_info = RunInfo(**all_run_info[run_id], entities=entities)
+    with stage('run_metadata'):
+        all_run_info = _get_run_info(
+            api, dataset_name, all_df.run_id.unique())
 
-        try:
-            df['amplitude'] = pd.to_numeric(df['amplitude'])
-        except ValueError:
-            pass
-        
-        df = df[['onset', 'duration', 'amplitude'] + keep_cols].sort_values('onset')
-        variables.append(SparseRunVariable(
-            names, df, run_info, 'events'))
-            
-    collection = BIDSRunVariableCollection(variables=variables)
+    if engine == 'numpy':
+        return _fetch_dense(
+            all_df, all_run_info, predictor_names, return_type, rescale)
+
+    # Create BIDSRunVariableCollection
+    with stage('variables'):
+        variables = _build_variables(all_df, all_run_info)
+        collection = BIDSRunVariableCollection(variables=variables)
 
     if rescale:
-        from bids.modeling.transformations import Scale
-        Scale(collection, predictor_names)
+        with stage('rescale'):
+            from bids.modeling.transformations import Scale
+            Scale(collection, predictor_names)
 
     if resample:
-        collection = collection.to_dense('TR')
+        with stage('to_dense'):
+            collection = collection.to_dense('TR')
 
-    if return_type == 'df':
-        collection = collection.to_df()
+    if return_type in ('df', ) + TABLE_TYPES:
+        with stage('to_df'):
+            collection = collection.to_df()
 
-        # Sort rows by keys
-        sort_keys = [a for a in ['subject', 'session', 'run', 'acquisition', 'onset'] if a in collection.columns]
-        collection = collection.sort_values(sort_keys)
+            # Sort rows by keys
+            sort_keys = [a for a in ['subject', 'session', 'run', 'acquisition', 'onset'] if a in collection.columns]
+            collection = collection.sort_values(sort_keys)
 
-        # Reorder columns
-        sort_columns = ['onset', 'duration'] + predictor_names
-        sort_columns += collection.columns.difference(sort_columns).tolist()
-        collection = collection[sort_columns]
+            # Reorder columns
+            sort_columns = ['onset', 'duration'] + predictor_names
+            sort_columns += collection.columns.difference(sort_columns).tolist()
+            collection = collection[sort_columns]
+
+            if return_type in TABLE_TYPES:
+                collection = _to_table(collection, return_type)
 
     return collection
 
 
+def iter_predictor_events(predictor_names, dataset_name, runs_per_chunk=1,
+    api=None, **entities):
+    """ Iterate over predictor events, one DataFrame per chunk of runs.
+
+    Each chunk of runs is a separate request, so that peak memory is
+    bounded by the events of one chunk, rather than the whole dataset.
+    Runs and predictors are looked up once, and their entities and names
+    attached to each chunk without further requests.
+
+    Args:
+        predictor_names (list): Names of predictors to fetch.
+        dataset_name (str): Name of dataset to fetch predictors from.
+        runs_per_chunk (int): Number of runs to request at once.
+        api (pyns.Neuroscout): A instance of API (if None, will create one).
+        entities (dict): Entities to filter by. e.g.: 'subject', 'session', 'run'.
+
+    Yields:
+        events (pd.DataFrame): Events for a chunk of runs, as from
+            `predictor_events.get` with output_type='df'. Chunks without
+            events are skipped.
+    """
+    if api is None:
+        api = Neuroscout()
+
+    if 'run' in entities:
+        entities['number'] = entities.pop('run')
+    runs = pd.DataFrame(api.runs.get(dataset_name=dataset_name, **entities))
+    if runs.empty:
+        raise ValueError("No runs found using provided arguments")
+    run_ids = sorted(runs.id)
+    predictors = api.predictors.get(name=predictor_names, run_id=run_ids)
+    if not predictors:
+        raise ValueError("No predictor_name found using provided arguments")
+
+    run_entities = runs.set_index('id')[RUN_ENTITIES]
+    names = {p['id']: p['name'] for p in predictors}
+    for i in range(0, len(run_ids), runs_per_chunk):
+        events = pd.DataFrame(api.predictor_events.get(
+            predictor_id=list(names), run_id=run_ids[i:i + runs_per_chunk]))
+        if events.empty:
+            continue
+        events = events.join(run_entities, on='run_id')
+        events['predictor_name'] = events.predictor_id.map(names)
+        yield events
+
+
 def get_paths(preproc_dir, fetch_json=False, fetch_brain_mask=False, **entities):
     """ Get paths to preprocessed images in a Neuroscout dataset.
 
@@ -123,7 +440,8 @@ def get_paths(preproc_dir, fetch_json=False, fetch_brain_mask=False, **entities)
     if BIDSLayout is None:
         raise ImportError("pybids is required to query dataset and associate with meta-data.")
     
-    layout = BIDSLayout(preproc_dir, derivatives=preproc_dir, index_metadata=False)
+    layout = BIDSLayout(preproc_dir, derivatives=preproc_dir,
+                        indexer=BIDSLayoutIndexer(index_metadata=False))
     
     # Identify functional runs
     paths = layout.get(desc='preproc', extension='.nii.gz', suffix='bold', 
@@ -177,6 +495,7 @@ def install_dataset(dataset_dir, preproc_address, no_get=False):
     return preproc_dir
 
 
+@profiled
 def fetch_images(dataset_name, data_dir, no_get=False, datalad_jobs='auto', 
     preproc_address=None, **kwargs):
     """ Fetch preprocessed images from a Neuroscout dataset.
@@ -189,6 +508,9 @@ def fetch_images(dataset_name, data_dir, no_get=False, datalad_jobs='auto',
         no_get (bool): Whether to skip fetching (i.e. dry run).
         datalad_jobs (int): Number of jobs to use for DataLad download.
         preproc_address (str): URL to install dataset from. Fetched from API if not provided.
+        profile (bool): Record the wall time and peak memory of each stage
+            (api_fetch, install, layout, get), and return a (result,
+            `pyns.profiling.ProfileReport`) tuple.
         kwargs: Additional arguments to pass to get_paths, including filters
         (e.g. subjects, runs, tasks).
 
@@ -207,19 +529,24 @@ def fetch_images(dataset_name, data_dir, no_get=False, datalad_jobs='auto',
         ]
     """
     if not preproc_address:
-        api = Neuroscout()
-        preproc_address = api.datasets.get(name=dataset_name)[0]['preproc_address']
+        with stage('api_fetch'):
+            api = Neuroscout()
+            preproc_address = api.datasets.get(name=dataset_name)[0]['preproc_address']
 
     data_dir = Path(data_dir)
     dataset_dir = data_dir / dataset_name
     
-    preproc_dir = install_dataset(dataset_dir, preproc_address, no_get=no_get)
+    with stage('install'):
+        preproc_dir = install_dataset(
+            dataset_dir, preproc_address, no_get=no_get)
     
-    paths = get_paths(preproc_dir, **kwargs)
+    with stage('layout'):
+        paths = get_paths(preproc_dir, **kwargs)
     
     if not no_get:
         try:
             # Get with DataLad
+            with stage('get'):
                 get([img.path for img in paths], dataset=dataset_dir, jobs=datalad_jobs)
 
         except Exception as exp:
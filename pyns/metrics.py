@@ -0,0 +1,158 @@
+""" Per-route request metrics, collected from client hooks """
+import json
+import threading
+import time
+from bisect import bisect_left
+
+# Upper bounds (s) of latency histogram buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10,
+                   30, 60)
+
+_COUNTERS = ('count', 'errors', 'cache_hits', 'coalesced', 'retries',
+             'request_bytes', 'response_bytes')
+
+
+def _labels(**labels):
+    return ','.join(
+        '{}="{}"'.format(k, str(v).replace('\\', '\\\\').replace('"', '\\"'))
+        for k, v in labels.items())
+
+
+class RequestMetrics:
+    """ Request hook aggregating latency histograms, throughput, errors and
+    bytes transferred per method and route. Thread-safe, so that one
+    collector can be shared by several clients.
+
+    Example:
+        metrics = RequestMetrics()
+        api = Neuroscout(hooks=[metrics])
+        ...
+        print(metrics.to_prometheus())
+    """
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        """ Initialize collector.
+
+        :param buckets: Upper bounds (s) of latency histogram buckets.
+        :type buckets: tuple
+        """
+        self.buckets = tuple(sorted(buckets))
+        self._lock = threading.Lock()
+        self.reset()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def reset(self):
+        """ Discard collected metrics """
+        with self._lock:
+            self._routes = {}
+            self._start = time.monotonic()
+
+    def __call__(self, event):
+        """ Record a :class:`.RequestEvent` """
+        failed = event.error is not None or (event.status or 0) >= 400
+        with self._lock:
+            stats = self._routes.get((event.method, event.route))
+            if stats is None:
+                stats = dict.fromkeys(_COUNTERS, 0)
+                stats['latency_sum'] = 0.
+                stats['latency_max'] = 0.
+                stats['buckets'] = [0] * len(self.buckets)
+                self._routes[(event.method, event.route)] = stats
+            stats['count'] += 1
+            stats['errors'] += failed
+            stats['cache_hits'] += event.cache_hit
+            stats['coalesced'] += event.coalesced
+            stats['retries'] += event.retries
+            stats['request_bytes'] += event.request_bytes
+            stats['response_bytes'] += event.response_bytes
+            stats['latency_sum'] += event.latency
+            stats['latency_max'] = max(stats['latency_max'], event.latency)
+            i = bisect_left(self.buckets, event.latency)
+            if i < len(self.buckets):
+                stats['buckets'][i] += 1
+
+    def summary(self):
+        """ Metrics of each method and route, slowest in total first.
+
+        :return: Records with the method, route, counts, total, mean and
+            maximum latency (s), throughput (requests per second since
+            the collector was created or reset), and the cumulative
+            latency histogram, as a dictionary of upper bound to count.
+        :rtype: list
+        """
+        with self._lock:
+            elapsed = max(time.monotonic() - self._start, 1e-9)
+            routes = [(key, dict(stats, buckets=list(stats['buckets'])))
+                      for key, stats in self._routes.items()]
+
+        records = []
+        for (method, route), stats in routes:
+            cumulative, histogram = 0, {}
+            for bound, count in zip(self.buckets, stats.pop('buckets')):
+                cumulative += count
+                histogram[bound] = cumulative
+            histogram['+Inf'] = stats['count']
+            records.append(dict(
+                method=method, route=route, **stats,
+                latency_mean=stats['latency_sum'] / stats['count'],
+                throughput=stats['count'] / elapsed,
+                histogram=histogram))
+        return sorted(records, key=lambda r: r['latency_sum'], reverse=True)
+
+    def to_json(self, **kwargs):
+        """ Metrics as a JSON string. See :meth:`summary`.
+
+        :param kwargs: Arguments to `json.dumps`, e.g. `indent`.
+        :type kwargs: dict
+        """
+        return json.dumps(self.summary(), **kwargs)
+
+    def to_prometheus(self, prefix='pyns'):
+        """ Metrics in the Prometheus text exposition format, e.g. to write
+        to a node exporter's textfile directory.
+
+        :param prefix: Prefix of metric names.
+        :type prefix: str
+        :rtype: str
+        """
+        summary = self.summary()
+        name = prefix + '_request_duration_seconds'
+        lines = ['# HELP {} Latency of API requests.'.format(name),
+                 '# TYPE {} histogram'.format(name)]
+        for record in summary:
+            labels = _labels(method=record['method'], route=record['route'])
+            for bound, count in record['histogram'].items():
+                lines.append('{}_bucket{{{},le="{}"}} {}'.format(
+                    name, labels, bound, count))
+            lines.append('{}_sum{{{}}} {}'.format(
+                name, labels, record['latency_sum']))
+            lines.append('{}_count{{{}}} {}'.format(
+                name, labels, record['count']))
+
+        counters = [
+            ('errors', 'request_errors', 'Failed API requests.'),
+            ('cache_hits', 'request_cache_hits',
+             'API requests served from cache.'),
+            ('coalesced', 'request_coalesced',
+             'API requests sharing the response of an identical request.'),
+            ('retries', 'request_retries', 'Retries of API requests.'),
+            ('request_bytes', 'sent_bytes', 'Bytes sent in API requests.'),
+            ('response_bytes', 'received_bytes',
+             'Bytes received in API responses.')]
+        for field, metric, doc in counters:
+            name = '{}_{}_total'.format(prefix, metric)
+            lines += ['# HELP {} {}'.format(name, doc),
+                      '# TYPE {} counter'.format(name)]
+            for record in summary:
+                lines.append('{}{{{}}} {}'.format(
+                    name, _labels(method=record['method'],
+                                  route=record['route']),
+                    record[field]))
+        return '\n'.join(lines) + '\n'
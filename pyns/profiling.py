@@ -0,0 +1,133 @@
+""" Stage-level wall time and peak memory profiling of bulk operations """
+import contextvars
+import time
+import tracemalloc
+from collections import namedtuple
+from contextlib import contextmanager
+from functools import wraps
+
+Stage = namedtuple('Stage', ['name', 'start', 'wall_time', 'peak_memory'])
+Stage.__doc__ = """ A profiled stage. `start` and `wall_time` are in
+seconds, from the start of profiling. `peak_memory` is the peak of memory
+allocated during the stage (bytes), above that allocated at its start """
+
+_PROFILE = contextvars.ContextVar('pyns_profile', default=None)
+
+
+class ProfileReport:
+    """ Stages recorded by :func:`profile`, in order of their start """
+    def __init__(self):
+        self.stages = []
+        self.wall_time = None
+        self.peak_memory = None
+        self._start = time.perf_counter()
+        self._frames = []
+        self._peak = 0
+        self._reset_peak = False
+
+    def _checkpoint(self):
+        """ Fold the peak since the last checkpoint into all open stages.
+        Returns memory currently allocated. """
+        current, peak = tracemalloc.get_traced_memory()
+        # The traced peak was only reached since the last checkpoint if it
+        # rose in the meantime, otherwise use the memory allocated now
+        high = peak if peak > self._peak else current
+        for frame in self._frames:
+            frame['peak'] = max(frame['peak'], high)
+        if self._reset_peak:
+            tracemalloc.reset_peak()
+            peak = current
+        self._peak = peak
+        return current
+
+    @contextmanager
+    def _stage(self, name):
+        start = time.perf_counter()
+        base = self._checkpoint()
+        frame = {'peak': base}
+        self._frames.append(frame)
+        try:
+            yield
+        finally:
+            self._checkpoint()
+            self._frames.pop()
+            self.stages.append(Stage(
+                name, start - self._start, time.perf_counter() - start,
+                frame['peak'] - base))
+            self.stages.sort(key=lambda s: s.start)
+
+    def as_dict(self):
+        """ Report as a JSON serializable dictionary """
+        return {'wall_time': self.wall_time, 'peak_memory': self.peak_memory,
+                'stages': [s._asdict() for s in self.stages]}
+
+    def __repr__(self):
+        lines = ['{:<20} {:>10} {:>12}'.format(
+            'stage', 'time (s)', 'peak (MiB)')]
+        for s in self.stages:
+            lines.append('{:<20} {:>10.3f} {:>12.1f}'.format(
+                s.name, s.wall_time, s.peak_memory / 2 ** 20))
+        if self.wall_time is not None:
+            lines.append('{:<20} {:>10.3f} {:>12.1f}'.format(
+                'total', self.wall_time, self.peak_memory / 2 ** 20))
+        return '\n'.join(lines)
+
+
+@contextmanager
+def profile():
+    """ Record the wall time and peak memory of each stage of the
+    operations run within this context, e.g.:
+
+        with profile() as report:
+            fetch_predictors(...)
+        print(report)
+
+    Memory is traced with `tracemalloc`, which covers Python and NumPy
+    allocations, and slows allocation heavy code while profiling. If
+    `tracemalloc` is already tracing, its peak is left untouched, and
+    (as on Python < 3.9) a stage peaking below an earlier peak reports
+    the most memory allocated at the boundaries of its nested stages.
+
+    :return: Report, completed on exit
+    :rtype: :class:`ProfileReport`
+    """
+    report = ProfileReport()
+    started = not tracemalloc.is_tracing()
+    if started:
+        tracemalloc.start()
+        report._reset_peak = hasattr(tracemalloc, 'reset_peak')
+    token = _PROFILE.set(report)
+    try:
+        with report._stage('total'):
+            yield report
+    finally:
+        _PROFILE.reset(token)
+        total = report.stages.pop(0)
+        report.wall_time = total.wall_time
+        report.peak_memory = total.peak_memory
+        if started:
+            tracemalloc.stop()
+
+
+@contextmanager
+def stage(name):
+    """ Record a stage of the current profile, if any """
+    report = _PROFILE.get()
+    if report is None:
+        yield
+    else:
+        with report._stage(name):
+            yield
+
+
+def profiled(func):
+    """ Decorator adding a `profile` argument. If True, `func` is run
+    within :func:`profile`, and returns a (result, report) tuple """
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        if not kwargs.pop('profile', False):
+            return func(*args, **kwargs)
+        with profile() as report:
+            result = func(*args, **kwargs)
+        return result, report
+    return wrapper
@@ -0,0 +1,211 @@
+""" NumPy engine to convert sparse predictor events into dense time series.
+
+This is a faster alternative to building pybids `SparseRunVariable` objects
+and calling `BIDSRunVariableCollection.to_dense`, used by
+:func:`pyns.fetch_utils.fetch_predictors` when `engine='numpy'`. All
+predictors sharing a bin rate and set of runs are densified together, as
+columns of a single array.
+
+To stay numerically equivalent to pybids, each predictor's runs are laid
+end to end at a rate which represents all onsets and durations exactly,
+low-pass filtered and linearly interpolated down to the target sampling
+rate, and then split back into runs.
+"""
+import math
+from collections import defaultdict
+
+import numpy as np
+import pandas as pd
+
+ENTITY_FIELDS = ['subject', 'session', 'run', 'acquisition', 'run_id']
+
+# Maximum number of bins (predictors x samples) painted at once, to bound
+# memory use with many predictors at a high bin rate
+MAX_BLOCK_BINS = 2 ** 24
+
+
+def _bin_rate(onset, duration, sampling_rate):
+    """ Largest rate (Hz) representing all timings to the millisecond,
+    and no lower than `sampling_rate` """
+    timings = np.round(np.r_[onset, duration] * 1000).astype(int)
+    gcd = np.gcd.reduce(timings) if len(timings) else 0
+    if gcd == 0:
+        return sampling_rate
+    return max(1000. / gcd, sampling_rate)
+
+
+def _paint(shape, starts, stops, columns, values):
+    """ Fill bins [start, stop) of each event's column (i.e. row of the
+    output, so that each time series is contiguous) with its value.
+    Where events of a column overlap, later events take precedence. """
+    ts = np.zeros(shape)
+    starts = np.clip(starts, 0, shape[1])
+    lengths = np.clip(np.clip(stops, 0, shape[1]) - starts, 0, None)
+    total = lengths.sum()
+    if total:
+        offsets = np.repeat(np.cumsum(lengths) - lengths, lengths)
+        index = np.arange(total) - offsets + np.repeat(starts, lengths)
+        # With repeated indices, NumPy assigns the last value
+        ts[np.repeat(columns, lengths), index] = np.repeat(values, lengths)
+    return ts
+
+
+def _downsample(ts, new_sr, old_sr, num):
+    """ Low-pass filter (if downsampling) and linearly interpolate each
+    row of `ts` to `num` samples, as `bids.variables` does """
+    n = ts.shape[1]
+    if new_sr < old_sr:
+        from scipy.signal import butter, filtfilt
+        b, a = butter(5, (new_sr / 2.0) / (old_sr / 2.0),
+                      btype='low', output='ba', analog=False)
+        ts = filtfilt(b, a, ts, axis=-1)
+
+    if n == 1:
+        return np.repeat(ts, num, axis=1)
+    x_new = np.linspace(0, n - 1, num=num)
+    left = np.clip(np.floor(x_new).astype(int), 0, n - 2)
+    weight = x_new - left
+    return ts[:, left] * (1 - weight) + ts[:, left + 1] * weight
+
+
+def _densify_block(events, runs, durations, n_columns, sampling_rate,
+                   bin_sr):
+    """ Densify events of predictors which occur in the same runs.
+
+    Args:
+        events (pd.DataFrame): Events, with a `column` index per predictor.
+        runs (list): Runs, in the order they are laid end to end.
+        durations (np.ndarray): Duration (s) of each run.
+        n_columns (int): Number of predictors.
+        sampling_rate (float): Target sampling rate (Hz).
+        bin_sr (float): Rate (Hz) at which to paint events.
+
+    Returns:
+        dense (dict): Array of shape (samples, n_columns) for each run.
+    """
+    offsets = np.concatenate([[0], np.cumsum(durations[:-1])]) * bin_sr
+    n_bins = math.ceil(round(bin_sr * durations.sum(), 3))
+
+    run_offset = pd.Series(offsets, index=runs).loc[
+        events.run_id].to_numpy()
+    starts = np.trunc(
+        run_offset + np.round(events.onset.to_numpy() * bin_sr)
+    ).astype(int)
+    stops = starts + np.round(
+        events.duration.to_numpy() * bin_sr).astype(int)
+
+    ts = _paint((n_columns, n_bins), starts, stops,
+                events.column.to_numpy(), events.amplitude.to_numpy())
+
+    if bin_sr != sampling_rate:
+        num = int(math.ceil(n_bins * sampling_rate / bin_sr))
+        ts = _downsample(ts, sampling_rate, bin_sr, num)
+
+    reps = [int(math.ceil(d * sampling_rate)) for d in durations]
+    bounds = np.cumsum([0] + reps)
+    return {r: ts[:, bounds[i]:bounds[i + 1]].T for i, r in enumerate(runs)}
+
+
+def to_dense(events, run_info, predictor_names, sampling_rate=None,
+             rescale=False):
+    """ Convert sparse predictor events to a dense array per run.
+
+    Args:
+        events (pd.DataFrame): Events with `run_id`, `predictor_name`,
+            `onset`, `duration` and numeric `amplitude` columns.
+        run_info (pd.DataFrame): Run metadata with `duration` and `tr`
+            columns, indexed by run_id.
+        predictor_names (list): Predictors to densify, in column order.
+        sampling_rate (float): Target sampling rate (Hz). Defaults to 1/TR,
+            which must then be the same for all runs.
+        rescale (bool): Whether to rescale each predictor's events to mean
+            0, std 1 (across all runs) before densifying.
+
+    Returns:
+        dense (dict): Array of shape (samples, predictors) for each run_id.
+            Predictors without events in a run are NaN.
+    """
+    if sampling_rate is None:
+        trs = run_info.loc[events.run_id.unique(), 'tr'].unique()
+        if len(trs) != 1:
+            raise ValueError(
+                "Non-unique Repetition times found ({!r}); specify "
+                "sampling_rate explicitly".format(list(trs)))
+        sampling_rate = 1. / trs[0]
+
+    events = events[events.predictor_name.isin(predictor_names)]
+    columns = {name: i for i, name in enumerate(predictor_names)}
+    events = events.assign(column=events.predictor_name.map(columns))
+    events = events.sort_values(['run_id', 'column', 'onset'],
+                                kind='stable')
+
+    if rescale:
+        grouped = events.groupby('column').amplitude
+        if (grouped.nunique() == 1).any():
+            raise ValueError("Cannot scale a predictor with constant value")
+        events['amplitude'] = (
+            events.amplitude - grouped.transform('mean')
+        ) / grouped.transform('std')
+
+    # Predictors can only be densified together if their events are laid
+    # out identically: same bin rate, and same runs
+    blocks = defaultdict(list)
+    for column, df in events.groupby('column'):
+        runs = tuple(df.run_id.unique())
+        bin_sr = _bin_rate(df.onset, df.duration, sampling_rate)
+        blocks[(bin_sr, runs)].append(column)
+
+    all_runs = sorted(events.run_id.unique())
+    dense = {
+        r: np.full(
+            (int(math.ceil(run_info.loc[r, 'duration'] * sampling_rate)),
+             len(predictor_names)), np.nan)
+        for r in all_runs
+    }
+    for (bin_sr, runs), block_columns in blocks.items():
+        durations = run_info.loc[list(runs), 'duration'].to_numpy(float)
+        size = max(1, MAX_BLOCK_BINS // int(bin_sr * durations.sum() + 1))
+        for i in range(0, len(block_columns), size):
+            chunk = block_columns[i:i + size]
+            block = events[events.column.isin(chunk)]
+            # Re-index columns within the chunk
+            block = block.assign(
+                column=block.column.map({c: j for j, c in enumerate(chunk)}))
+            for run_id, ts in _densify_block(
+                    block, list(runs), durations, len(chunk),
+                    sampling_rate, bin_sr).items():
+                dense[run_id][:len(ts), chunk] = ts
+
+    return dense
+
+
+def dense_to_df(dense, events, predictor_names, sampling_rate):
+    """ Convert the output of :func:`to_dense` to a long DataFrame, with
+    one row per sample and run, and columns for entities.
+
+    Args:
+        dense (dict): Array of shape (samples, predictors) for each run_id.
+        events (pd.DataFrame): Events, used to look up run entities.
+        predictor_names (list): Predictor names, in column order.
+        sampling_rate (float): Sampling rate (Hz) of `dense`.
+
+    Returns:
+        df (pd.DataFrame): Dense predictors with `onset` (relative to the
+            start of each run), `duration` and entity columns.
+    """
+    cols = [j for j in ENTITY_FIELDS if j in events.columns]
+    entities = events.drop_duplicates('run_id')[cols].set_index(
+        'run_id', drop=False)
+
+    frames = []
+    for run_id, values in dense.items():
+        n = len(values)
+        df = pd.DataFrame(values, columns=predictor_names)
+        df.insert(0, 'onset', np.arange(n) / sampling_rate)
+        df.insert(1, 'duration', 1. / sampling_rate)
+        for j, val in entities.loc[run_id].items():
+            if pd.notna(val) and val:
+                df[j] = val
+        frames.append(df)
+
+    return pd.concat(frames, ignore_index=True)
@@ -0,0 +1,4 @@
+""" Tools for testing and benchmarking pyns without the Neuroscout API """
+from .server import FixtureData, NeuroscoutServer, SyntheticData
+
+__all__ = ['FixtureData', 'NeuroscoutServer', 'SyntheticData']
@@ -0,0 +1,124 @@
+""" Offline replay of recorded (betamax) API interactions """
+import base64
+import gzip
+import json
+from collections import defaultdict
+from io import BytesIO
+from pathlib import Path
+from urllib.parse import urlsplit, parse_qsl
+
+from requests.adapters import HTTPAdapter
+from requests.exceptions import ConnectionError
+from urllib3.response import HTTPResponse
+
+# Response headers which do not apply to replayed bodies
+_DROP_HEADERS = {'transfer-encoding', 'content-length', 'content-encoding'}
+
+
+def _key(method, url):
+    """ Request key, ignoring the order of query arguments and of values
+    in comma separated lists """
+    split = urlsplit(url)
+    query = tuple(sorted(
+        (k, ','.join(sorted(v.split(','))))
+        for k, v in parse_qsl(split.query)))
+    return method.upper(), split.path.rstrip('/'), query
+
+
+def _scale_records(records, factor):
+    """ Replicate records `factor` times. Copies get new ids, or, for
+    events (without an id), later onsets, so that they remain distinct. """
+    if factor == 1 or not records or not all(
+            isinstance(r, dict) for r in records):
+        return records
+    if all(isinstance(r.get('id'), int) for r in records):
+        offset = max(r['id'] for r in records) + 1
+        return [dict(r, id=r['id'] + k * offset)
+                for k in range(factor) for r in records]
+    if all('onset' in r for r in records):
+        offset = max(r['onset'] + (r.get('duration') or 0) for r in records)
+        return [dict(r, onset=r['onset'] + k * offset)
+                for k in range(factor) for r in records]
+    return [dict(r) for _ in range(factor) for r in records]
+
+
+def load_cassettes(paths, scale=1):
+    """ Load interactions from betamax cassettes.
+
+    Args:
+        paths (list): Cassette files, or directories of them.
+        scale (int): Factor to replicate the records of list responses by,
+            to simulate larger datasets.
+
+    Returns:
+        interactions (list): (method, url, status, headers, body) tuples,
+            with decoded bodies
+    """
+    files = []
+    for path in map(Path, paths):
+        files += sorted(path.glob('*.json')) if path.is_dir() else [path]
+
+    interactions = []
+    for file in files:
+        for item in json.loads(file.read_text())['http_interactions']:
+            request, response = item['request'], item['response']
+            body = response['body']
+            if body.get('base64_string'):
+                content = base64.b64decode(body['base64_string'])
+            else:
+                content = (body.get('string') or '').encode()
+            if content[:2] == b'\x1f\x8b':
+                content = gzip.decompress(content)
+            headers = {k: v[0] if isinstance(v, list) else v
+                       for k, v in response['headers'].items()
+                       if k.lower() not in _DROP_HEADERS}
+            if scale != 1 and headers.get('Content-Type') == \
+                    'application/json':
+                records = json.loads(content or b'null')
+                if isinstance(records, list):
+                    content = json.dumps(
+                        _scale_records(records, scale)).encode()
+            interactions.append((
+                request['method'], request['uri'],
+                response['status']['code'], headers, content))
+    return interactions
+
+
+class ReplayAdapter(HTTPAdapter):
+    """ Transport adapter answering requests with recorded responses, for
+    benchmarking the client without the network.
+
+    Requests are matched on method, path and query. Responses recorded for
+    the same request (e.g. when polling) are replayed in order, and the
+    last is then repeated. Unmatched requests raise a ConnectionError.
+
+    Example:
+        adapter = ReplayAdapter(load_cassettes(['tests/cassettes']))
+        api._session.mount('https://', adapter)
+    """
+    def __init__(self, interactions, **kwargs):
+        super().__init__(**kwargs)
+        self._responses = defaultdict(list)
+        for method, url, status, headers, body in interactions:
+            self._responses[_key(method, url)].append(
+                (status, headers, body))
+        self._served = defaultdict(int)
+
+    def send(self, request, **kwargs):
+        key = _key(request.method, request.url)
+        responses = self._responses.get(key)
+        if not responses:
+            raise ConnectionError(
+                "No recorded response for {} {}".format(
+                    request.method, request.url), request=request)
+        i = min(self._served[key], len(responses) - 1)
+        self._served[key] += 1
+        status, headers, body = responses[i]
+        raw = HTTPResponse(
+            body=BytesIO(body), status=status, preload_content=False,
+            headers=dict(headers, **{'Content-Length': str(len(body))}))
+        return self.build_response(request, raw)
+
+    def rewind(self):
+        """ Replay responses from the first again """
+        self._served.clear()
@@ -0,0 +1,584 @@
+""" Local stand-in for the Neuroscout API.
+
+Serves the routes used by pyns from fixture or synthetic datasets, so that
+the client can be tested, benchmarked and load tested without
+neuroscout.org. Latency and server errors can be injected, and all
+requests are recorded.
+
+Run from the command line with, e.g.:
+
+    python -m pyns.testing.server --runs 1000 --predictors 500
+"""
+import argparse
+import gzip
+import io
+import json
+import random
+import string
+import tarfile
+import threading
+import time
+from datetime import datetime, timedelta
+from email.parser import BytesParser
+from email.policy import HTTP
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+import jwt
+
+RESOURCES = ('datasets', 'tasks', 'runs', 'predictors')
+
+# Query arguments which map onto a differently named record field
+FIELD_ALIASES = {'task_id': 'task'}
+
+
+def make_token(email, lifetime=timedelta(hours=1)):
+    """ Build an unsigned-verification JWT similar to the API's """
+    now = datetime.utcnow()
+    payload = {'identity': email, 'iat': now, 'nbf': now,
+               'exp': now + lifetime}
+    token = jwt.encode(payload, 'stub-secret', algorithm='HS256')
+    return token.decode() if isinstance(token, bytes) else token
+
+
+def _matches(record, query):
+    """ Whether a record matches all query arguments which are fields of
+    it. Query values are sets of strings. """
+    for key, values in query.items():
+        field = FIELD_ALIASES.get(key, key)
+        if field in record and str(record[field]) not in values:
+            return False
+    return True
+
+
+class FixtureData:
+    """ Datasets, tasks, runs, predictors and predictor events to serve,
+    from lists of records """
+
+    def __init__(self, datasets, tasks, runs, predictors, events=()):
+        """ Initialize data.
+
+        :param datasets: Dataset records, each with an `id`.
+        :type datasets: list
+        :param tasks: Task records.
+        :type tasks: list
+        :param runs: Run records.
+        :type runs: list
+        :param predictors: Predictor records.
+        :type predictors: list
+        :param events: Predictor event records.
+        :type events: list
+        """
+        self.resources = {'datasets': list(datasets), 'tasks': list(tasks),
+                          'runs': list(runs),
+                          'predictors': list(predictors)}
+        self._index = {
+            route: {str(r['id']): r for r in records}
+            for route, records in self.resources.items()}
+        self._events = list(events)
+
+    def list(self, route, query):
+        """ Records of a route matching the query """
+        return [r for r in self.resources[route] if _matches(r, query)]
+
+    def get(self, route, id):
+        """ Record of a route by id, or None """
+        return self._index[route].get(str(id))
+
+    def events(self, query):
+        """ Predictor events matching the query """
+        return [e for e in self._events if _matches(e, query)]
+
+
+class SyntheticData(FixtureData):
+    """ A synthetic dataset of arbitrary size. Predictor events are
+    generated on request, deterministically, so that large datasets take
+    little memory. """
+
+    def __init__(self, n_runs=1000, n_predictors=500, runs_per_subject=4,
+                 events_per_run=50, run_duration=600., tr=2., seed=0,
+                 dataset_name='Synthetic'):
+        """ Initialize data.
+
+        :param n_runs: Number of runs.
+        :type n_runs: int
+        :param n_predictors: Number of predictors, each with events in
+            every run.
+        :type n_predictors: int
+        :param runs_per_subject: Number of runs of each subject.
+        :type runs_per_subject: int
+        :param events_per_run: Events per run and predictor.
+        :type events_per_run: int
+        :param run_duration: Duration (s) of each run.
+        :type run_duration: float
+        :param tr: Repetition time (s) of the task.
+        :type tr: float
+        :param seed: Seed of event values.
+        :type seed: int
+        :param dataset_name: Name of the dataset.
+        :type dataset_name: str
+        """
+        self.events_per_run = events_per_run
+        self.seed = seed
+        datasets = [{
+            'id': 1, 'name': dataset_name, 'active': True,
+            'preproc_address': 'https://example.org/synthetic',
+            'tasks': [{'id': 1, 'name': 'task'}]}]
+        tasks = [{'id': 1, 'name': 'task', 'dataset_id': 1, 'TR': tr}]
+        runs = [
+            {'id': i + 1, 'dataset_id': 1, 'task': 1, 'task_name': 'task',
+             'subject': '%03d' % (i // runs_per_subject + 1),
+             'session': None, 'number': i % runs_per_subject + 1,
+             'acquisition': None, 'duration': run_duration}
+            for i in range(n_runs)]
+        predictors = [
+            {'id': i + 1, 'name': 'predictor_%03d' % i, 'dataset_id': 1,
+             'source': 'synthetic'}
+            for i in range(n_predictors)]
+        super().__init__(datasets, tasks, runs, predictors)
+
+    def events(self, query):
+        """ Generate the events of the queried runs and predictors """
+        runs = [r for r in self.resources['runs'] if _matches(
+            r, {k.replace('run_id', 'id'): v for k, v in query.items()
+                if k in ('run_id', 'subject', 'number', 'session')})]
+        predictor_ids = [
+            p['id'] for p in self.resources['predictors']
+            if _matches(p, {'id': query['predictor_id']}
+                        if 'predictor_id' in query else {})]
+        events = []
+        for run in runs:
+            step = run['duration'] / self.events_per_run
+            for pid in predictor_ids:
+                rng = random.Random(
+                    (self.seed * 1000003 + run['id']) * 1000003 + pid)
+                events.extend(
+                    {'run_id': run['id'], 'predictor_id': pid,
+                     'onset': round(i * step, 3),
+                     'duration': round(step, 3),
+                     'value': str(round(rng.gauss(0, 1), 6))}
+                    for i in range(self.events_per_run))
+        return events
+
+
+class NeuroscoutHandler(BaseHTTPRequestHandler):
+    """ Routes requests to the :class:`NeuroscoutServer` """
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def log_message(self, *args):
+        pass
+
+    @property
+    def app(self):
+        return self.server.app
+
+    def _send(self, status, body, content_type='application/json',
+              headers=None):
+        payload = body if isinstance(body, bytes) else \
+            json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        for key, value in (headers or {}).items():
+            self.send_header(key, str(value))
+        if 'gzip' in self.headers.get('Accept-Encoding', '') and \
+                content_type == 'application/json':
+            payload = gzip.compress(payload, compresslevel=5)
+            self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        try:
+            self.wfile.write(payload)
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # Client gave up, e.g. on a timeout
+
+    def _handle(self, method):
+        url = urlparse(self.path)
+        query = {k: set(','.join(v).split(','))
+                 for k, v in parse_qs(url.query).items()}
+        parts = [p for p in url.path.split('/') if p][1:]  # Strip 'api'
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        if self.headers.get('Content-Encoding') == 'gzip':
+            body = gzip.decompress(body)
+
+        failure = self.app._intercept(method, parts, query)
+        if failure is not None:
+            status, headers = failure
+            return self._send(status, {'message': 'Unavailable'},
+                              headers=headers)
+        try:
+            result = self.app.route(
+                method, parts, query, body, self.headers)
+        except KeyError as error:
+            return self._send(404, {'message': 'Not found: {}'.format(
+                error)})
+        self._send(*result)
+
+    def do_GET(self):
+        self._handle('GET')
+
+    def do_POST(self):
+        self._handle('POST')
+
+    def do_PUT(self):
+        self._handle('PUT')
+
+    def do_DELETE(self):
+        self._handle('DELETE')
+
+
+class _HTTPServer(ThreadingHTTPServer):
+    # Accept bursts of connections from many client threads
+    request_queue_size = 128
+
+
+class NeuroscoutServer:
+    """ Local stand-in for the Neuroscout API, run on a background thread.
+
+    Serves `auth`, `user`, `datasets`, `tasks`, `runs`, `predictors` and
+    `predictor-events` from `data`, and `analyses` (including `compile`,
+    `report`, `upload`, `bundle`, `full`, `resources`, `clone` and `fill`)
+    from an in-memory store. POSTs to other resources echo the body with a
+    new id, without storing it.
+
+    Example:
+        with NeuroscoutServer(SyntheticData(n_runs=1000)) as server:
+            api = Neuroscout(email='user@example.com', password='password',
+                             api_base_url=server.url)
+    """
+
+    def __init__(self, data=None, latency=0, error_rate=0, job_time=0,
+                 token_lifetime=3600, seed=None, host='127.0.0.1', port=0):
+        """ Initialize server.
+
+        :param data: Data to serve. Defaults to a small
+            :class:`SyntheticData`.
+        :type data: :class:`FixtureData`, optional
+        :param latency: Delay (s) of every response, or a (min, max) range
+            to draw delays from.
+        :type latency: float or tuple
+        :param error_rate: Probability of responding to a request (other
+            than `auth`) with a 503 error.
+        :type error_rate: float
+        :param job_time: Time (s) compile and report jobs stay PENDING.
+        :type job_time: float
+        :param token_lifetime: Time (s) until issued tokens expire.
+        :type token_lifetime: float
+        :param seed: Seed of injected latencies and errors.
+        :type seed: int, optional
+        :param host: Host to listen on.
+        :type host: str
+        :param port: Port to listen on. By default, any free port.
+        :type port: int
+        """
+        self.data = data if data is not None else SyntheticData(
+            n_runs=8, n_predictors=4, events_per_run=10, run_duration=30.)
+        self.latency = latency
+        self.error_rate = error_rate
+        self.job_time = job_time
+        self.token_lifetime = token_lifetime
+        self.analyses = {}
+        self.uploads = {}
+        self.requests = []
+        self._failures = {}
+        self._delays = {}
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._store_lock = threading.RLock()
+        self._next_id = 10 ** 6
+
+        self.httpd = _HTTPServer((host, port), NeuroscoutHandler)
+        self.httpd.app = self
+        self.thread = threading.Thread(
+            target=self.httpd.serve_forever, daemon=True)
+
+    @property
+    def url(self):
+        """ Base URL of the API, for `api_base_url` """
+        host, port = self.httpd.server_address[:2]
+        return 'http://{}:{}/api'.format(host, port)
+
+    def count(self, method=None, route=None):
+        """ Number of recorded requests matching method and route """
+        return len([
+            r for r in self.requests
+            if (method is None or r[0] == method)
+            and (route is None or r[1].split('/')[0] == route)])
+
+    def fail(self, route, times=1, status=503, retry_after=None):
+        """ Respond to the next `times` requests to `route` with `status` """
+        headers = {} if retry_after is None else {'Retry-After': retry_after}
+        with self._lock:
+            self._failures.setdefault(route, []).extend(
+                [(status, headers)] * times)
+
+    def delay(self, route, seconds):
+        """ Delay responses to `route` by `seconds`, on top of `latency` """
+        with self._lock:
+            self._delays[route] = seconds
+
+    def reset(self):
+        """ Clear recorded requests, queued failures and route delays """
+        with self._lock:
+            self.requests.clear()
+            self._failures.clear()
+            self._delays.clear()
+
+    def _intercept(self, method, parts, query):
+        """ Record a request, and apply injected latency. Returns the
+        (status, headers) of an injected failure, if any. """
+        route = parts[0] if parts else ''
+        with self._lock:
+            self.requests.append((method, '/'.join(parts),
+                                  {k: sorted(v) for k, v in query.items()}))
+            delay = self._delays.get(route, 0)
+            if isinstance(self.latency, tuple):
+                delay += self._rng.uniform(*self.latency)
+            else:
+                delay += self.latency
+            queue = self._failures.get(route)
+            failure = queue.pop(0) if queue else None
+            if failure is None and route != 'auth' and self.error_rate and \
+                    self._rng.random() < self.error_rate:
+                failure = (503, {})
+        if delay:
+            time.sleep(delay)
+        return failure
+
+    def _new_id(self):
+        with self._lock:
+            self._next_id += 1
+            return self._next_id
+
+    def route(self, method, parts, query, body, headers):
+        """ Handle a request. Returns (status, body[, content_type]).
+        Raises KeyError for unknown routes or ids. """
+        if not parts:
+            raise KeyError('/')
+        route, rest = parts[0], parts[1:]
+        content_type = headers.get('Content-Type', '')
+        if content_type.startswith('multipart/form-data'):
+            payload = self._parse_form(content_type, body)
+        else:
+            payload = json.loads(body or b'{}')
+
+        if route == 'auth' and method == 'POST':
+            return 200, {'access_token': make_token(
+                payload['email'], timedelta(seconds=self.token_lifetime))}
+        if route == 'user':
+            return self._user(rest)
+        if route == 'predictor-events' and method == 'GET':
+            return 200, self.data.events(query)
+        if route == 'analyses':
+            with self._store_lock:
+                return self._analyses(method, rest, query, payload)
+        if route not in RESOURCES:
+            raise KeyError(route)
+
+        if method == 'GET':
+            if rest:
+                record = self.data.get(route, rest[0])
+                if record is None:
+                    raise KeyError(rest[0])
+                return 200, record
+            return 200, self.data.list(route, query)
+        if method == 'POST':
+            return 200, {'id': self._new_id(), **payload}
+        raise KeyError(method)
+
+    @staticmethod
+    def _parse_form(content_type, body):
+        """ Fields and file names of a multipart form """
+        message = BytesParser(policy=HTTP).parsebytes(
+            b'Content-Type: ' + content_type.encode() + b'\r\n\r\n' + body)
+        fields = {}
+        for part in message.iter_parts():
+            name = part.get_param('name', header='content-disposition')
+            filename = part.get_filename()
+            fields[name] = filename if filename is not None else \
+                part.get_content()
+        return fields
+
+    def _user(self, rest):
+        if not rest:
+            return 200, {'email': 'user@example.com', 'name': 'User'}
+        if rest == ['predictors']:
+            return 200, []
+        if rest == ['myanalyses']:
+            return 200, list(self.analyses.values())
+        raise KeyError('user/' + '/'.join(rest))
+
+    def _job_status(self, job):
+        if job is None:
+            return None
+        return 'PENDING' if time.monotonic() < job['ready'] else job['status']
+
+    def _analysis(self, id):
+        analysis = self.analyses[id]
+        status = self._job_status(analysis.get('_compile'))
+        if status is not None:
+            analysis['status'] = status
+        return {k: v for k, v in analysis.items() if not k.startswith('_')}
+
+    def _create_analysis(self, fields, hash_id=None):
+        hash_id = hash_id or ''.join(
+            self._rng.choice(string.ascii_lowercase + string.digits)
+            for _ in range(5))
+        now = datetime.utcnow().isoformat()
+        self.analyses[hash_id] = {
+            'hash_id': hash_id, 'name': None, 'dataset_id': None,
+            'description': None, 'predictions': None, 'model': None,
+            'predictors': [], 'runs': [], 'private': True,
+            'status': 'DRAFT', 'created_at': now, 'modified_at': now,
+            **fields}
+        self.uploads[hash_id] = []
+        return hash_id
+
+    def _analyses(self, method, rest, query, payload):
+        if not rest:
+            if method == 'POST':
+                return 200, self._analysis(self._create_analysis(payload))
+            if method == 'GET':
+                return 200, [self._analysis(i) for i, a in
+                             self.analyses.items() if _matches(a, query)]
+            raise KeyError(method)
+
+        id, sub = rest[0], '/'.join(rest[1:])
+        if method == 'PUT' and not sub:
+            if id not in self.analyses:
+                self._create_analysis({}, hash_id=id)
+            self.analyses[id].update(payload, hash_id=id)
+            return 200, self._analysis(id)
+        analysis = self._analysis(id)
+
+        if method == 'DELETE' and not sub:
+            del self.analyses[id]
+            return 200, {}
+        if method == 'GET' and sub in ('', 'full', 'resources'):
+            if sub == 'resources':
+                return 200, {'dataset_address': 'https://example.org',
+                             'preproc_address': 'https://example.org',
+                             'dataset_name': 'dataset'}
+            return 200, analysis
+        if method == 'POST' and sub in ('clone', 'fill'):
+            if sub == 'clone':
+                fields = {k: v for k, v in analysis.items()
+                          if k != 'hash_id'}
+                return 200, self._analysis(self._create_analysis(fields))
+            return 200, analysis
+        if sub == 'compile':
+            if method == 'POST':
+                self.analyses[id]['_compile'] = {
+                    'ready': time.monotonic() + self.job_time,
+                    'status': 'PASSED'}
+            return 200, {'status': self._analysis(id)['status'],
+                         'traceback': None}
+        if sub == 'report':
+            return self._report(method, id, query)
+        if sub == 'upload':
+            return self._upload(method, id, payload)
+        if sub == 'bundle' and method == 'GET':
+            return 200, self._bundle(analysis), 'application/x-tar'
+        raise KeyError(sub)
+
+    def _report(self, method, id, query):
+        if method == 'POST':
+            self.analyses[id]['_report'] = {
+                'ready': time.monotonic() + self.job_time, 'status': 'OK',
+                'run_id': sorted(query.get('run_id', []))}
+        report = self.analyses[id].get('_report')
+        if report is None:
+            raise KeyError('report')
+        status = self._job_status(report)
+        result = None
+        if status == 'OK':
+            run_ids = report['run_id'] or ['all']
+            result = {k: ['{}_{}.json'.format(k, r) for r in run_ids]
+                      for k in ('design_matrix', 'design_matrix_plot',
+                                'design_matrix_corrplot')}
+        return 200, {'status': status, 'result': result, 'traceback': None,
+                     'generated_at': datetime.utcnow().isoformat()}
+
+    def _upload(self, method, id, payload):
+        uploads = self.uploads[id]
+        if method == 'GET':
+            return 200, uploads
+        collection_id = payload.get('collection_id')
+        match = [u for u in uploads
+                 if str(u['collection_id']) == str(collection_id)]
+        if match:
+            collection = match[0]
+        else:
+            collection = {
+                'collection_id': self._new_id(),
+                'uploaded_at': datetime.utcnow().strftime('%Y-%m-%dT%H:%M'),
+                'cli_version': payload.get('cli_version'),
+                'fmriprep_version': payload.get('fmriprep_version'),
+                'estimator': payload.get('estimator'),
+                'cli_args': payload.get('cli_args'), 'files': []}
+            uploads.append(collection)
+        collection['files'].append({
+            'basename': payload.get('image_file'),
+            'level': payload.get('level'), 'status': 'OK',
+            'traceback': None})
+        return 200, {k: v for k, v in collection.items() if k != 'files'}
+
+    @staticmethod
+    def _bundle(analysis):
+        """ Tarball of the analysis, as a stand-in for the bundle """
+        content = json.dumps(analysis).encode()
+        buffer = io.BytesIO()
+        with tarfile.open(fileobj=buffer, mode='w:gz') as tar:
+            info = tarfile.TarInfo('analysis.json')
+            info.size = len(content)
+            tar.addfile(info, io.BytesIO(content))
+        return buffer.getvalue()
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Serve a synthetic Neuroscout API dataset")
+    parser.add_argument('--runs', type=int, default=1000)
+    parser.add_argument('--predictors', type=int, default=500)
+    parser.add_argument('--events', type=int, default=50,
+                        help='Events per run and predictor')
+    parser.add_argument('--latency', type=float, default=0,
+                        help='Delay (s) of every response')
+    parser.add_argument('--error-rate', type=float, default=0,
+                        help='Probability of a 503 response')
+    parser.add_argument('--job-time', type=float, default=0,
+                        help='Time (s) compile and report jobs take')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    args = parser.parse_args(argv)
+
+    data = SyntheticData(n_runs=args.runs, n_predictors=args.predictors,
+                         events_per_run=args.events)
+    server = NeuroscoutServer(
+        data, latency=args.latency, error_rate=args.error_rate,
+        job_time=args.job_time, host=args.host, port=args.port)
+    print("Serving on {}".format(server.url))
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.httpd.server_close()
+
+
+if __name__ == '__main__':
+    main()
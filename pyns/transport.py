@@ -0,0 +1,398 @@
+""" Retry policy, client-side rate limiting, deadlines and coalescing of
+API requests """
+import asyncio
+import contextvars
+import random
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+from requests.adapters import HTTPAdapter
+from requests.exceptions import (ConnectionError, ConnectTimeout, SSLError,
+                                 Timeout)
+from urllib3.exceptions import (ConnectTimeoutError, MaxRetryError,
+                                NewConnectionError)
+from urllib3.util.retry import Retry
+
+# Methods which are safe to repeat, and statuses worth retrying
+RETRY_METHODS = frozenset(['GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE'])
+RETRY_STATUSES = frozenset([429, 500, 502, 503, 504])
+
+# Default (connect, read) timeouts (s) of each request
+DEFAULT_TIMEOUT = (10, 300)
+
+# Absolute time (time.monotonic) by which requests in scope must complete
+_DEADLINE = contextvars.ContextVar('pyns_deadline', default=None)
+
+
+class DeadlineExceeded(Timeout):
+    """ The deadline of an operation passed before a request was made """
+
+
+def make_retry(retries=3, backoff_factor=0.5, backoff_max=60, jitter=0.5,
+               allowed_methods=RETRY_METHODS,
+               status_forcelist=RETRY_STATUSES):
+    """ Build a retry policy.
+
+    Args:
+        retries (int): Maximum number of retries of a request.
+        backoff_factor (float): Delay (s) before the first retry, doubled
+            for each further retry.
+        backoff_max (float): Maximum delay (s) between retries.
+        jitter (float): Maximum random delay (s) added to each backoff, so
+            that concurrent clients do not retry in lockstep.
+        allowed_methods (frozenset): Methods retried on server errors and
+            read failures. Failed connections are retried for all methods.
+        status_forcelist (frozenset): Statuses to retry. A `Retry-After`
+            header, if sent, takes precedence over the backoff.
+
+    Returns:
+        retry (urllib3.util.retry.Retry): Retry policy
+    """
+    kwargs = dict(
+        total=retries, connect=retries, read=retries, status=retries,
+        backoff_factor=backoff_factor, allowed_methods=allowed_methods,
+        status_forcelist=status_forcelist, raise_on_status=False,
+        respect_retry_after_header=True)
+    try:
+        return Retry(backoff_max=backoff_max, backoff_jitter=jitter,
+                     **kwargs)
+    except TypeError:  # urllib3 < 2
+        return Retry(**kwargs)
+
+
+def as_retry(retries):
+    """ Retry policy from a number of retries, or a Retry (passed through).
+    None or False disable retries. """
+    if isinstance(retries, Retry):
+        return retries
+    if not retries:
+        # As requests' default, so that errors are raised as is
+        return Retry(0, read=False)
+    return make_retry(int(retries))
+
+
+@contextmanager
+def deadline_scope(seconds):
+    """ Bound the total time of all requests made within this scope,
+    including from threads started by :meth:`.Neuroscout.gather`.
+
+    Each request's timeout is capped to the time left, and requests made
+    after the deadline raise :class:`DeadlineExceeded`. Nested scopes can
+    only shorten the deadline. None leaves the current deadline, if any.
+
+    :param seconds: Time (s) allowed from now.
+    :type seconds: float, optional
+    """
+    if seconds is None:
+        yield
+        return
+    end = time.monotonic() + seconds
+    current = _DEADLINE.get()
+    token = _DEADLINE.set(end if current is None else min(current, end))
+    try:
+        yield
+    finally:
+        _DEADLINE.reset(token)
+
+
+def with_deadline(func):
+    """ Decorator adding a `deadline` (s) argument, which runs `func`
+    within a :func:`deadline_scope` """
+    @wraps(func)
+    def wrapper(*args, deadline=None, **kwargs):
+        with deadline_scope(deadline):
+            return func(*args, **kwargs)
+    return wrapper
+
+
+def remaining():
+    """ Time (s) left until the current deadline, or None if there is
+    none """
+    end = _DEADLINE.get()
+    return None if end is None else end - time.monotonic()
+
+
+def request_timeout(timeout):
+    """ Cap a request timeout to the current deadline.
+
+    Args:
+        timeout (float or tuple): Timeout (s), or (connect, read) timeouts.
+            None for no timeout.
+
+    Returns:
+        timeout (float or tuple): Timeout, in the same form, or the time
+            left if `timeout` is None and there is a deadline.
+    """
+    left = remaining()
+    if left is None:
+        return timeout
+    if left <= 0:
+        raise DeadlineExceeded("Deadline exceeded")
+    if timeout is None:
+        return left
+    if isinstance(timeout, tuple):
+        return tuple(left if t is None else min(t, left) for t in timeout)
+    return min(timeout, left)
+
+
+def wait(seconds):
+    """ Sleep for `seconds`, or until the current deadline if sooner.
+    Raises :class:`DeadlineExceeded` if it has passed. """
+    left = remaining()
+    if left is not None:
+        if left <= 0:
+            raise DeadlineExceeded("Deadline exceeded")
+        seconds = min(seconds, left)
+    time.sleep(seconds)
+
+
+class RateLimiter:
+    """ Token bucket rate limiter, shared by all threads (and clients)
+    using it.
+
+    Tokens accrue at `rate` per second, up to `burst`. Each request takes
+    one token, waiting for it to accrue if none are left.
+    """
+    def __init__(self, rate, burst=None):
+        """ Initialize rate limiter.
+
+        :param rate: Sustained number of requests per second.
+        :type rate: float
+        :param burst: Maximum number of requests made at once, before
+            being limited to `rate`. Defaults to max(1, rate).
+        :type burst: float, optional
+        """
+        if rate <= 0:
+            raise ValueError("rate must be positive")
+        self.rate = float(rate)
+        self.burst = float(burst if burst is not None else max(1, rate))
+        self._tokens = self.burst
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        # Monotonic times and locks do not carry over to other processes,
+        # so an unpickled limiter starts afresh, and limits its own process
+        return {'rate': self.rate, 'burst': self.burst}
+
+    def __setstate__(self, state):
+        self.__init__(state['rate'], state['burst'])
+
+    def _reserve(self):
+        """ Take a token, and return how long (s) to wait for it """
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(
+                self.burst, self._tokens + (now - self._last) * self.rate)
+            self._last = now
+            self._tokens -= 1
+            return max(0., -self._tokens / self.rate)
+
+    def acquire(self):
+        """ Block until a request may be made """
+        wait = self._reserve()
+        if wait:
+            time.sleep(wait)
+
+    async def acquire_async(self):
+        """ Wait, without blocking the event loop, until a request may be
+        made """
+        wait = self._reserve()
+        if wait:
+            await asyncio.sleep(wait)
+
+
+def as_rate_limiter(rate_limit):
+    """ RateLimiter from a rate (requests per second), or a RateLimiter
+    (passed through). None disables rate limiting. """
+    if rate_limit is None or isinstance(rate_limit, RateLimiter):
+        return rate_limit
+    return RateLimiter(rate_limit)
+
+
+def _is_connect_error(error):
+    """ Whether a requests error happened before the request was sent """
+    if isinstance(error, ConnectTimeout):
+        return True
+    reason = getattr(error.args[0] if error.args else None, 'reason', None)
+    return isinstance(error.args[0], MaxRetryError) and \
+        isinstance(reason, (NewConnectionError, ConnectTimeoutError))
+
+
+class NeuroscoutAdapter(HTTPAdapter):
+    """ Transport adapter which retries according to a :class:`Retry`
+    policy, and waits for a :class:`RateLimiter` before each attempt.
+
+    Retries are made here rather than by urllib3, so that each attempt's
+    timeout and backoff are capped to the current deadline (see
+    :func:`deadline_scope`). The number of retries made is stored in the
+    response's `retries` attribute. """
+    def __init__(self, rate_limiter=None, max_retries=None, **kwargs):
+        self.rate_limiter = rate_limiter
+        self.retry = as_retry(max_retries)
+        super().__init__(max_retries=as_retry(None), **kwargs)
+
+    def send(self, request, timeout=None, **kwargs):
+        retry = self.retry
+        idempotent = request.method in (retry.allowed_methods or ())
+        attempt = 0
+        while True:
+            # Each attempt, including retries, takes a token
+            if self.rate_limiter is not None:
+                self.rate_limiter.acquire()
+            try:
+                response = super().send(
+                    request, timeout=request_timeout(timeout), **kwargs)
+            except DeadlineExceeded:
+                raise
+            except (ConnectionError, Timeout) as error:
+                retryable = not isinstance(error, SSLError) and \
+                    (idempotent or _is_connect_error(error))
+                if not retryable or attempt >= (retry.total or 0):
+                    raise
+                delay = _retry_delay(retry, attempt + 1)
+            else:
+                if not idempotent or attempt >= (retry.total or 0) or \
+                        response.status_code not in \
+                        (retry.status_forcelist or ()):
+                    response.retries = attempt
+                    return response
+                delay = _retry_delay(
+                    retry, attempt + 1, response.headers.get('Retry-After'))
+                response.close()
+            attempt += 1
+            time.sleep(delay)
+
+
+def _backoff(retry, attempt):
+    """ Delay (s) before retry number `attempt` (from 1) """
+    delay = min(getattr(retry, 'backoff_max', 120),
+                retry.backoff_factor * 2 ** (attempt - 1))
+    return delay + random.uniform(0, getattr(retry, 'backoff_jitter', 0))
+
+
+def _retry_delay(retry, attempt, retry_after=None):
+    """ Delay (s) before retry number `attempt` (from 1), from the
+    response's `Retry-After` header if any (at most the policy's
+    `backoff_max`), or the backoff.
+
+    Raises :class:`DeadlineExceeded` if the retry would be made after the
+    current deadline. """
+    if retry_after and retry.respect_retry_after_header:
+        delay = min(retry.parse_retry_after(retry_after),
+                    getattr(retry, 'backoff_max', 120))
+    else:
+        delay = _backoff(retry, attempt)
+    left = remaining()
+    if left is not None and delay >= left:
+        raise DeadlineExceeded(
+            "Deadline exceeded before retry {}".format(attempt))
+    return delay
+
+
+class _Flight:
+    __slots__ = ('done', 'result', 'error')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """ Coalesces concurrent calls with the same key, across threads. The
+    first caller (the leader) runs the call, and callers arriving before
+    it completes wait for, and share, its result or exception. """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flights = {}
+
+    def __getstate__(self):
+        # Calls in flight stay with their process
+        return {}
+
+    def __setstate__(self, state):
+        self.__init__()
+
+    def do(self, key, func):
+        """ Run `func`, unless a call with `key` is in flight.
+
+        Args:
+            key (hashable): Key of the call.
+            func (callable): Function taking no arguments.
+
+        Returns:
+            result: Result of `func`, from this or the leader's call
+            shared (bool): Whether the result is the leader's
+        """
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+
+        if not leader:
+            left = remaining()
+            if not flight.done.wait(left):
+                raise DeadlineExceeded(
+                    "Deadline exceeded waiting for a coalesced request")
+            if flight.error is not None:
+                raise flight.error
+            return flight.result, True
+
+        try:
+            flight.result = func()
+        except BaseException as error:
+            flight.error = error
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
+        return flight.result, False
+
+
+class AsyncSingleFlight:
+    """ Coalesces concurrent calls with the same key, across the coroutines
+    of an event loop. See :class:`SingleFlight`. The call runs as a task,
+    so that it completes for the other callers if the leader is
+    cancelled, or a follower reaches its deadline. """
+    def __init__(self):
+        self._flights = {}
+
+    @staticmethod
+    def _retrieve(task):
+        # Mark the error as retrieved, in case all callers were cancelled
+        if not task.cancelled():
+            task.exception()
+
+    async def do(self, key, func):
+        """ Await `func()`, unless a call with `key` is in flight.
+
+        Args:
+            key (hashable): Key of the call.
+            func (callable): Coroutine function taking no arguments.
+
+        Returns:
+            result: Result of `func`, from this or the leader's call
+            shared (bool): Whether the result is the leader's
+        """
+        task = self._flights.get(key)
+        shared = task is not None
+        if not shared:
+            task = self._flights[key] = asyncio.ensure_future(func())
+            task.add_done_callback(self._retrieve)
+            task.add_done_callback(lambda t: self._flights.pop(key, None))
+            return await asyncio.shield(task), False
+
+        try:
+            return await asyncio.wait_for(
+                asyncio.shield(task), remaining()), True
+        except asyncio.TimeoutError:
+            if task.done():
+                # The call itself timed out
+                raise
+            raise DeadlineExceeded(
+                "Deadline exceeded waiting for a coalesced request")
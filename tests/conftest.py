@@ -43,3 +43,19 @@ def neuroscout(neuroscout_recorder):
 @pytest.fixture(scope='module')
 def get_test_data_path():
     return Path(__file__).parents[0].absolute() / 'data'
+
+
+@pytest.fixture(scope='module')
+def stub_server():
+    """ Local stand-in API server which records incoming requests """
+    from .stub_server import StubServer
+    with StubServer() as server:
+        yield server
+
+
+@pytest.fixture
+def stub_neuroscout(stub_server):
+    """ Client authorized against the local stand-in server """
+    client = Neuroscout(email='user@example.com', password='password',
+                        api_base_url=stub_server.url)
+    return client
@@ -0,0 +1,42 @@
+""" Small fixture datasets for the local stand-in API server """
+from pyns.testing.server import FixtureData, NeuroscoutServer
+
+DATASETS = [
+    {'id': 1, 'name': 'Sherlock', 'active': True,
+     'preproc_address': 'https://example.org/sherlock',
+     'tasks': [{'id': 10, 'name': 'movie'}]},
+    {'id': 2, 'name': 'Budapest', 'active': True,
+     'preproc_address': 'https://example.org/budapest',
+     'tasks': [{'id': 20, 'name': 'movie'}]},
+]
+
+TASKS = [
+    {'id': 10, 'name': 'movie', 'dataset_id': 1, 'TR': 1.5},
+    {'id': 20, 'name': 'movie', 'dataset_id': 2, 'TR': 1.0},
+]
+
+RUNS = [
+    {'id': 100 + i, 'dataset_id': 1, 'task': 10, 'task_name': 'movie',
+     'subject': '0%d' % (i // 2 + 1), 'session': None,
+     'number': i % 2 + 1, 'acquisition': None, 'duration': 30.0}
+    for i in range(4)
+]
+
+PREDICTORS = [
+    {'id': 1000, 'name': 'speech', 'dataset_id': 1, 'source': 'extracted'},
+    {'id': 1001, 'name': 'brightness', 'dataset_id': 1, 'source': 'extracted'},
+]
+
+EVENTS = [
+    {'run_id': r['id'], 'predictor_id': p['id'], 'onset': float(onset),
+     'duration': 1.0, 'value': str(round(0.1 * (onset + 1), 3))}
+    for r in RUNS for p in PREDICTORS for onset in range(0, 30, 3)
+]
+
+
+class StubServer(NeuroscoutServer):
+    """ :class:`NeuroscoutServer` serving the fixtures above """
+
+    def __init__(self, **kwargs):
+        super().__init__(
+            FixtureData(DATASETS, TASKS, RUNS, PREDICTORS, EVENTS), **kwargs)
@@ -0,0 +1,128 @@
+import asyncio
+import threading
+from datetime import datetime, timedelta
+
+import pytest
+from requests.exceptions import HTTPError
+
+from pyns import AsyncNeuroscout
+from pyns.cache import DiskCache, TokenCache
+
+
+def _client(stub_server):
+    return AsyncNeuroscout(email='user@example.com', password='password',
+                           api_base_url=stub_server.url)
+
+
+def test_async_get(stub_server):
+    async def main():
+        async with _client(stub_server) as api:
+            run = await api.runs.get(101)
+            runs = await api.runs.get(dataset_name='Sherlock')
+            task = await api.tasks.get(task_name='movie', dataset_id=2)
+            df = await api.predictor_events.get(
+                predictor_name='speech', dataset_name='Sherlock',
+                subject='02', output_type='df')
+            many = await api.runs.get_many([100, 999])
+            return run, runs, task, df, many
+
+    run, runs, task, df, many = asyncio.run(main())
+    assert run['id'] == 101
+    assert len(runs) == 4
+    assert task[0]['TR'] == 1.0
+    assert set(df.subject) == {'02'}
+    assert set(df.predictor_name) == {'speech'}
+    assert many[0]['id'] == 100
+    assert isinstance(many[1], HTTPError)
+
+
+def test_async_single_auth(stub_server):
+    async def main():
+        api = AsyncNeuroscout(email='user@example.com', password='password',
+                              api_base_url=stub_server.url,
+                              coalesce_requests=False)
+        await asyncio.gather(*[api.tasks.get(10) for _ in range(10)])
+        assert stub_server.count('POST', 'auth') == 1
+
+        # Expired token is refreshed once for all concurrent requests
+        api._api_token_exp = datetime.now() - timedelta(seconds=1)
+        await asyncio.gather(*[api.tasks.get(10) for _ in range(10)])
+        await api.aclose()
+
+    stub_server.reset()
+    asyncio.run(main())
+    assert stub_server.count('POST', 'auth') == 2
+    assert stub_server.count('GET', 'tasks') == 20
+
+
+def test_async_token_cache(stub_server, tmp_path):
+    async def main():
+        for _ in range(2):
+            async with AsyncNeuroscout(
+                    email='user@example.com', password='password',
+                    api_base_url=stub_server.url, cache_dir=tmp_path) as api:
+                await api.tasks.get(10)
+
+    stub_server.reset()
+    asyncio.run(main())
+    assert stub_server.count('POST', 'auth') == 1
+
+
+def test_async_disk_off_loop(stub_server, tmp_path, monkeypatch):
+    # Disk cache and token cache calls do not block the event loop
+    threads = {}
+
+    def spy(cls, name):
+        method = getattr(cls, name)
+
+        def wrapper(*args, **kwargs):
+            threads.setdefault(name, set()).add(threading.get_ident())
+            return method(*args, **kwargs)
+        monkeypatch.setattr(cls, name, wrapper)
+
+    for cls, name in [(DiskCache, 'get'), (DiskCache, 'set'),
+                      (TokenCache, 'fetch')]:
+        spy(cls, name)
+
+    async def main():
+        async with AsyncNeuroscout(
+                email='user@example.com', password='password',
+                api_base_url=stub_server.url, cache_dir=tmp_path) as api:
+            await api.tasks.get(10)
+            await api.tasks.get(10)
+        return threading.get_ident()
+
+    stub_server.reset()
+    loop_thread = asyncio.run(main())
+    assert set(threads) == {'get', 'set', 'fetch'}
+    assert loop_thread not in set.union(*threads.values())
+    assert stub_server.count('POST', 'auth') == 1
+    assert stub_server.count('GET', 'tasks') == 1
+
+
+def test_async_errors(stub_server):
+    async def main():
+        async with _client(stub_server) as api:
+            with pytest.raises(HTTPError):
+                await api.runs.get(999)
+            with pytest.raises(ValueError):
+                await api.runs.get(dataset_name='Missing')
+
+    asyncio.run(main())
+
+
+def test_async_compression(stub_server):
+    async def main():
+        async with AsyncNeuroscout(
+                email='user@example.com', password='password',
+                api_base_url=stub_server.url,
+                compress_requests=True) as api:
+            await api.runs.get(dataset_name='Sherlock')
+            res = await api.analyses.put('abcde', runs=list(range(1000)))
+            return api.transfers, res
+
+    transfers, res = asyncio.run(main())
+    assert res['runs'] == list(range(1000))
+    get, put = list(transfers)[-2:]
+    assert 0 < get.response_bytes < get.response_decoded_bytes
+    assert 0 < put.request_bytes < put.request_decoded_bytes
@@ -0,0 +1,127 @@
+import numpy as np
+import pytest
+from requests.exceptions import HTTPError
+
+from pyns.endpoints import base
+
+
+def test_lookups_reuse_client(stub_server, stub_neuroscout):
+    assert stub_server.count('POST', 'auth') == 1
+
+    df = stub_neuroscout.predictor_events.get(
+        predictor_name=['speech', 'brightness'], dataset_name='Sherlock',
+        subject='01', output_type='df')
+
+    assert set(df.predictor_name) == {'speech', 'brightness'}
+    assert set(df.subject) == {'01'}
+
+    # All name lookups and entity conversions go through the same client
+    assert stub_server.count('POST', 'auth') == 1
+
+
+def test_names_to_ids_uses_owning_client(stub_server, stub_neuroscout):
+    stub_server.reset()
+    runs = stub_neuroscout.runs.get(dataset_name='Sherlock')
+    assert len(runs) == 4
+
+    assert stub_server.count('GET', 'datasets') == 1
+    assert stub_server.count('GET', 'runs') == 1
+    assert stub_server.count('POST', 'auth') == 0
+
+
+def test_get_many(stub_server, stub_neuroscout):
+    stub_server.reset()
+    res = stub_neuroscout.runs.get_many([103, 100, 999, 101], max_workers=4)
+
+    assert [r['id'] for r in res if isinstance(r, dict)] == [103, 100, 101]
+    assert isinstance(res[2], HTTPError)
+    assert stub_server.count('GET', 'runs') == 4
+
+    with pytest.raises(HTTPError):
+        stub_neuroscout.runs.get_many([999], return_exceptions=False)
+
+
+def test_to_df_compact(stub_neuroscout):
+    kwargs = dict(predictor_name=['speech', 'brightness'],
+                  dataset_name='Sherlock', output_type='df')
+    plain = stub_neuroscout.predictor_events.get(**kwargs)
+    df = stub_neuroscout.predictor_events.get(compact=True, **kwargs)
+
+    assert df.predictor_name.dtype == 'category'
+    assert df.subject.dtype == 'category'
+    assert set(df.subject) == {'01', '02'}
+    assert df.onset.dtype == 'float32'
+    assert df.value.dtype == 'float32'
+    assert df.run_id.dtype == 'int32'
+    assert np.allclose(df.value, plain.value.astype(float))
+    assert df.memory_usage(deep=True).sum() < \
+        plain.memory_usage(deep=True).sum() / 2
+
+
+def test_id_to_entities_catalog(stub_server, stub_neuroscout):
+    kwargs = dict(predictor_name=['speech', 'brightness'],
+                  dataset_name='Sherlock', output_type='df')
+    stub_server.reset()
+    df = stub_neuroscout.predictor_events.get(**kwargs)
+
+    # All 4 runs are listed by dataset, rather than fetched one by one
+    assert stub_server.count('GET', 'runs') == 3  # Search, one run, list
+    # Only 2 predictors, which are fetched one by one
+    assert stub_server.count('GET', 'predictors') == 3
+    assert df.groupby('run_id').subject.first().to_dict() == {
+        100: '01', 101: '01', 102: '02', 103: '02'}
+    assert set(df.number) == {1, 2}
+    assert set(df.predictor_name) == {'speech', 'brightness'}
+
+    stub_server.reset()
+    df = stub_neuroscout.predictor_events.get(resolve_ids=False, **kwargs)
+    assert 'subject' not in df.columns
+    assert stub_server.count('GET', 'runs') == 1
+
+
+def test_id_to_entities_predictor_catalog(stub_server, stub_neuroscout,
+                                          monkeypatch):
+    monkeypatch.setattr(base, 'CATALOG_MIN_IDS', 2)
+    stub_server.reset()
+    df = stub_neuroscout.predictor_events.get(
+        predictor_name=['speech', 'brightness'], dataset_name='Sherlock',
+        output_type='df')
+
+    # Name lookup, and one listing by run
+    assert stub_server.count('GET', 'predictors') == 2
+    assert df.groupby('predictor_id').predictor_name.first().to_dict() == {
+        1000: 'speech', 1001: 'brightness'}
+
+    # Listing would take a request per run, more than one per predictor
+    monkeypatch.setattr(base, 'RUN_ID_CHUNK', 1)
+    stub_server.reset()
+    df = stub_neuroscout.predictor_events.get(
+        predictor_name=['speech', 'brightness'], dataset_name='Sherlock',
+        output_type='df')
+
+    # Name lookup, and each predictor
+    assert stub_server.count('GET', 'predictors') == 3
+    assert set(df.predictor_name) == {'speech', 'brightness'}
+
+
+@pytest.mark.parametrize('output_type', ['arrow', 'polars'])
+def test_to_df_arrow(stub_neuroscout, output_type):
+    pa = pytest.importorskip('pyarrow')
+    if output_type == 'polars':
+        pytest.importorskip('polars')
+    kwargs = dict(predictor_name=['speech', 'brightness'],
+                  dataset_name='Sherlock')
+    expected = stub_neuroscout.predictor_events.get(output_type='df',
+                                                    **kwargs)
+    res = stub_neuroscout.predictor_events.get(output_type=output_type,
+                                               **kwargs)
+
+    table = res if output_type == 'arrow' else res.to_arrow()
+    assert isinstance(table, pa.Table)
+    assert table.column_names == list(expected.columns)
+    assert table['subject'].to_pylist() == expected.subject.tolist()
+    assert table['predictor_name'].to_pylist() == \
+        expected.predictor_name.tolist()
+
+    with pytest.raises(ValueError):
+        stub_neuroscout.runs.get(100, output_type=output_type)
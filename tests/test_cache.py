@@ -0,0 +1,272 @@
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+import pytest
+
+from pyns import Neuroscout, api as api_module
+from pyns.cache import (ResponseCache, DiskCache, EventCache, TokenCache,
+                        make_key)
+
+
+def test_make_key_normalizes_params():
+    a = make_key('GET', '/runs', {'subject': '01', 'dataset_id': 1})
+    b = make_key('get', '/runs', {'dataset_id': '1', 'subject': '01'})
+    assert a == b
+    assert a != make_key('get', '/runs', {'dataset_id': 1}, identity='x')
+
+
+def test_lru_and_ttl():
+    cache = ResponseCache(maxsize=2, route_ttls={'runs': 60, 'tasks': 0.05})
+    cache.set('a', [1], route='runs')
+    cache.set('b', [2], route='runs')
+    assert cache.get('a') == (True, [1])
+    cache.set('c', [3], route='runs')  # Evicts 'b', least recently used
+    assert cache.get('b') == (False, None)
+    assert cache.stats['evictions'] == 1
+
+    cache.set('d', [4], route='tasks')
+    time.sleep(0.1)
+    assert cache.get('d') == (False, None)
+
+    # Routes without a TTL are not cached
+    cache.set('e', [5], route='analyses')
+    assert cache.get('e') == (False, None)
+
+    # Cached values are copies
+    hit, value = cache.get('c')
+    value.append(2)
+    assert cache.get('c') == (True, [3])
+
+
+def test_maxbytes():
+    cache = ResponseCache(maxbytes=20, route_ttls={'runs': 60})
+    # The raw response body is stored, rather than re-encoding the value
+    cache.set('a', [1], route='runs', raw=b'[1]       ')
+    cache.set('b', [2], route='runs')
+    assert cache.stats['bytes'] == 13
+    cache.set('c', [3, 4, 5], route='runs')  # Evicts 'a', over maxbytes
+    assert cache.get('a') == (False, None)
+    assert cache.get('b') == (True, [2])
+    assert cache.stats['evictions'] == 1
+
+    # Responses larger than maxbytes are not cached
+    cache.set('d', list(range(10)), route='runs')
+    assert cache.get('d') == (False, None)
+    assert cache.invalidate() == 2
+    assert cache.stats['bytes'] == 0
+
+
+def test_client_cache(stub_server):
+    api = Neuroscout(email='user@example.com', password='password',
+                     api_base_url=stub_server.url, cache=True)
+    stub_server.reset()
+
+    first = api.runs.get(dataset_id=1)
+    first[0]['subject'] = 'changed'
+    second = api.runs.get(dataset_id=1)
+    assert second[0]['subject'] != 'changed'
+    api.runs.get(101)
+    api.runs.get(101)
+    assert stub_server.count('GET', 'runs') == 2
+    assert api.cache.stats['hits'] == 2
+    assert api.cache.stats['misses'] == 2
+
+    assert api.invalidate(route='runs', id=101) == 1
+    api.runs.get(101)
+    assert stub_server.count('GET', 'runs') == 3
+
+    # Mutations evict the route
+    api.predictors.get(dataset_id=1)
+    assert len(api.cache) == 3
+    api.predictors.post(name='new')
+    assert len(api.cache) == 2
+    api.predictors.get(dataset_id=1)
+    assert stub_server.count('GET', 'predictors') == 2
+
+
+def test_disk_cache(tmp_path):
+    cache = DiskCache(tmp_path, maxbytes=100)
+    cache.set('a', [{'id': 1}], route='runs', id=1)
+    cache.set('b', b'bundle', route='runs', id=2)
+    assert cache.get('a') == (True, [{'id': 1}])
+    assert cache.get('b') == (True, b'bundle')
+    assert cache.get('c') == (False, None)
+    assert cache.stats['hits'] == 2
+
+    # A second instance (e.g. another process) shares the same store
+    other = DiskCache(tmp_path, maxbytes=100)
+    assert other.get('a') == (True, [{'id': 1}])
+    assert other.invalidate(route='runs', id=2) == 1
+    assert cache.get('b') == (False, None)
+
+    # Least recently used responses are evicted over the size cap
+    cache.set('d', 'x' * 60, route='runs')
+    time.sleep(0.01)
+    cache.get('a')
+    cache.set('e', 'y' * 30, route='runs')
+    assert cache.get('d') == (False, None)
+    assert cache.get('a')[0]
+    assert cache.stats['evictions'] == 1
+    assert cache.nbytes <= 100
+
+
+def _fill_cache(cache_dir, worker):
+    cache = DiskCache(cache_dir)
+    for i in range(25):
+        cache.set(('shared', i), {'i': i}, route='runs')
+        cache.set((worker, i), {'i': i}, route='runs')
+    return worker
+
+
+def test_disk_cache_processes(tmp_path):
+    with ProcessPoolExecutor(4) as pool:
+        list(pool.map(_fill_cache, [tmp_path] * 4, range(4)))
+
+    cache = DiskCache(tmp_path)
+    assert len(cache) == 25 * 5
+    assert cache.get((3, 24)) == (True, {'i': 24})
+
+
+def test_disk_cache_env(stub_server, tmp_path, monkeypatch):
+    monkeypatch.setenv('NEUROSCOUT_CACHE_DIR', str(tmp_path))
+    api = Neuroscout(email='user@example.com', password='password',
+                     api_base_url=stub_server.url)
+    assert isinstance(api.cache, DiskCache)
+    stub_server.reset()
+    api.tasks.get(10)
+
+    api2 = Neuroscout(email='user@example.com', password='password',
+                      api_base_url=stub_server.url)
+    assert api2.tasks.get(10)['TR'] == 1.5
+    assert stub_server.count('GET', 'tasks') == 1
+
+    assert Neuroscout(api_base_url=stub_server.url, cache=False).cache is None
+
+
+def _events(pairs, n=3):
+    return pd.DataFrame([
+        {'run_id': r, 'predictor_id': p, 'onset': float(i), 'duration': 1.0,
+         'value': i * 0.5}
+        for p, r in pairs for i in range(n)])
+
+
+def test_event_cache(tmp_path):
+    pytest.importorskip('pyarrow')
+    cache = EventCache(tmp_path)
+    events, missing = cache.load([1, 2], [10, 11])
+    assert events.empty
+    assert missing == [(1, 10), (1, 11), (2, 10), (2, 11)]
+
+    # (2, 11) has no events, but is still recorded as fetched
+    cache.store(_events([(1, 10), (1, 11), (2, 10)]), missing)
+    events, missing = cache.load([1, 2], [10, 11])
+    assert missing == []
+    assert len(events) == 9
+    assert set(events.value) == {'0.0', '0.5', '1.0'}
+
+    events, missing = cache.load([1, 3], [10])
+    assert missing == [(3, 10)]
+    assert len(events) == 3
+
+    # Corrupt shards are dropped, and fetched again
+    cache._shard_path(1, 10).write_bytes(b'corrupt')
+    events, missing = cache.load([1], [10, 11])
+    assert missing == [(1, 10)]
+    assert len(cache) == 3
+
+    assert cache.invalidate(run_id=11) == 2
+    assert cache.load([1, 2], [11])[1] == [(1, 11), (2, 11)]
+
+
+def test_event_cache_eviction(tmp_path):
+    pytest.importorskip('pyarrow')
+    cache = EventCache(tmp_path)
+    cache.store(_events([(1, 10)]), [(1, 10)])
+    size = cache.nbytes
+
+    cache = EventCache(tmp_path, maxbytes=int(size * 2.5))
+    cache.store(_events([(1, 11)]), [(1, 11)])
+    cache.load([1], [10])  # (1, 11) is now least recently used
+    cache.store(_events([(1, 12)]), [(1, 12)])
+    assert cache.stats['evictions'] == 1
+    assert cache.load([1], [10, 11, 12])[1] == [(1, 11)]
+    assert not cache._shard_path(1, 11).exists()
+
+
+def _login(url, cache_dir):
+    api = Neuroscout(email='user@example.com', password='password',
+                     api_base_url=url, cache_dir=cache_dir)
+    return api._api_token
+
+
+def test_token_cache(stub_server, tmp_path):
+    stub_server.reset()
+    cache = TokenCache(tmp_path)
+    api = Neuroscout(email='user@example.com', password='password',
+                     api_base_url=stub_server.url, token_cache=cache)
+    # A cache directory enables the token cache
+    assert _login(stub_server.url, tmp_path) == api._api_token
+    assert stub_server.count('POST', 'auth') == 1
+    assert (tmp_path / 'tokens.sqlite').stat().st_mode & 0o777 == 0o600
+
+    # Tokens are stored per user and API
+    Neuroscout(email='other@example.com', password='password',
+               api_base_url=stub_server.url, token_cache=cache)
+    assert stub_server.count('POST', 'auth') == 2
+    assert len(cache) == 2
+
+    # Tokens close to expiry are renewed
+    cache.set(stub_server.url, 'user@example.com', 'password',
+              api._api_token, time.time() + 10)
+    _login(stub_server.url, tmp_path)
+    assert stub_server.count('POST', 'auth') == 3
+    assert cache.get(stub_server.url, 'user@example.com', 'password',
+                     600) is not None
+
+    # Tokens are only given to callers with the same password
+    assert cache.get(stub_server.url, 'user@example.com', 'wrong') is None
+    api = Neuroscout(email='user@example.com', api_base_url=stub_server.url,
+                     token_cache=cache)
+    assert api._api_token is None
+    # The stub API accepts any password, so this logs in again
+    Neuroscout(email='user@example.com', password='wrong',
+               api_base_url=stub_server.url, token_cache=cache)
+    assert stub_server.count('POST', 'auth') == 4
+    assert cache.get(stub_server.url, 'user@example.com', 'wrong')
+
+    cache.invalidate(stub_server.url, 'other@example.com')
+    assert len(cache) == 1
+    cache.invalidate()
+    assert len(cache) == 0
+
+
+def test_token_cache_processes(stub_server, tmp_path):
+    stub_server.reset()
+    with ProcessPoolExecutor(4) as pool:
+        tokens = set(pool.map(
+            _login, [stub_server.url] * 8, [tmp_path] * 8))
+    assert len(tokens) == 1
+    assert stub_server.count('POST', 'auth') == 1
+
+
+def test_token_refresh(stub_server, monkeypatch):
+    monkeypatch.setattr(api_module, 'TOKEN_REFRESH_MARGIN', 1)
+    monkeypatch.setattr(stub_server, 'token_lifetime', 4)
+    api = Neuroscout(email='user@example.com', password='password',
+                     api_base_url=stub_server.url, refresh_tokens=True)
+    expires = api._api_token_exp
+
+    start = time.monotonic()
+    while api._api_token_exp == expires and time.monotonic() - start < 5:
+        time.sleep(0.05)
+    assert api._api_token_exp > expires
+
+    # Requests do not wait on a login
+    stub_server.reset()
+    api.tasks.get(10)
+    assert stub_server.count('POST', 'auth') == 0
+
+    api.close()
+    api._refresher.join(1)
+    assert not api._refresher.is_alive()
@@ -1,3 +1,16 @@
+import json
+import logging
+import pickle
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from pyns import Neuroscout
+from pyns.cache import ResponseCache
+from pyns.fetch_utils import fetch_predictors
+from pyns.metrics import RequestMetrics
+
+
 def test_auth(recorder, neuroscout):
     assert neuroscout._api_token is not None
     assert len(neuroscout._api_token)
@@ -9,3 +22,192 @@ def test_datasets(recorder, neuroscout):
 
         datasets = resp
         assert len(datasets) > 1
+
+
+def test_gather(stub_server, stub_neuroscout, caplog):
+    from functools import partial
+
+    calls = [partial(stub_neuroscout.tasks.get, 10),
+             partial(stub_neuroscout.datasets.get, name='Budapest')]
+    tasks, datasets = stub_neuroscout.gather(calls, max_workers=24)
+    assert tasks['TR'] == 1.5
+    assert datasets[0]['id'] == 2
+
+    # More workers than the default 32 connections reuse pooled connections,
+    # rather than discarding them
+    api = Neuroscout(email='user@example.com', password='password',
+                     api_base_url=stub_server.url, coalesce_requests=False)
+    stub_server.delay('runs', 0.2)
+    try:
+        with caplog.at_level(logging.WARNING, logger='urllib3'):
+            results = api.gather(
+                [partial(api.runs.get, 100 + i % 4) for i in range(96)],
+                max_workers=48)
+    finally:
+        stub_server.reset()
+    assert all(r['dataset_id'] == 1 for r in results)
+    assert not [r for r in caplog.records
+                if 'Connection pool is full' in r.getMessage()]
+
+
+def test_json_loads(stub_server):
+    bodies = []
+
+    def loads(body):
+        bodies.append(body)
+        return json.loads(body)
+
+    api = Neuroscout(email='user@example.com', password='password',
+                     api_base_url=stub_server.url, json_loads=loads)
+    assert api.runs.get(100)['subject'] == '01'
+    # Decoded from the raw bytes
+    assert all(isinstance(b, bytes) for b in bodies)
+    assert len(bodies) == 2  # Auth, and run
+
+    # Cached responses are decoded with it too
+    stub_server.reset()
+    api = Neuroscout(email='user@example.com', password='password',
+                     api_base_url=stub_server.url, json_loads=loads,
+                     cache=True)
+    for _ in range(2):
+        assert api.runs.get(100)['subject'] == '01'
+    assert stub_server.count('GET', 'runs') == 1
+    assert len(bodies) == 5
+
+
+def test_compression(stub_server):
+    api = Neuroscout(email='user@example.com', password='password',
+                     api_base_url=stub_server.url, compress_requests=True)
+    api.transfers.clear()
+
+    # Responses are requested and received compressed
+    runs = api.runs.get(dataset_name='Sherlock')
+    transfer = api.transfers[-1]
+    assert transfer.method == 'GET' and transfer.status == 200
+    assert transfer.request_bytes == 0
+    assert 0 < transfer.response_bytes < transfer.response_decoded_bytes
+    assert transfer.response_decoded_bytes == len(json.dumps(runs))
+
+    # Large JSON bodies are sent compressed
+    model = {'Name': 'model', 'Input': {'Run': list(range(1000))}}
+    res = api.analyses.put('abcde', model=model, runs=list(range(1000)))
+    assert res['model'] == model
+    transfer = api.transfers[-1]
+    assert 0 < transfer.request_bytes < transfer.request_decoded_bytes / 2
+
+    # Small bodies are not
+    api.analyses.put('abcde', name='small')
+    transfer = api.transfers[-1]
+    assert transfer.request_bytes == transfer.request_decoded_bytes
+
+    totals = api.transfer_totals
+    assert totals['response_bytes'] < totals['response_decoded_bytes']
+
+
+def test_thread_safety(stub_server, caplog):
+    api = Neuroscout(email='user@example.com', password='password',
+                     api_base_url=stub_server.url, transfer_history=10000)
+    run_ids = [100, 101, 102]
+    calls = [
+        lambda: api.runs.get(run_id=run_ids),
+        lambda: api.runs.get(dataset_name='Sherlock', subject='02'),
+        lambda: api.tasks.get(10),
+        lambda: api.predictor_events.get(
+            predictor_name=['speech', 'brightness'], dataset_name='Sherlock',
+            run_id=run_ids, output_type='df'),
+    ]
+    expected = [call() for call in calls]
+
+    n_threads, rounds = 32, 10
+    barrier = threading.Barrier(n_threads)
+
+    def worker(i):
+        barrier.wait()
+        return [calls[(i + j) % len(calls)]() for j in range(rounds)]
+
+    # All threads find the token expired at once
+    api._api_token_exp = datetime.now() - timedelta(seconds=1)
+    stub_server.reset()
+    api.transfers.clear()
+    with caplog.at_level(logging.WARNING, logger='urllib3'), \
+            ThreadPoolExecutor(n_threads) as pool:
+        results = list(pool.map(worker, range(n_threads)))
+
+    for i, thread_results in enumerate(results):
+        for j, result in enumerate(thread_results):
+            exp = expected[(i + j) % len(calls)]
+            if hasattr(exp, 'equals'):
+                assert exp.equals(result)
+            else:
+                assert result == exp
+    # Single-flight token renewal
+    assert stub_server.count('POST', 'auth') == 1
+    # Arguments are not modified
+    assert run_ids == [100, 101, 102]
+    # Connections are reused
+    assert 'Connection pool is full' not in caplog.text
+    # Every request is recorded
+    assert len(api.transfers) == stub_server.count()
+    assert api.transfer_totals['response_bytes'] > 0
+
+
+def test_pickle(stub_server, tmp_path, monkeypatch):
+    metrics = RequestMetrics()
+    api = Neuroscout(email='user@example.com', password='password',
+                     api_base_url=stub_server.url, cache_dir=tmp_path,
+                     rate_limit=100, hooks=[metrics], refresh_tokens=True)
+    api.tasks.get(10)
+
+    stub_server.reset()
+    clone = pickle.loads(pickle.dumps(api))
+    assert clone._http_session is None
+    assert clone._api_token == api._api_token
+    # Without a password, the token cannot be renewed
+    assert clone._refresher is None
+    assert clone.runs.get(100)['subject'] == '01'
+    assert clone._session is not api._session
+    # Reused the token, and the shared disk cache
+    assert stub_server.count('POST', 'auth') == 0
+    assert clone.tasks.get(10)['TR'] == 1.5
+    assert stub_server.count('GET', 'tasks') == 0
+    assert len(clone.transfers) == 1
+    # The password is not pickled, but can be given by the environment
+    assert b'password' not in pickle.dumps(api)
+    assert clone._credentials == ('user@example.com', None)
+    monkeypatch.setenv('NEUROSCOUT_PASSWORD', 'password')
+    clone.close()
+    clone = pickle.loads(pickle.dumps(api))
+    assert clone._refresher.is_alive()
+    clone._api_token = None
+    clone._authorize()
+    # Renewed from the token cache
+    assert clone._api_token == api._api_token
+    assert stub_server.count('POST', 'auth') == 0
+    api.close()
+    clone.close()
+
+    # In-memory cached responses are not pickled
+    api = Neuroscout(email='user@example.com', password='password',
+                     api_base_url=stub_server.url, cache=True)
+    api.cache = ResponseCache(maxsize=16)
+    api.tasks.get(10)
+    clone = pickle.loads(pickle.dumps(api))
+    assert len(clone.cache) == 0
+    assert clone.cache.stats['misses'] == 0
+    assert clone.cache.maxsize == 16
+    assert len(api.cache) == 1
+
+
+def _fetch_subject(api, subject):
+    return fetch_predictors(['speech'], dataset_name='Sherlock', api=api,
+                            subject=subject)
+
+
+def test_process_pool(stub_server):
+    api = Neuroscout(email='user@example.com', password='password',
+                     api_base_url=stub_server.url)
+    stub_server.reset()
+    with ProcessPoolExecutor(2) as pool:
+        results = list(pool.map(_fetch_subject, [api] * 2, ['01', '02']))
+    assert [set(df.subject) for df in results] == [{'01'}, {'02'}]
+    assert stub_server.count('POST', 'auth') == 0
@@ -0,0 +1,194 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from pyns.cache import EventCache
+from pyns.fetch_utils import (RUN_INFO_FIELDS, _build_variables,
+                              _fetch_events, _select_events,
+                              fetch_predictors, iter_predictor_events)
+
+pytest.importorskip('bids')
+
+
+def test_fetch_predictors(stub_server, stub_neuroscout):
+    stub_server.reset()
+    df = fetch_predictors(['speech', 'brightness'], 'Sherlock',
+                          api=stub_neuroscout, subject='01')
+
+    assert list(df.columns[:4]) == ['onset', 'duration', 'speech', 'brightness']
+    assert set(df.subject) == {'01'}
+    # 2 runs of 30s at TR 1.5
+    assert len(df) == 2 * 20
+
+    # Run metadata is a single listing, rather than one request per run
+    assert len([r for r in stub_server.requests if r[1] == 'runs']) == 2
+    assert stub_server.count('GET', 'tasks') == 1
+
+
+def test_fetch_predictors_collection(stub_neuroscout):
+    collection = fetch_predictors(
+        ['speech'], 'Sherlock', api=stub_neuroscout,
+        return_type='collection', resample=False)
+    assert set(collection.variables) == {'speech'}
+    assert len(collection.variables['speech'].to_df()) == 4 * 10
+
+    # Run info keeps integer volumes, which pybids needs to resample
+    variable = collection.variables['speech']
+    assert all(isinstance(r.n_vols, int) for r in variable.run_info)
+    dense = variable.to_dense(10).resample('TR')
+    assert len(dense.values) == 4 * 20
+
+
+def test_build_variables():
+    from bids.variables import SparseRunVariable
+    from bids.variables.entities import RunInfo
+
+    # 'face' is numeric in run 1, but not in run 2
+    all_df = pd.DataFrame({
+        'run_id': [2, 1, 1, 2, 1, 2],
+        'predictor_name': ['face', 'face', 'face', 'face', 'speech', 'speech'],
+        'onset': [1., 2., 0., 0., 0., 0.],
+        'duration': 1.,
+        'amplitude': ['yes', '0.5', '1', 'no', '2', '3'],
+        'subject': ['02', '01', '01', '02', '01', '02'],
+    })
+    run_info = pd.DataFrame(
+        {'duration': 10., 'tr': 1., 'n_vols': 10},
+        index=pd.Index([1, 2], name='run_id'))
+    variables = _build_variables(all_df, run_info)
+    assert variables[0].run_info[0].n_vols == 10
+    assert isinstance(variables[0].run_info[0].n_vols, int)
+
+    # Same as building each (run, predictor) variable from its own events
+    expected = []
+    for (run_id, name), df in all_df.groupby(['run_id', 'predictor_name']):
+        entities = {'subject': df.subject.iloc[0], 'run_id': run_id}
+        try:
+            df = df.assign(amplitude=pd.to_numeric(df.amplitude))
+        except ValueError:
+            pass
+        df = df[['onset', 'duration', 'amplitude', 'subject', 'run_id']]
+        expected.append(SparseRunVariable(
+            name, df.sort_values('onset'), RunInfo(
+                **run_info[RUN_INFO_FIELDS].to_dict('index')[run_id],
+                image=None, entities=entities), 'events'))
+
+    assert len(variables) == len(expected) == 4
+    for var, exp in zip(variables, expected):
+        # Numeric amplitudes are always floats, including integers
+        pd.testing.assert_frame_equal(
+            var.to_df().reset_index(drop=True),
+            exp.to_df().reset_index(drop=True), check_dtype=False)
+    assert variables[0].values.dtype == float
+    assert list(variables[2].values) == ['no', 'yes']
+
+
+@pytest.mark.parametrize('rescale', [False, True])
+def test_fetch_predictors_numpy_engine(stub_neuroscout, rescale):
+    names = ['speech', 'brightness']
+    dense = fetch_predictors(
+        names, 'Sherlock', api=stub_neuroscout, return_type='array',
+        engine='numpy', rescale=rescale)
+    collection = fetch_predictors(
+        names, 'Sherlock', api=stub_neuroscout, return_type='collection',
+        rescale=rescale)
+
+    assert sorted(dense) == [100, 101, 102, 103]
+    assert all(arr.shape == (20, 2) for arr in dense.values())
+    for i, name in enumerate(names):
+        expected = collection.variables[name].values.values.ravel()
+        actual = np.concatenate([dense[r][:, i] for r in sorted(dense)])
+        assert np.allclose(actual, expected)
+
+    df = fetch_predictors(names, 'Sherlock', api=stub_neuroscout,
+                          engine='numpy', subject='01')
+    assert list(df.columns[:4]) == ['onset', 'duration', 'speech', 'brightness']
+    assert len(df) == 2 * 20
+    assert df.onset.max() == 19 * 1.5
+    assert set(df.run) == {1, 2}
+
+
+def test_fetch_predictors_event_cache(stub_server, stub_neuroscout,
+                                      tmp_path):
+    pytest.importorskip('pyarrow')
+    expected = fetch_predictors(['speech', 'brightness'], 'Sherlock',
+                                api=stub_neuroscout, subject='01')
+
+    fetch_predictors(['speech'], 'Sherlock', api=stub_neuroscout,
+                     subject='01', event_cache=tmp_path)
+    stub_server.reset()
+    df = fetch_predictors(['speech', 'brightness'], 'Sherlock',
+                          api=stub_neuroscout, subject='01',
+                          event_cache=tmp_path)
+
+    # Only the new predictor's events are requested
+    events = [r for r in stub_server.requests if r[1] == 'predictor-events']
+    assert len(events) == 1
+    assert events[0][2]['predictor_id'] == ['1001']
+    assert sorted(events[0][2]['run_id']) == ['100', '101']
+    assert np.allclose(df.iloc[:, 2:4], expected.iloc[:, 2:4])
+
+    stub_server.reset()
+    fetch_predictors(['speech', 'brightness'], 'Sherlock',
+                     api=stub_neuroscout, subject='01', event_cache=tmp_path)
+    assert stub_server.count('GET', 'predictor-events') == 0
+
+
+def test_fetch_events_columns(stub_server, stub_neuroscout, tmp_path):
+    pytest.importorskip('pyarrow')
+    cache = EventCache(tmp_path)
+    fetched = _fetch_events(
+        stub_neuroscout, ['speech'], 'Sherlock', cache, subject='01')
+    loaded = _fetch_events(
+        stub_neuroscout, ['speech'], 'Sherlock', cache, subject='01')
+    assert stub_server.count('GET', 'predictor-events') == 1
+
+    # Fields the cache does not store are left out either way
+    uncached = stub_neuroscout.predictor_events.get(
+        predictor_name=['speech'], dataset_name='Sherlock', subject='01',
+        output_type='df')
+    uncached = _select_events(uncached.assign(id=range(len(uncached))))
+
+    columns = ['run_id', 'predictor_id', 'onset', 'duration', 'value',
+               'subject', 'session', 'number', 'acquisition',
+               'predictor_name']
+    assert list(fetched.columns) == columns
+    assert list(loaded.columns) == columns
+    assert list(uncached.columns) == columns
+
+
+def test_iter_predictor_events(stub_server, stub_neuroscout):
+    expected = stub_neuroscout.predictor_events.get(
+        predictor_name=['speech', 'brightness'], dataset_name='Sherlock',
+        subject='01', output_type='df')
+
+    stub_server.reset()
+    chunks = list(iter_predictor_events(
+        ['speech', 'brightness'], 'Sherlock', api=stub_neuroscout,
+        subject='01'))
+
+    # One request per run, and no per-id entity lookups
+    assert stub_server.count('GET', 'predictor-events') == 2
+    assert [set(c.run_id) for c in chunks] == [{100}, {101}]
+    assert stub_server.count('GET', 'runs') == 1
+
+    df = pd.concat(chunks, ignore_index=True)
+    assert list(df.columns) == list(expected.columns)
+    pd.testing.assert_frame_equal(
+        df.sort_values(['run_id', 'predictor_id', 'onset'],
+                       ignore_index=True),
+        expected[df.columns].sort_values(
+            ['run_id', 'predictor_id', 'onset'], ignore_index=True))
+
+
+@pytest.mark.parametrize('engine', ['pybids', 'numpy'])
+def test_fetch_predictors_arrow(stub_neuroscout, engine):
+    pytest.importorskip('pyarrow')
+    expected = fetch_predictors(['speech', 'brightness'], 'Sherlock',
+                                api=stub_neuroscout, engine=engine)
+    table = fetch_predictors(['speech', 'brightness'], 'Sherlock',
+                             api=stub_neuroscout, engine=engine,
+                             return_type='arrow')
+    assert table.column_names[:4] == ['onset', 'duration', 'speech',
+                                      'brightness']
+    assert np.allclose(table['speech'].to_numpy(), expected.speech)
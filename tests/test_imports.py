@@ -0,0 +1,63 @@
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+from pyns.endpoints.utils import lazy_import, module_names
+
+# Optional or heavy dependencies, which should only be imported when used
+HEAVY_MODULES = ['pandas', 'numpy', 'pyarrow', 'polars', 'altair', 'nibabel',
+                 'nilearn', 'tqdm', 'httpx', 'bids', 'datalad']
+
+SCRIPT = """
+import json, os, sys, time
+start = time.perf_counter()
+import pyns
+from pyns import Neuroscout
+elapsed = time.perf_counter() - start
+api = Neuroscout(cache=False)
+print(json.dumps({
+    'elapsed': elapsed,
+    'modules': sorted(set(m.split('.')[0] for m in sys.modules)),
+    'tmp': os.listdir(os.environ['TMPDIR'])}))
+"""
+
+
+def test_import_time(tmp_path):
+    env = dict(os.environ, TMPDIR=str(tmp_path))
+    out = subprocess.run(
+        [sys.executable, '-c', SCRIPT], env=env, check=True,
+        capture_output=True, text=True).stdout
+    result = json.loads(out)
+
+    assert sorted(set(HEAVY_MODULES) & set(result['modules'])) == []
+    # Download directory is only created when first used
+    assert result['tmp'] == []
+    # Previously ~7s, importing altair and pandas
+    assert result['elapsed'] < 3
+
+
+def test_lazy_import():
+    mod = lazy_import('json', name='lazy_json')
+    assert 'not loaded' in repr(mod)
+    assert mod.dumps([1]) == '[1]'
+    assert mod
+    assert module_names['lazy_json'].value is json
+
+    missing = lazy_import('pyns_missing_dependency')
+    assert not missing
+    with pytest.raises(ImportError, match='pyns_missing_dependency'):
+        missing.anything
+
+
+def test_lazy_attributes():
+    import pyns
+    from pyns.endpoints import analysis
+
+    assert pyns.AsyncNeuroscout.__name__ == 'AsyncNeuroscout'
+    assert analysis.TMP_DIR.is_dir()
+    assert analysis.TMP_DIR == analysis._tmp_dir()
+    with pytest.raises(AttributeError):
+        pyns.missing
@@ -0,0 +1,87 @@
+import asyncio
+import json
+
+import pytest
+from requests.exceptions import HTTPError
+
+from pyns import AsyncNeuroscout, Neuroscout
+from pyns.api import RequestEvent, _route_label
+from pyns.metrics import RequestMetrics
+from pyns.transport import make_retry
+
+
+def test_hooks(stub_server):
+    events = []
+    api = Neuroscout(email='user@example.com', password='password',
+                     api_base_url=stub_server.url, hooks=[events.append],
+                     cache=True, retries=make_retry(2, backoff_factor=0.01))
+    assert [e.route for e in events] == ['auth']
+
+    stub_server.fail('runs')
+    api.runs.get(100)
+    api.runs.get(100)
+    api.analyses.put('abcde', name='analysis')
+    api.analyses.generate_report('abcde')
+    api.analyses.get_report('abcde')
+
+    auth, run, cached, put, post_report, report = events
+    assert run.method == 'GET' and run.route == 'runs/{id}'
+    assert run.status == 200 and run.retries == 1 and not run.cache_hit
+    assert run.response_bytes > 0 and run.latency > 0
+    assert cached.cache_hit and cached.status is None
+    assert report.route == 'analyses/{id}/report'
+    assert _route_label('user', 'predictors') == 'user/predictors'
+
+    # Failing hooks do not fail requests
+    def fail(event):
+        raise ValueError
+    api.hooks.append(fail)
+    api.runs.get(101)
+
+
+def test_metrics(stub_server):
+    metrics = RequestMetrics()
+    api = Neuroscout(email='user@example.com', password='password',
+                     api_base_url=stub_server.url, hooks=[metrics])
+    for i in range(4):
+        api.runs.get(100 + i)
+    with pytest.raises(HTTPError):
+        api.runs.get(999)
+    api.runs.get(dataset_name='Sherlock')
+
+    by_route = {(r['method'], r['route']): r for r in metrics.summary()}
+    assert set(by_route) == {('POST', 'auth'), ('GET', 'runs/{id}'),
+                             ('GET', 'runs'), ('GET', 'datasets')}
+    runs = by_route['GET', 'runs/{id}']
+    assert runs['count'] == 5 and runs['errors'] == 1
+    assert runs['histogram']['+Inf'] == 5
+    assert list(runs['histogram'].values()) == sorted(
+        runs['histogram'].values())
+    assert runs['throughput'] > 0
+    assert json.loads(metrics.to_json())[0]['count'] >= 1
+
+    text = metrics.to_prometheus()
+    assert 'pyns_request_duration_seconds_count{method="GET",' \
+        'route="runs/{id}"} 5' in text
+    assert 'pyns_request_errors_total{method="GET",route="runs/{id}"} 1' \
+        in text
+    assert '# TYPE pyns_received_bytes_total counter' in text
+
+    metrics.reset()
+    assert metrics.summary() == []
+
+
+def test_async_hooks(stub_server):
+    events = []
+
+    async def main():
+        async with AsyncNeuroscout(
+                email='user@example.com', password='password',
+                api_base_url=stub_server.url,
+                hooks=[events.append]) as api:
+            await api.runs.get(100)
+
+    asyncio.run(main())
+    assert [e.route for e in events] == ['auth', 'runs/{id}']
+    assert all(isinstance(e, RequestEvent) for e in events)
+    assert events[1].retries == 0 and events[1].status == 200
@@ -0,0 +1,113 @@
+import json
+import tracemalloc
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+from pyns import fetch_utils
+from pyns.fetch_utils import fetch_images, fetch_predictors
+from pyns.profiling import profile, stage
+
+
+def test_profile():
+    with profile() as report:
+        with stage('outer'):
+            with stage('alloc'):
+                x = np.ones(2 ** 20)  # 8 MiB
+            del x
+        with stage('small'):
+            pass
+
+    assert [s.name for s in report.stages] == ['outer', 'alloc', 'small']
+    outer, alloc, small = report.stages
+    assert alloc.peak_memory >= 2 ** 23
+    assert outer.peak_memory >= alloc.peak_memory
+    assert small.peak_memory < 2 ** 20
+    assert outer.wall_time >= alloc.wall_time
+    assert report.wall_time >= outer.wall_time + small.wall_time
+    assert report.peak_memory >= alloc.peak_memory
+    json.dumps(report.as_dict())
+    assert 'alloc' in repr(report)
+
+    # Stages outside of a profile are not recorded
+    with stage('none'):
+        pass
+    assert len(report.stages) == 3
+
+
+def test_profile_without_reset(monkeypatch):
+    # Python 3.8 has no tracemalloc.reset_peak
+    monkeypatch.delattr(tracemalloc, 'reset_peak', raising=False)
+    with profile() as report:
+        with stage('alloc'):
+            x = np.ones(2 ** 20)
+        del x
+        with stage('small'):
+            pass
+
+    alloc, small = report.stages
+    assert alloc.peak_memory >= 2 ** 23
+    assert small.peak_memory < 2 ** 20
+    assert report.peak_memory >= alloc.peak_memory
+
+
+def test_profile_traced():
+    # The peak of a caller already tracing memory is left untouched
+    tracemalloc.start()
+    try:
+        x = np.ones(2 ** 20)
+        del x
+        with profile() as report:
+            with stage('small'):
+                pass
+        assert tracemalloc.get_traced_memory()[1] >= 2 ** 23
+        assert tracemalloc.is_tracing()
+    finally:
+        tracemalloc.stop()
+    assert report.stages[0].peak_memory < 2 ** 20
+
+
+@pytest.mark.parametrize('engine', ['pybids', 'numpy'])
+def test_fetch_predictors_profile(stub_neuroscout, engine):
+    pytest.importorskip('bids')
+    df, report = fetch_predictors(
+        ['speech'], 'Sherlock', api=stub_neuroscout, engine=engine,
+        rescale=True, profile=True)
+    assert len(df) == 4 * 20
+    names = [s.name for s in report.stages]
+    if engine == 'pybids':
+        assert names == ['api_fetch', 'run_metadata', 'variables',
+                         'rescale', 'to_dense', 'to_df']
+    else:
+        assert names == ['api_fetch', 'run_metadata', 'to_dense', 'to_df']
+    assert all(s.wall_time > 0 for s in report.stages)
+
+
+def test_fetch_images_profile(tmp_path, monkeypatch):
+    pytest.importorskip('bids')
+    description = json.dumps({
+        'Name': 'Sherlock', 'BIDSVersion': '1.6.0', 'DatasetType':
+        'derivative', 'GeneratedBy': [{'Name': 'fmriprep'}]})
+    bold = 'sub-01_task-movie_run-1_space-MNI152NLin2009cAsym_desc-preproc_bold'
+
+    def install(source, path):
+        func = tmp_path / 'Sherlock' / 'fmriprep' / 'sub-01' / 'func'
+        func.mkdir(parents=True)
+        (func.parents[1] / 'dataset_description.json').write_text(description)
+        (func / (bold + '.nii.gz')).touch()
+
+    fetched = []
+    # Stand-ins for DataLad, which installs and fetches files from the web
+    monkeypatch.setattr(fetch_utils, 'install', install)
+    monkeypatch.setattr(
+        fetch_utils, 'get', lambda path, dataset, **kwargs: fetched.append(path))
+
+    (preproc_dir, paths), report = fetch_images(
+        'Sherlock', tmp_path, preproc_address='https://example.org/sherlock',
+        profile=True)
+    assert preproc_dir == tmp_path / 'Sherlock' / 'fmriprep'
+    assert {Path(p.path).name for p in paths} == {bold + '.nii.gz'}
+    assert fetched[-1] == [p.path for p in paths]
+    assert [s.name for s in report.stages] == ['install', 'layout', 'get']
+    assert all(s.wall_time > 0 for s in report.stages)
@@ -0,0 +1,102 @@
+import io
+import tarfile
+from pathlib import Path
+
+import pytest
+from requests.exceptions import ConnectionError, HTTPError
+
+from pyns import Neuroscout
+from pyns.testing import NeuroscoutServer, SyntheticData
+from pyns.testing.replay import ReplayAdapter, load_cassettes
+
+CASSETTES = Path(__file__).parent / 'cassettes'
+
+
+def _client(server, **kwargs):
+    return Neuroscout(email='user@example.com', password='password',
+                      api_base_url=server.url, **kwargs)
+
+
+def test_synthetic_data():
+    data = SyntheticData(n_runs=1000, n_predictors=500, events_per_run=5)
+    with NeuroscoutServer(data) as server:
+        api = _client(server)
+        assert len(api.runs.get(dataset_name='Synthetic')) == 1000
+        assert len(api.predictors.get(dataset_id=1)) == 500
+
+        events = api.predictor_events.get(
+            predictor_name=['predictor_000', 'predictor_499'],
+            dataset_name='Synthetic', subject='001')
+        assert len(events) == 4 * 2 * 5
+        assert {e['predictor_id'] for e in events} == {1, 500}
+        # Generated deterministically
+        assert events == api.predictor_events.get(
+            predictor_id=[1, 500], run_id=[1, 2, 3, 4])
+
+
+def test_injected_faults():
+    with NeuroscoutServer(latency=(0.01, 0.02), error_rate=0.5,
+                          seed=0) as server:
+        api = _client(server, retries=0, coalesce_requests=False)
+        results = api.gather(
+            [lambda: api.runs.get(1)] * 40, max_workers=8)
+        errors = [r for r in results if isinstance(r, HTTPError)]
+        assert 5 < len(errors) < 35
+        assert server.count('GET', 'runs') == 40
+
+        # Retried with the default policy
+        server.error_rate = 0.2
+        api = _client(server, coalesce_requests=False)
+        assert all(run['id'] == 1 for run in api.gather(
+            [lambda: api.runs.get(1)] * 20, return_exceptions=False))
+
+
+def test_analyses(tmp_path):
+    with NeuroscoutServer(job_time=0.2) as server:
+        api = _client(server)
+        analysis = api.analyses.create_analysis(
+            name='analysis', dataset_name='Synthetic',
+            predictor_names=['predictor_000'], subjects=['001'])
+        assert analysis.runs == [1, 2, 3, 4]
+        analysis.push()
+
+        analysis.compile()
+        assert analysis.get_status()['status'] == 'PENDING'
+        analysis.generate_report(run_id=1)
+        report = analysis.get_report(run_id=1, poll_interval=0.05)
+        assert report['status'] == 'OK'
+        assert analysis.get_status()['status'] == 'PASSED'
+
+        path = tmp_path / 'contrast-a_stat-t_statmap.nii.gz'
+        path.write_bytes(b'image')
+        analysis.upload_neurovault('hash', group_paths=[str(path)])
+        uploads = analysis.get_uploads()
+        assert uploads[0]['files'][0]['basename'] == path.name
+
+        with tarfile.open(fileobj=io.BytesIO(analysis.get_bundle())) as tar:
+            assert tar.getnames() == ['analysis.json']
+
+        clone = api.analyses.clone(analysis.hash_id)
+        assert clone['hash_id'] != analysis.hash_id
+        api.analyses.delete(clone['hash_id'])
+        with pytest.raises(HTTPError):
+            api.analyses.get(clone['hash_id'])
+
+
+def test_replay():
+    adapter = ReplayAdapter(load_cassettes([CASSETTES], scale=3))
+    api = Neuroscout(cache=False, retries=0)
+    api._session.mount('https://', adapter)
+
+    runs = api.runs.get(dataset_id=5, task_id=4)
+    assert len(runs) == 3 * 18
+    assert len({r['id'] for r in runs}) == len(runs)
+
+    # Polled responses are replayed in order
+    statuses = [api._get('analyses', id='cmprm', sub_route='compile')
+                for _ in range(10)]
+    assert statuses[0]['status'] == 'PENDING'
+    assert statuses[-1]['status'] == 'PASSED'
+
+    with pytest.raises(ConnectionError):
+        api.runs.get(dataset_id=999)
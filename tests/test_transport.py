@@ -0,0 +1,301 @@
+import asyncio
+import threading
+import time
+
+import httpx
+import pytest
+from requests.exceptions import HTTPError, Timeout
+
+from pyns import AsyncNeuroscout, Neuroscout
+from pyns.metrics import RequestMetrics
+from pyns.transport import (DeadlineExceeded, RateLimiter, deadline_scope,
+                            make_retry)
+
+
+def _client(stub_server, cls=Neuroscout, **kwargs):
+    return cls(email='user@example.com', password='password',
+               api_base_url=stub_server.url, **kwargs)
+
+
+def test_retry(stub_server):
+    api = _client(stub_server, retries=make_retry(3, backoff_factor=0.01))
+    stub_server.reset()
+
+    # Transient errors on idempotent requests are retried
+    stub_server.fail('runs', times=2)
+    assert api.runs.get(100)['id'] == 100
+    assert stub_server.count('GET', 'runs') == 3
+
+    # Retry-After is respected
+    stub_server.fail('runs', status=429, retry_after=1)
+    start = time.monotonic()
+    api.runs.get(100)
+    assert time.monotonic() - start >= 0.9
+
+    # Non-idempotent requests are not
+    stub_server.reset()
+    stub_server.fail('analyses')
+    with pytest.raises(HTTPError):
+        api.analyses.post(name='analysis')
+    assert stub_server.count('POST', 'analyses') == 1
+
+    # Exhausted retries return the last error
+    stub_server.fail('runs', times=2)
+    api = _client(stub_server, retries=1)
+    with pytest.raises(HTTPError):
+        api.runs.get(100)
+    stub_server.reset()
+
+
+def test_async_retry(stub_server):
+    async def main():
+        async with _client(stub_server, AsyncNeuroscout,
+                           retries=make_retry(3, backoff_factor=0.01)) as api:
+            stub_server.fail('runs', times=2)
+            run = await api.runs.get(100)
+            stub_server.fail('analyses')
+            with pytest.raises(HTTPError):
+                await api.analyses.post(name='analysis')
+            return run
+
+    stub_server.reset()
+    assert asyncio.run(main())['id'] == 100
+    assert stub_server.count('GET', 'runs') == 3
+    assert stub_server.count('POST', 'analyses') == 1
+
+
+def test_rate_limiter():
+    limiter = RateLimiter(20, burst=1)
+    start = time.monotonic()
+    threads = [threading.Thread(target=limiter.acquire) for _ in range(6)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    # First is free, the other 5 are shared out at 20/s across threads
+    assert time.monotonic() - start >= 0.24
+
+    with pytest.raises(ValueError):
+        RateLimiter(0)
+
+
+def test_rate_limited_client(stub_server):
+    api = _client(stub_server, rate_limit=RateLimiter(20, burst=1),
+                  coalesce_requests=False)
+    start = time.monotonic()
+    api.gather([lambda: api.runs.get(100)] * 5, max_workers=5)
+    assert time.monotonic() - start >= 0.19
+
+
+def test_rate_limited_retries(stub_server):
+    # Retries wait for the rate limiter too
+    api = _client(stub_server, rate_limit=RateLimiter(10, burst=1),
+                  retries=make_retry(3, backoff_factor=0.001, jitter=0))
+    stub_server.reset()
+    stub_server.fail('runs', times=2, status=429)
+    start = time.monotonic()
+    assert api.runs.get(100)['id'] == 100
+    assert time.monotonic() - start >= 0.19
+    assert stub_server.count('GET', 'runs') == 3
+
+    # Retry-After is capped to backoff_max
+    api = _client(stub_server, retries=make_retry(1, backoff_max=0.1))
+    stub_server.fail('runs', status=429, retry_after=5)
+    start = time.monotonic()
+    assert api.runs.get(100)['id'] == 100
+    assert time.monotonic() - start < 1
+    stub_server.reset()
+
+
+def test_timeout(stub_server):
+    api = _client(stub_server, retries=0, timeout=0.1)
+    stub_server.delay('runs', 0.5)
+    with pytest.raises(Timeout):
+        api.runs.get(100)
+    # Per-call timeout overrides the client's
+    assert api.runs.get(100, timeout=2)['id'] == 100
+    stub_server.reset()
+
+
+def test_deadline(stub_server):
+    api = _client(stub_server, retries=0, cache=True)
+    api.runs.get(101)
+
+    with deadline_scope(0.05):
+        time.sleep(0.1)
+        assert api.runs.get(101)['id'] == 101  # Cached
+        with pytest.raises(DeadlineExceeded):
+            api.runs.get(100)
+
+    # Propagated to every request, including from other threads
+    stub_server.delay('runs', 0.5)
+    start = time.monotonic()
+    with deadline_scope(0.2):
+        res = api.gather([lambda: api.runs.get(100)] * 4)
+    assert time.monotonic() - start < 0.45
+    assert all(isinstance(r, Timeout) for r in res)
+
+    # Of high-level operations
+    stub_server.reset()
+    api.analyses.put('abcde', name='analysis')
+    stub_server.job_time = 60
+    try:
+        api.analyses.generate_report('abcde')
+        start = time.monotonic()
+        with pytest.raises(DeadlineExceeded):
+            api.analyses.get_report('abcde', poll_interval=0.1,
+                                    deadline=0.3)
+        assert 0.3 <= time.monotonic() - start < 0.6
+    finally:
+        stub_server.job_time = 0
+
+
+def test_async_timeout(stub_server):
+    async def main():
+        async with _client(stub_server, AsyncNeuroscout, retries=0,
+                           timeout=0.1) as api:
+            with pytest.raises(httpx.TimeoutException):
+                await api.runs.get(100)
+            with deadline_scope(0.2):
+                await asyncio.sleep(0.25)
+                with pytest.raises(DeadlineExceeded):
+                    await api.runs.get(100, timeout=2)
+
+    stub_server.delay('runs', 0.5)
+    asyncio.run(main())
+    stub_server.reset()
+
+
+def test_retry_deadline(stub_server):
+    api = _client(stub_server, retries=make_retry(3, backoff_factor=0.2))
+    stub_server.reset()
+
+    # Retry-After past the deadline is not waited for
+    stub_server.fail('runs', retry_after=5)
+    start = time.monotonic()
+    with deadline_scope(0.5), pytest.raises(DeadlineExceeded):
+        api.runs.get(100)
+    assert time.monotonic() - start < 0.2
+
+    # Nor is a backoff
+    stub_server.reset()
+    stub_server.fail('runs', times=3)
+    start = time.monotonic()
+    with deadline_scope(0.5), pytest.raises(DeadlineExceeded):
+        api.runs.get(100)
+    assert time.monotonic() - start < 0.5
+    assert stub_server.count('GET', 'runs') < 3
+
+    # Each attempt's timeout is capped to the time left
+    stub_server.reset()
+    stub_server.fail('runs')
+    stub_server.delay('runs', 0.3)
+    api = _client(stub_server, retries=make_retry(3, backoff_factor=0.01))
+    start = time.monotonic()
+    with deadline_scope(0.5), pytest.raises(Timeout):
+        api.runs.get(100)
+    assert time.monotonic() - start < 0.58
+    stub_server.reset()
+
+
+def test_async_retry_deadline(stub_server):
+    async def main():
+        async with _client(stub_server, AsyncNeuroscout,
+                           retries=make_retry(3, backoff_factor=0.01)) as api:
+            stub_server.fail('runs', retry_after=5)
+            start = time.monotonic()
+            with deadline_scope(0.5), pytest.raises(DeadlineExceeded):
+                await api.runs.get(100)
+            assert time.monotonic() - start < 0.2
+
+            stub_server.fail('runs')
+            stub_server.delay('runs', 0.3)
+            start = time.monotonic()
+            with deadline_scope(0.5), pytest.raises(
+                    (DeadlineExceeded, httpx.TimeoutException)):
+                await api.runs.get(100)
+            assert time.monotonic() - start < 0.58
+
+    stub_server.reset()
+    asyncio.run(main())
+    stub_server.reset()
+
+
+def test_coalescing(stub_server):
+    metrics = RequestMetrics()
+    api = _client(stub_server, hooks=[metrics])
+    stub_server.reset()
+    stub_server.delay('tasks', 0.2)
+    results = api.gather([lambda: api.tasks.get(10)] * 8, max_workers=8)
+    assert stub_server.count('GET', 'tasks') == 1
+    assert all(r == {'id': 10, 'name': 'movie', 'dataset_id': 1, 'TR': 1.5}
+               for r in results)
+    # Each caller gets its own copy
+    assert len({id(r) for r in results}) == 8
+    record, = [r for r in metrics.summary() if r['route'] == 'tasks/{id}']
+    assert record['count'] == 8 and record['coalesced'] == 7
+    assert 'pyns_request_coalesced_total' in metrics.to_prometheus()
+
+    # Errors are shared, and later requests are sent again
+    stub_server.delay('runs', 0.2)
+    results = api.gather([lambda: api.runs.get(999)] * 4, max_workers=4)
+    assert all(isinstance(r, HTTPError) for r in results)
+    assert stub_server.count('GET', 'runs') == 1
+    api.tasks.get(10)
+    assert stub_server.count('GET', 'tasks') == 2
+
+    # Different requests are not coalesced
+    api.gather([lambda: api.tasks.get(10), lambda: api.tasks.get(20)])
+    assert stub_server.count('GET', 'tasks') == 4
+
+    # Followers give up at their own deadline
+    def follower():
+        time.sleep(0.05)
+        with deadline_scope(0.05):
+            return api.tasks.get(10)
+
+    leader, follower = api.gather([lambda: api.tasks.get(10), follower])
+    assert leader['TR'] == 1.5
+    assert isinstance(follower, DeadlineExceeded)
+    assert stub_server.count('GET', 'tasks') == 5
+
+    api = _client(stub_server, coalesce_requests=False)
+    api.gather([lambda: api.tasks.get(10)] * 4, max_workers=4)
+    assert stub_server.count('GET', 'tasks') == 9
+    stub_server.reset()
+
+
+def test_async_coalescing(stub_server):
+    async def main():
+        async with _client(stub_server, cls=AsyncNeuroscout) as api:
+            stub_server.reset()
+            stub_server.delay('tasks', 0.2)
+            results = await asyncio.gather(
+                *[api.tasks.get(10) for _ in range(8)])
+            assert stub_server.count('GET', 'tasks') == 1
+            assert len({id(r) for r in results}) == 8
+
+            # The request completes for followers if the leader is
+            # cancelled
+            leader = asyncio.ensure_future(api.tasks.get(20))
+            await asyncio.sleep(0.05)
+            follower = asyncio.ensure_future(api.tasks.get(20))
+            await asyncio.sleep(0.05)
+            leader.cancel()
+            assert (await follower)['TR'] == 1.0
+            assert stub_server.count('GET', 'tasks') == 2
+
+            # Followers give up at their own deadline
+            async def follower():
+                await asyncio.sleep(0.05)
+                with deadline_scope(0.05):
+                    return await api.tasks.get(10)
+
+            leader, follower = await asyncio.gather(
+                api.tasks.get(10), follower(), return_exceptions=True)
+            assert leader['TR'] == 1.5
+            assert isinstance(follower, DeadlineExceeded)
+            assert stub_server.count('GET', 'tasks') == 3
+
+    asyncio.run(main())
+    stub_server.reset()